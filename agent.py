@@ -1,6 +1,54 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+
 from agents.manager_agent import ManagerAgent
 
+
+def main():
+    parser = argparse.ArgumentParser(description="Браузерный агент")
+    parser.add_argument("--batch", metavar="FILE", help="JSONL с задачами ('-' — читать из stdin)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AGENT_WORKERS", "3")),
+                        help="сколько задач выполнять одновременно")
+    parser.add_argument("--max-steps", type=int, default=None,
+                        help="предел шагов на задачу (в пакетном режиме по умолчанию AGENT_BATCH_MAX_STEPS, 30)")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="предел времени на задачу, сек (в пакетном режиме по умолчанию AGENT_BATCH_DEADLINE, 600)")
+    parser.add_argument("--output", help="файл для итогов JSONL (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if not args.batch:
+        goal = input("🎯 Задача: ")
+        agent = ManagerAgent()
+        agent.run(goal, max_steps=args.max_steps, deadline=args.deadline)
+        return
+
+    from agents.batch_runner import read_tasks, run_goals
+
+    # Без пределов одна зависшая задача держала бы поток и сессию сервера бесконечно.
+    if args.max_steps is None:
+        args.max_steps = int(os.getenv("AGENT_BATCH_MAX_STEPS", "30"))
+    if args.deadline is None:
+        args.deadline = float(os.getenv("AGENT_BATCH_DEADLINE", "600"))
+
+    if args.batch == "-":
+        tasks = read_tasks(sys.stdin)
+    else:
+        with open(args.batch, encoding="utf-8") as f:
+            tasks = read_tasks(f)
+
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        # Итоги идут в stdout (или файл), а ход работы агентов — в stderr.
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = run_goals(tasks, args.workers, args.max_steps, args.deadline, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"📊 {json.dumps(summary, ensure_ascii=False)}", file=sys.stderr)
+
+
 if __name__ == "__main__":
-    goal = input("🎯 Задача: ")
-    agent = ManagerAgent()
-    agent.run(goal)
\ No newline at end of file
+    main()
@@ -0,0 +1,98 @@
+"""
+Пакетный запуск задач: цели из JSONL выполняются параллельно в пуле потоков.
+
+Строка входа — {"goal": "...", "id": "...", "max_steps": N, "deadline": сек}
+(id, max_steps и deadline необязательны) или просто JSON-строка с целью.
+Каждая задача идёт в своей сессии MCP-сервера, то есть в своём контексте
+браузера, и сессия закрывается после задачи. Потоков не больше, чем сессий
+в пуле сервера (MCP_MAX_SESSIONS); если сессию открыть не удалось, задача
+сразу завершается со статусом session_error. Итоги пишутся строками JSONL
+по мере готовности, в порядке завершения задач.
+"""
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from agents.browser_tools import close_session, open_session, set_deadline, set_session
+
+# Размер пула сессий MCP-сервера: больше параллельных задач он не примет.
+MAX_SESSIONS = int(os.getenv("MCP_MAX_SESSIONS", "4"))
+
+
+def read_tasks(stream) -> list:
+    tasks = []
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        if isinstance(item, str):
+            item = {"goal": item}
+        if not item.get("goal"):
+            raise ValueError(f"❌ Строка {number}: нет поля goal")
+        item.setdefault("id", str(number))
+        tasks.append(item)
+    return tasks
+
+
+def run_task(task: dict, max_steps: int, deadline: float, session_prefix: str) -> dict:
+    """Выполняет одну задачу в отдельной сессии и возвращает запись для JSONL."""
+    from agents.manager_agent import ManagerAgent
+
+    session_id = f"{session_prefix}-{task['id']}"
+    set_session(session_id)
+    record = {"id": task["id"], "goal": task["goal"], "session": session_id,
+              "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    started = time.perf_counter()
+    try:
+        error = open_session()
+        if error is not None:
+            print(f"❌ Задача {task['id']}: {error}")
+            record.update(status="session_error", error=error)
+            return record
+        outcome = ManagerAgent().run(
+            task["goal"],
+            max_steps=task.get("max_steps", max_steps),
+            deadline=task.get("deadline", deadline),
+        )
+        record.update(outcome)
+    except Exception as e:
+        record.update(status="error", error=str(e))
+    finally:
+        # Закрытию сессии срок задачи не мешает.
+        set_deadline(None)
+        close_session()
+        record["wall_sec"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def run_goals(tasks: list, workers: int, max_steps: int, deadline: float, out) -> dict:
+    """
+    Выполняет задачи в workers потоках, по мере готовности пишет итоги в out.
+    Возвращает сводку: число задач, время, пропускную способность и статусы.
+    """
+    if workers > MAX_SESSIONS:
+        print(f"⚠️ Потоков {workers}, а сессий в пуле сервера {MAX_SESSIONS} (MCP_MAX_SESSIONS) — запускаю {MAX_SESSIONS}")
+        workers = MAX_SESSIONS
+    session_prefix = f"batch-{uuid.uuid4().hex[:6]}"
+    statuses = Counter()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent") as pool:
+        futures = [pool.submit(run_task, task, max_steps, deadline, session_prefix) for task in tasks]
+        for future in as_completed(futures):
+            record = future.result()
+            statuses[record["status"]] += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "tasks": len(tasks),
+        "workers": workers,
+        "wall_sec": round(elapsed, 3),
+        "tasks_per_min": round(len(tasks) / elapsed * 60, 2) if elapsed else None,
+        "statuses": dict(statuses),
+    }
@@ -1,23 +1,176 @@
+import json
+import os
+import threading
+import time
+import uuid
+
 import requests
+from requests.adapters import HTTPAdapter
 
-MCP_SERVER_URL = "http://127.0.0.1:8000/mcp" 
+from agents import tracing
+from agents.relevance import format_element
 
-def mcp_call(tool_name: str, args: dict):
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8000/mcp")
+
+# Сессия на MCP-сервере: у каждой свой контекст браузера и своя вкладка.
+MCP_SESSION = os.getenv("MCP_SESSION", "default")
+
+# Сколько ждём ответа; тот же срок уходит серверу как deadline вызова,
+# чтобы он не продолжал работу, которую клиент уже не ждёт.
+MCP_TIMEOUT = 30
+# Даже при истёкшем сроке задачи вызову даётся хотя бы столько секунд.
+MIN_CALL_TIMEOUT = 1.0
+
+# Потолок ожидания стабильности страницы и длина «тихого» окна, в секундах.
+SETTLE_TIMEOUT = float(os.getenv("SETTLE_TIMEOUT", "10"))
+SETTLE_QUIET = float(os.getenv("SETTLE_QUIET", "0.3"))
+
+# Сколько элементов в одной строке потока get_page_summary; без него сервер
+# режет поток по своему MCP_ELEMENTS_PAGE_SIZE.
+ELEMENTS_CHUNK = int(os.getenv("MCP_ELEMENTS_CHUNK", "200"))
+NDJSON_TYPE = "application/x-ndjson"
+
+# Сессия и снимок последнего getElements хранятся отдельно для каждого потока:
+# пакетный запуск гоняет несколько агентов параллельно, каждого в своей сессии.
+# click/type ссылаются на снимок, чтобы индекс указывал ровно на тот элемент,
+# который видела LLM.
+_local = threading.local()
+
+def set_session(session_id: str):
+    """Привязывает текущий поток к сессии MCP-сервера."""
+    _local.session = session_id
+    _local.snapshot_id = None
+
+def current_session() -> str:
+    return getattr(_local, "session", MCP_SESSION)
+
+def set_deadline(deadline_at):
+    """Срок задачи текущего потока по time.monotonic() (None — без срока): вызовы не ждут дольше него."""
+    _local.deadline_at = deadline_at
+
+def _timeout(limit: float = MCP_TIMEOUT) -> float:
+    deadline_at = getattr(_local, "deadline_at", None)
+    if deadline_at is None:
+        return limit
+    return max(MIN_CALL_TIMEOUT, min(limit, deadline_at - time.monotonic()))
+
+_http = None
+_http_lock = threading.Lock()
+
+def _http_session() -> requests.Session:
+    """Одна keep-alive сессия на процесс, чтобы не открывать соединение на каждый вызов."""
+    global _http
+    with _http_lock:
+        if _http is None:
+            _http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32)
+            _http.mount("http://", adapter)
+            _http.mount("https://", adapter)
+            # msgpack компактнее JSON на больших списках элементов, если пакет установлен.
+            _http.headers["Accept"] = "application/msgpack, application/json" if msgpack else "application/json"
+        return _http
+
+def _call_body(tool_name: str, args: dict, request_id: str, deadline: float = MCP_TIMEOUT) -> dict:
+    return {"tool": tool_name, "args": args, "session": current_session(), "id": request_id,
+            "deadline": deadline}
+
+def _post(payload, timeout: float):
+    """Отправляет тело на сервер; возвращает разобранный ответ или {exception}/{http_status}."""
     try:
-        resp = requests.post(
-            MCP_SERVER_URL,
-            json={"tool": tool_name, "args": args},
-            timeout=30
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            if "error" in data:
-                return f"Ошибка: {data['error']}"
-            return data.get("result", "OK")
-        else:
-            return f"Ошибка HTTP {resp.status_code}"
+        resp = _http_session().post(MCP_SERVER_URL, json=payload, timeout=timeout)
+        if resp.status_code != 200:
+            return {"http_status": resp.status_code}
+        if msgpack is not None and resp.headers.get("Content-Type", "").startswith("application/msgpack"):
+            return msgpack.unpackb(resp.content, raw=False)
+        return resp.json()
+    except Exception as e:
+        return {"exception": str(e)}
+
+def _post_stream(payload, timeout: float):
+    """
+    Отправляет вызов с Accept: application/x-ndjson и отдаёт строки ответа по мере прихода.
+    Если сервер ответил обычным JSON, он отдаётся одной строкой.
+    """
+    try:
+        with _http_session().post(MCP_SERVER_URL, json=payload, timeout=timeout, stream=True,
+                                  headers={"Accept": NDJSON_TYPE}) as resp:
+            if resp.status_code != 200:
+                yield {"http_status": resp.status_code}
+                return
+            if not resp.headers.get("Content-Type", "").startswith(NDJSON_TYPE):
+                yield resp.json()
+                return
+            for raw in resp.iter_lines():
+                if raw:
+                    yield _check_id(json.loads(raw), payload["id"])
     except Exception as e:
-        return f"Исключение: {str(e)}"
+        yield {"exception": str(e)}
+
+def _check_id(data: dict, request_id: str) -> dict:
+    if "id" in data and data["id"] != request_id:
+        return {"error": f"Ответ на чужой запрос {data.get('id')}"}
+    return data
+
+def _is_ok(data: dict) -> bool:
+    return not any(key in data for key in ("error", "exception", "http_status"))
+
+def _mcp_request(tool_name: str, args: dict) -> dict:
+    """Отправляет вызов на MCP-сервер и возвращает ответ целиком."""
+    request_id = uuid.uuid4().hex
+    started = time.perf_counter()
+    timeout = _timeout()
+    data = _check_id(_post(_call_body(tool_name, args, request_id, timeout), timeout), request_id)
+    if tracing.enabled():
+        tracing.record_tool(
+            tool_name,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            server_ms=data.get("server_ms"),
+            ok=_is_ok(data),
+        )
+    return data
+
+def mcp_pipeline(calls: list) -> list:
+    """
+    Отправляет несколько вызовов [(tool, args), ...] одним запросом.
+    Сервер выполняет их по порядку, ответы приходят в том же порядке;
+    ошибка одного вызова не отменяет остальные.
+    """
+    request_ids = [uuid.uuid4().hex for _ in calls]
+    started = time.perf_counter()
+    timeout = _timeout(MCP_TIMEOUT * len(calls))
+    data = _post([_call_body(tool, args, request_id, timeout) for (tool, args), request_id in zip(calls, request_ids)],
+                 timeout)
+    if isinstance(data, list) and len(data) == len(calls):
+        results = [_check_id(item, request_id) for item, request_id in zip(data, request_ids)]
+    else:
+        # Сбой связи или неожиданный ответ — одна и та же ошибка для всех вызовов.
+        results = [data if isinstance(data, dict) else {"error": "Неожиданный ответ сервера"}] * len(calls)
+    if tracing.enabled():
+        tracing.record_tool(
+            "+".join(tool for tool, _ in calls),
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            server_ms=sum(item.get("server_ms") or 0 for item in results),
+            ok=all(_is_ok(item) for item in results),
+        )
+    return results
+
+def _unwrap(data: dict):
+    """Превращает ответ сервера в результат или строку с ошибкой."""
+    if "exception" in data:
+        return f"Исключение: {data['exception']}"
+    if "http_status" in data:
+        return f"Ошибка HTTP {data['http_status']}"
+    if "error" in data:
+        return f"Ошибка: {data['error']}"
+    return data.get("result", "OK")
+
+def mcp_call(tool_name: str, args: dict):
+    return _unwrap(_mcp_request(tool_name, args))
 
 def summarize_elements(elements):
     if not elements:
@@ -36,30 +189,184 @@ def wait_for_page_ready(timeout=15):
     - исчезнет индикатор загрузки,
     - появится хотя бы один интерактивный элемент.
     """
-    try:
-        resp = requests.post("http://127.0.0.1:8000/mcp", json={
-            "tool": "wait_for_page_ready",
-            "args": {"timeout": timeout * 1000}
-        }, timeout=timeout + 2)
-        return resp.json().get("result", "OK")
-    except Exception as e:
-        return f"Таймаут ожидания страницы: {e}"
+    started = time.perf_counter()
+    data = _post(_call_body("wait_for_page_ready", {"timeout": timeout * 1000}, uuid.uuid4().hex, timeout),
+                 timeout + 2)
+    if "exception" in data:
+        result = f"Таймаут ожидания страницы: {data['exception']}"
+    elif "result" not in data:
+        result = f"Таймаут ожидания страницы: {data.get('error') or _unwrap(data)}"
+    else:
+        result = data["result"]
+    if tracing.enabled():
+        tracing.record_tool("wait_for_page_ready", latency_ms=round((time.perf_counter() - started) * 1000, 1),
+                            server_ms=data.get("server_ms"), ok="result" in data)
+    return result
+
+def wait_for_stable(timeout: float = SETTLE_TIMEOUT, quiet: float = SETTLE_QUIET) -> str:
+    """
+    Ждёт, пока страница успокоится: затихнет сеть, перестанет меняться DOM
+    и закончатся навигации. Возвращается сразу, как только это произошло.
+    """
+    return mcp_call("wait_for_stable", {"timeout": int(timeout * 1000), "quiet": int(quiet * 1000)})
 
 # --- Публичные функции для агента ---
 def navigate(url: str) -> str:
     return mcp_call("navigate", {"url": url})
 
+def prefetch(urls: list) -> str:
+    """
+    Просит сервер загрузить адреса в фоновых вкладках, пока агент думает.
+    navigate на один из них подменит вкладку уже загруженной, остальные закроются.
+    """
+    data = _mcp_request("prefetch", {"urls": urls})
+    if "started" in data:
+        return f"в фоне {len(data['started'])}, пропущено {len(data['skipped'])}"
+    return _unwrap(data)
+
+def discard_prefetch() -> str:
+    return mcp_call("discard_prefetch", {})
+
+def _with_snapshot(args: dict) -> dict:
+    snapshot_id = get_snapshot_id()
+    if snapshot_id is not None:
+        args["snapshot_id"] = snapshot_id
+    return args
+
 def click_element(index: int) -> str:
-    return mcp_call("click", {"index": index})
+    return mcp_call("click", _with_snapshot({"index": index}))
 
 def type_text(index: int, text: str) -> str:
-    return mcp_call("type", {"index": index, "text": text})
+    return mcp_call("type", _with_snapshot({"index": index, "text": text}))
+
+def run_batch(actions: list) -> list:
+    """
+    Выполняет список действий {action, args} одним запросом против текущего снимка.
+    Возвращает результаты выполненных действий; на первой ошибке сервер останавливается,
+    и последний элемент списка содержит поле error.
+    """
+    data = _mcp_request("batch", _with_snapshot({"actions": actions}))
+    if isinstance(data.get("result"), list):
+        return data["result"]
+    return [{"action": "BATCH", "error": _unwrap(data)}]
+
+def get_page_summary(on_chunk=None, chunk: int = ELEMENTS_CHUNK, geometry: bool = False, details: bool = False):
+    """
+    URL и элементы страницы потоком NDJSON: сервер сначала отдаёт видимые элементы,
+    и on_chunk(строки сводки) вызывается для каждого куска, пока остальные ещё
+    извлекаются. Возвращает (url, полный список в порядке индексов), как get_page_state.
+    Если поток оборвался или сервер его не умеет, берётся обычный get_page_state.
+    """
+    request_id = uuid.uuid4().hex
+    started = time.perf_counter()
+    args = {"chunk": chunk}
+    if geometry:
+        args["geometry"] = True
+    if details:
+        args["details"] = True
+    elements, total, url = {}, None, None
+    timeout = _timeout()
+    for data in _post_stream(_call_body("getElements", args, request_id, timeout), timeout):
+        if data.get("done"):
+            url = data.get("url")
+            break
+        if "offset" not in data:
+            print(f"⚠️ Поток элементов недоступен: {_unwrap(data)}")
+            break
+        _local.snapshot_id = data["snapshot_id"]
+        total = data["total"]
+        chunk_indexes = [el.pop("index") for el in data["result"]]
+        elements.update(zip(chunk_indexes, data["result"]))
+        if on_chunk is not None:
+            on_chunk([format_element(i, el) for i, el in zip(chunk_indexes, data["result"])])
+    ok = url is not None and len(elements) == total
+    if tracing.enabled():
+        tracing.record_tool("getElements_stream", latency_ms=round((time.perf_counter() - started) * 1000, 1),
+                            server_ms=None, ok=ok)
+
+    if not ok:
+        url, elements, _ = get_page_state(geometry=geometry, details=details)
+    else:
+        elements = [elements[i] for i in range(total)]
+    print(f"🔍 Элементов на странице: {len(elements)}")
+    return url, elements
+
+def apply_delta(previous: list, delta: dict) -> list:
+    """Собирает полный список элементов из прошлого списка и диффа сервера."""
+    elements = [None] * delta["count"]
+    for new_start, old_start, length in delta["unchanged"]:
+        elements[new_start:new_start + length] = previous[old_start:old_start + length]
+    for el in delta["added"] + delta["changed"]:
+        elements[el["index"]] = {k: v for k, v in el.items() if k not in ("index", "id")}
+    for el in delta.get("moved", []):
+        # Неизменившийся элемент с новым положением: копия из прошлого списка не трогается.
+        elements[el["index"]] = dict(elements[el["index"]], **{k: v for k, v in el.items() if k != "index"})
+    return elements
+
+def decode_columns(block: dict) -> list:
+    """Обратное к encoding.encode_columns на сервере: столбцы → список словарей."""
+    columns = block["columns"]
+    return [
+        {key: values[i] for key, values in columns.items() if values[i] is not None}
+        for i in range(block["count"])
+    ]
+
+def _read_elements(data: dict, previous: list = None):
+    """Разбирает ответ getElements: (полный список элементов, дифф или None)."""
+    _local.snapshot_id = data.get("snapshot_id")
+    result = _unwrap(data)
+    if data.get("format") == "columns" and isinstance(result, dict):
+        if data.get("diff"):
+            result = dict(result, added=decode_columns(result["added"]), changed=decode_columns(result["changed"]))
+            if "moved" in result:
+                result["moved"] = decode_columns(result["moved"])
+        else:
+            result = decode_columns(result)
+    if data.get("diff"):
+        return apply_delta(previous, result), result
+    return (result if isinstance(result, list) else []), None
+
+def _elements_args(previous, since, geometry, details) -> dict:
+    args = {"since": since} if since is not None and previous is not None else {}
+    args["format"] = "columns"
+    if geometry:
+        args["geometry"] = True
+    if details:
+        args["details"] = True
+    return args
 
-def get_page_summary() -> list:
-    result = mcp_call("getElements", {})
-    print("result: ", len(result), type(result))
-    print("result: ", result)
-    return result if isinstance(result, list) else []
+def get_page_update(previous: list = None, since: int = None, geometry: bool = False, details: bool = False):
+    """
+    getElements с диффом к снимку since (его список элементов — previous).
+    geometry=True просит у сервера положение элементов (y, in_viewport),
+    details=True — их атрибуты (attrs) для отпечатков траекторий.
+    Возвращает (полный список элементов, дифф или None, если сервер прислал весь список).
+    """
+    return _read_elements(_mcp_request("getElements", _elements_args(previous, since, geometry, details)), previous)
+
+def get_page_state(previous: list = None, since: int = None, geometry: bool = False, details: bool = False):
+    """
+    URL и элементы страницы одним запросом (get_url и getElements конвейером).
+    Возвращает (url, полный список элементов, дифф или None).
+    """
+    url_data, elements_data = mcp_pipeline([
+        ("get_url", {}),
+        ("getElements", _elements_args(previous, since, geometry, details)),
+    ])
+    elements, delta = _read_elements(elements_data, previous)
+    return _unwrap(url_data), elements, delta
+
+def get_snapshot_id():
+    return getattr(_local, "snapshot_id", None)
 
 def get_current_url() -> str:
-    return mcp_call("get_url", {})
\ No newline at end of file
+    return mcp_call("get_url", {})
+
+def open_session():
+    """Открывает сессию текущего потока на сервере. Возвращает None или текст ошибки (например, пул заполнен)."""
+    data = _mcp_request("get_url", {})
+    return None if _is_ok(data) else _unwrap(data)
+
+def close_session() -> str:
+    """Закрывает сессию текущего потока на сервере (основную закрыть нельзя)."""
+    return mcp_call("close_session", {})
\ No newline at end of file
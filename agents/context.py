@@ -0,0 +1,98 @@
+"""
+Сборка промпта менеджера в пределах бюджета токенов.
+
+- последние recent_steps шагов истории идут дословно;
+- более ранние сжимаются в сводку: подряд идущие одинаковые шаги схлопываются
+  с числом повторов, отдельно перечисляются повторявшиеся действия, а при
+  нехватке места первыми выпадают самые старые удачные шаги — ошибки держатся
+  дольше всех, чтобы агент их не повторял;
+- список элементов получает то, что осталось от бюджета после шаблона,
+  цели, URL и истории (не меньше min_element_tokens).
+"""
+from collections import Counter
+
+from agents.tokens import count_tokens
+
+ERROR_MARKERS = ("⛔", "Ошибка", "Исключение")
+
+
+def is_error_step(step: str) -> bool:
+    return any(marker in step for marker in ERROR_MARKERS)
+
+
+def summarize_history(steps: list, budget_tokens: int, all_steps: list = None) -> str:
+    """Сжатая сводка шагов steps не длиннее budget_tokens."""
+    if not steps:
+        return ""
+
+    runs = []
+    for step in steps:
+        if runs and runs[-1][0] == step:
+            runs[-1][1] += 1
+        else:
+            runs.append([step, 1])
+    lines = [f"{step} (×{count})" if count > 1 else step for step, count in runs]
+
+    header = []
+    repeated = [(step, n) for step, n in Counter(all_steps or steps).most_common(3) if n > 1]
+    if repeated:
+        header.append("Повторялись: " + "; ".join(f"«{step}» ×{n}" for step, n in repeated))
+
+    costs = [count_tokens(line) + 1 for line in lines]
+    budget = budget_tokens - sum(count_tokens(line) + 1 for line in header)
+    kept = list(range(len(lines)))
+    total = sum(costs)
+    # Сначала выбрасываем старые удачные шаги, потом старые ошибки.
+    for errors_too in (False, True):
+        for i in list(kept):
+            if total <= budget:
+                break
+            if errors_too or not is_error_step(lines[i]):
+                kept.remove(i)
+                total -= costs[i]
+
+    dropped = len(lines) - len(kept)
+    body = [lines[i] for i in kept]
+    if dropped:
+        body.insert(0, f"… ещё {dropped} ранних записей опущено")
+    return "\n".join(header + ["Ранее:"] + body)
+
+
+class ContextAssembler:
+    def __init__(self, template: str, budget: int, recent_steps: int = 5,
+                 history_budget: int = 600, min_element_tokens: int = 500):
+        self.template = template
+        self.budget = budget
+        self.recent_steps = recent_steps
+        self.history_budget = history_budget
+        self.min_element_tokens = min_element_tokens
+        # Список элементов может входить в шаблон несколько раз.
+        self._element_slots = max(1, template.count("{page_summary}"))
+
+    def history_section(self, history: list) -> str:
+        if not history:
+            return ""
+        recent = history[-self.recent_steps:] if self.recent_steps else []
+        older = history[:len(history) - len(recent)]
+        parts = []
+        if older:
+            recent_cost = sum(count_tokens(step) + 1 for step in recent)
+            parts.append(summarize_history(older, max(0, self.history_budget - recent_cost), history))
+        if recent:
+            parts.append("Последние шаги:\n" + "\n".join(recent))
+        return "\n".join(parts)
+
+    def element_budget(self, goal: str, current_url: str, history: list) -> int:
+        """Сколько токенов можно отдать списку элементов (на одно его вхождение в шаблон)."""
+        fixed = count_tokens(self.template.format(
+            goal=goal, current_url=current_url, history=self.history_section(history), page_summary=""
+        ))
+        return max(self.min_element_tokens, (self.budget - fixed) // self._element_slots)
+
+    def build(self, goal: str, current_url: str, history: list, page_summary: str) -> str:
+        return self.template.format(
+            goal=goal,
+            current_url=current_url,
+            history=self.history_section(history),
+            page_summary=page_summary,
+        )
@@ -1,6 +1,8 @@
 import os
-import json
-import requests
+from agents.llm_client import LLMClient
+from agents.ranker import OptionRanker
+from agents.schemas import repair_choice
+from agents.relevance import summarize_relevant
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,75 +15,102 @@ class ExecutorAgent:
         
         if not self.api_key or not self.base_url:
             raise ValueError("❌ Отсутствуют LITELLM_API_KEY или LITELLM_BASE_URL в .env")
+        self.llm = LLMClient(self.base_url, self.api_key, self.model, temperature=0.0, max_attempts=2,
+                             role="executor")
+        # Порог уверенности локального выбора; значение > 1 отключает быстрый путь.
+        self.ranker = OptionRanker(float(os.getenv("EXECUTOR_FASTPATH_THRESHOLD", "0.75")))
+        self.stats = {"calls": 0, "fastpath": 0, "llm": 0}
+        self.element_budget = int(os.getenv("EXECUTOR_ELEMENT_BUDGET", "400"))
         
         with open("prompts/executor.txt", encoding="utf-8") as f:
             self.prompt_template = f.read()
 
-    def choose_best_action(self, options: list, goal: str, current_url: str, page_summary: str) -> int:
+    def choose_best_action(self, options: list, goal: str, current_url: str, page_summary: str,
+                           elements: list = None, before_llm=None) -> int:
         """
         Выбирает индекс лучшего действия из списка.
+        Сначала пробует локальный ранжировщик и обращается к LLM, только если он не уверен.
+        before_llm() вызывается прямо перед запросом к LLM — например, чтобы загружать
+        страницы вариантов, пока LLM думает; при мгновенном выборе он не вызывается.
         Возвращает int или None при ошибке.
         """
         if len(options) == 1:
             return 0
 
+        self.stats["calls"] += 1
+        decision = self.ranker.pick(options, goal, current_url, elements or [])
+        if decision is not None:
+            idx, confidence, reason = decision
+            self.stats["fastpath"] += 1
+            print(f"⚡ Локальный выбор варианта {idx} (уверенность {confidence:.2f}): {reason}")
+            return idx
+        self.stats["llm"] += 1
+        if before_llm is not None:
+            before_llm()
+
+        elements = elements or []
         options_text = "\n".join(
-            f"{i}. [{opt.get('action', 'UNKNOWN')}] {self._describe_option(opt)}"
+            f"{i}. [{opt.get('action', 'UNKNOWN')}] {self._describe_option(opt, elements)}"
             for i, opt in enumerate(options)
         )
 
+        # Исполнителю показываем элементы, к которым относятся варианты и цель,
+        # а не первые 300 символов списка. Цели вариантов попадают в выборку всегда.
+        if elements:
+            query = " ".join([goal] + [self._describe_option(opt, elements) for opt in options])
+            targets = [i for opt in options for i in self._target_indexes(opt)]
+            page_summary = summarize_relevant(elements, query, self.element_budget, required=targets)
+        else:
+            page_summary = page_summary[:300]
+
         prompt = self.prompt_template.format(
             goal=goal,
             current_url=current_url,
-            page_summary=page_summary[:300],
+            page_summary=page_summary,
             options=options_text
         )
 
-        for attempt in range(1, 3):
-            try:
-                resp = requests.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.0
-                    },
-                    timeout=300
-                )
-                if resp.status_code == 200:
-                    content = resp.json()["choices"][0]["message"]["content"].strip()
-                    start = content.find("{")
-                    end = content.rfind("}") + 1
-                    if start != -1 and end > start:
-                        try:
-                            data = json.loads(content[start:end])
-                            idx = data.get("chosen_index")
-                            if isinstance(idx, int) and 0 <= idx < len(options):
-                                reason = data.get("reason", "")
-                                print(f"✅ Исполнитель выбрал вариант {idx}: {reason}")
-                                return idx
-                        except json.JSONDecodeError:
-                            pass
-            except Exception as e:
-                print(f"⚠️ Ошибка при выборе действия (попытка {attempt}): {e}")
-            if attempt < 2:
-                continue
+        data, _ = self.llm.complete_json(prompt, repair=lambda data: repair_choice(data, len(options)))
+        if data is not None:
+            idx = data["chosen_index"]
+            reason = data.get("reason", "")
+            print(f"✅ Исполнитель выбрал вариант {idx}: {reason}")
+            return idx
 
         print("⚠️ Не удалось выбрать действие — использую первый вариант")
         return 0
 
-    def _describe_option(self, opt: dict) -> str:
+    def saved_calls_summary(self) -> str:
+        return (f"⚡ Исполнитель: сэкономлено {self.stats['fastpath']} из "
+                f"{self.stats['calls']} вызовов LLM")
+
+    def _target_indexes(self, opt: dict) -> list:
+        """Номера элементов, на которые указывает вариант (для BATCH — все шаги)."""
+        args = opt.get("args", {})
+        if opt.get("action") == "BATCH":
+            return [i for step in args.get("actions", []) for i in self._target_indexes(step)]
+        index = args.get("index")
+        return [index] if isinstance(index, int) and not isinstance(index, bool) else []
+
+    def _describe_target(self, args: dict, elements: list) -> str:
+        index = args.get("index")
+        if isinstance(index, int) and 0 <= index < len(elements):
+            el = elements[index]
+            text = str(el.get("text", "")).replace("\n", " ").strip()
+            return f"элемент {index} ({el.get('tag') or el.get('type', '')} '{text}')"
+        return f"элемент {index}"
+
+    def _describe_option(self, opt: dict, elements: list = ()) -> str:
         action = opt.get("action", "")
         args = opt.get("args", {})
         if action == "TYPE":
-            return f"Ввести текст '{args.get('text', '')}' в элемент с селектором '{args.get('query', '')}'"
+            return f"Ввести текст '{args.get('text', '')}' в {self._describe_target(args, elements)}"
         elif action == "CLICK":
-            return f"Кликнуть по элементу с селектором '{args.get('query', '')}'"
+            return f"Кликнуть по: {self._describe_target(args, elements)}"
         elif action == "NAVIGATE":
             return f"Перейти по URL: {args.get('url', '')}"
+        elif action == "BATCH":
+            steps = "; ".join(self._describe_option(step, elements) for step in args.get("actions", []))
+            return f"Выполнить подряд: {steps}"
         else:
             return f"Выполнить действие {action} с аргументами: {args}"
\ No newline at end of file
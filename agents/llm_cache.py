@@ -0,0 +1,115 @@
+"""
+Дисковый кэш ответов LLM на SQLite.
+
+Ключ — sha256 от имени модели и нормализованного текста промпта (пробелы
+схлопнуты), поэтому одинаковые состояния (цель, URL, элементы, история)
+не требуют повторного похода в LLM. Вытеснение: по TTL и по LRU при
+превышении max_entries; ответ, который привёл к ошибке или холостому шагу,
+агент удаляет сам (delete). Ответы, полученные с temperature > 0, по
+умолчанию не кэшируются: повтор запроса может дать другой, лучший ответ.
+
+Переменные окружения:
+    LLM_CACHE=0               — отключить кэш
+    LLM_CACHE_PATH            — файл базы (по умолчанию .cache/llm_cache.sqlite)
+    LLM_CACHE_MAX_ENTRIES     — сколько ответов хранить (5000)
+    LLM_CACHE_TTL_SEC         — срок жизни ответа (7 дней)
+    LLM_CACHE_SAMPLED=1       — кэшировать и ответы с temperature > 0
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class LLMCache:
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str):
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, model: str, prompt: str, response: dict):
+        key = self.make_key(model, prompt)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def delete(self, model: str, prompt: str) -> bool:
+        """Удаляет ответ на prompt; True, если он был в кэше."""
+        key = self.make_key(model, prompt)
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+            self._db.commit()
+        return deleted > 0
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"💾 Кэш LLM: попаданий {self.hits}, промахов {self.misses} ({rate:.0f}%)"
+
+
+def get_cache():
+    """Общий кэш процесса или None, если он отключён через LLM_CACHE=0."""
+    global _cache
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite"),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+                ttl=float(os.getenv("LLM_CACHE_TTL_SEC", str(7 * 24 * 3600))),
+            )
+        return _cache
@@ -0,0 +1,356 @@
+"""
+Общий клиент LLM для менеджера и исполнителя.
+
+- один пул keep-alive соединений на процесс;
+- потоковый ответ (stream=True), чтение обрывается, как только из текста
+  собран полный JSON-объект — длинную «преамбулу» reasoning-модели не ждём;
+- повторы с экспоненциальной задержкой со случайным разбросом;
+- JSON mode (response_format), если эндпоинт его поддерживает; ответ с мелкими
+  огрехами (висячая запятая, "2" вместо 2) чинится локально по схеме
+  (agents/schemas.py), а не запрашивается заново;
+- с LLM_ENDPOINTS запрос идёт через LLMRouter: запасные эндпоинты,
+  дублирование медленных запросов и учёт здоровья (см. llm_router.py).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from agents import tracing
+from agents.llm_cache import get_cache
+from agents.llm_router import get_endpoint, router_from_env
+from agents.schemas import parse_lenient
+from agents.tokens import count_tokens
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Общая для всех агентов сессия requests с пулом соединений."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+class JsonObjectScanner:
+    """
+    Принимает текст по кускам и возвращает первый полный JSON-объект, который
+    принимает accept(dict) -> bool. Скобки внутри строк не считаются; блок
+    <think>...</think> пропускается. Отвергнутый объект (например, фрагмент
+    {"index": 3}, процитированный в рассуждении) пропускается целиком, и поиск
+    идёт дальше.
+    """
+
+    def __init__(self, accept=None):
+        self.accept = accept
+        self.buffer = ""
+        self._start = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._think_checked = False
+
+    def feed(self, chunk: str):
+        self.buffer += chunk
+        if not self._think_checked:
+            stripped = self.buffer.lstrip()
+            if "<think>".startswith(stripped):
+                return None
+            if stripped.startswith("<think>"):
+                end = self.buffer.find("</think>")
+                if end == -1:
+                    return None
+                self._pos = end + len("</think>")
+            self._think_checked = True
+        return self._scan()
+
+    def _scan(self):
+        text = self.buffer
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if self._start is None:
+                if ch == "{":
+                    self._start, self._depth = self._pos, 1
+                    self._in_string = self._escape = False
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = text[self._start:self._pos + 1]
+                    try:
+                        value = json.loads(candidate)
+                    except json.JSONDecodeError:
+                        value = None
+                    if isinstance(value, dict):
+                        if self.accept is None or self.accept(value):
+                            return value
+                        # Негодный объект пропускаем вместе со вложенными.
+                        self._start = None
+                        self._pos += 1
+                        continue
+                    # Не JSON (например, фигурные скобки в рассуждении) — ищем дальше.
+                    self._pos = self._start
+                    self._start = None
+            self._pos += 1
+        return None
+
+
+def extract_json(text: str, accept=None):
+    """Первый полный JSON-объект из готового текста (годный для accept) или None."""
+    return JsonObjectScanner(accept).feed(text)
+
+
+class LLMClient:
+    def __init__(self, base_url: str, api_key: str, model: str, temperature: float,
+                 timeout: float = 300, max_attempts: int = 3, backoff: float = 1.0, max_backoff: float = 10.0,
+                 role: str = "llm"):
+        self.base_url = base_url.strip()
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+        self.timeout = timeout
+        # Срок задачи по time.monotonic(): запросы и повторы не выходят за него (None — без срока).
+        self.deadline_at = None
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Роль агента в трассировке: manager, executor.
+        self.role = role
+        self.endpoint = get_endpoint("primary", self.base_url, api_key, model)
+        self.router = router_from_env(self.base_url, api_key, model, role)
+        self._route = {}
+        # LLM_JSON_MODE=0 — не просить response_format даже у эндпоинтов, которые его понимают.
+        self.json_mode = os.getenv("LLM_JSON_MODE", "1") != "0"
+
+    def complete_json(self, prompt: str, validate=None, temperature: float = None, use_cache: bool = None,
+                      repair=None):
+        """
+        Запрашивает ответ и возвращает (dict, текст ответа).
+        repair(dict) -> (dict или None, проблемы) приводит ответ к схеме (agents/schemas.py);
+        None — ответ не починить, нужен новый запрос.
+        validate(dict) -> bool отсеивает синтаксически верные, но негодные ответы.
+        Удачные ответы кладутся в дисковый кэш; use_cache=False обходит его. По умолчанию
+        кэш используется только при temperature 0 (LLM_CACHE_SAMPLED=1 — при любой).
+        После всех неудачных попыток возвращает (None, последний текст).
+        """
+        accepted = {}
+        repaired = set()
+
+        def accept(data, report: bool = False):
+            """
+            Ответ после починки или None, если он негоден. Каждый объект проверяется
+            один раз (его видят и чтение потока, и роутер, и цикл попыток); report —
+            напечатать итог проверки.
+            """
+            if id(data) not in accepted:
+                fixed, note = data, None
+                if repair is not None:
+                    fixed, problems = repair(data)
+                    if fixed is None:
+                        note = f"❌ Ответ не соответствует схеме: {'; '.join(problems)}"
+                    elif problems or any(fixed.get(key) != value for key, value in data.items()):
+                        repaired.add(id(data))
+                        note = f"🩹 Ответ починен локально{': ' + '; '.join(problems) if problems else ''}"
+                if fixed is not None and validate is not None and not validate(fixed):
+                    note = f"❌ JSON не прошёл проверку: {fixed}"
+                    fixed = None
+                # Ссылка на data держит id занятым, пока идут попытки.
+                accepted[id(data)] = (data, fixed, note)
+            _, fixed, note = accepted[id(data)]
+            if report and note:
+                print(note)
+            return fixed
+
+        started = time.perf_counter()
+        temperature = self.temperature if temperature is None else temperature
+        if use_cache is None:
+            use_cache = temperature == 0 or os.getenv("LLM_CACHE_SAMPLED", "0") == "1"
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(self.model, prompt)
+            cached = accept(cached) if cached is not None else None
+            if cached is not None:
+                print("💾 Ответ взят из кэша")
+                content = json.dumps(cached, ensure_ascii=False)
+                self._trace(started, prompt, content, attempts=0, ok=True, cached=True)
+                return cached, content
+
+        content = ""
+        wasted_tokens = 0
+        for attempt in range(1, self.max_attempts + 1):
+            if self.deadline_at is not None and time.monotonic() >= self.deadline_at:
+                print("🛑 Срок задачи истёк — больше не спрашиваю LLM")
+                break
+            try:
+                raw, content = self._request(prompt, temperature, lambda data: accept(data) is not None)
+                result = accept(raw, report=True) if raw is not None else None
+                if raw is None:
+                    print("❌ В ответе нет JSON-объекта")
+                if result is not None:
+                    if cache is not None:
+                        cache.put(self.model, prompt, result)
+                    self._trace(started, prompt, content, attempts=attempt, ok=True,
+                                repaired=id(raw) in repaired or extract_json(content) is None,
+                                wasted_tokens=wasted_tokens)
+                    return result, content
+                wasted_tokens += count_tokens(content)
+            except requests.HTTPError as e:
+                print(f"❌ API ошибка: {e}")
+            except Exception as e:
+                print(f"⚠️ Исключение при запросе к LLM: {e}")
+
+            if attempt < self.max_attempts:
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+                print(f"⏳ Повтор попытки {attempt + 1} через {delay:.1f} с...")
+                if self.deadline_at is not None:
+                    delay = min(delay, max(0.0, self.deadline_at - time.monotonic()))
+                time.sleep(delay)
+        self._trace(started, prompt, content, attempts=self.max_attempts, ok=False, wasted_tokens=wasted_tokens)
+        return None, content
+
+    def forget(self, prompt: str):
+        """Убирает из кэша ответ на prompt: он привёл к ошибке или холостому шагу и не должен повториться."""
+        cache = get_cache()
+        if cache is not None and cache.delete(self.model, prompt):
+            print("🗑️ Негодный ответ убран из кэша")
+
+    def _request(self, prompt: str, temperature: float, validate):
+        """Один запрос: напрямую или через роутер эндпоинтов."""
+        if self.router is None:
+            started = time.perf_counter()
+            ok = False
+            try:
+                result, content = self._stream(self.endpoint, prompt, temperature, validate=validate)
+                ok = result is not None and validate(result)
+                return result, content
+            finally:
+                self.endpoint.observe(time.perf_counter() - started, ok)
+
+        def request(endpoint, prompt, temperature, cancel):
+            return self._stream(endpoint, prompt, temperature, cancel, validate)
+
+        result, content, self._route = self.router.complete(prompt, temperature, validate, request)
+        if self._route["hedges"]:
+            print(f"🪁 Ответил {self._route['endpoint']} (дублирований: {self._route['hedges']})")
+        return result, content
+
+    def _timeout(self) -> float:
+        """Тайм-аут одного запроса: self.timeout, но не дольше остатка срока задачи."""
+        if self.deadline_at is None:
+            return self.timeout
+        return max(1.0, min(self.timeout, self.deadline_at - time.monotonic()))
+
+    def _trace(self, started: float, prompt: str, content: str, attempts: int, ok: bool, cached: bool = False,
+               repaired: bool = False, wasted_tokens: int = 0):
+        if not tracing.enabled():
+            return
+        route, self._route = self._route, {}
+        tracing.record_llm(
+            self.role,
+            model=self.model,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            attempts=attempts,
+            retries=max(0, attempts - 1),
+            ok=ok,
+            cached=cached,
+            repaired=repaired,
+            wasted_tokens=wasted_tokens,
+            prompt_chars=len(prompt),
+            prompt_tokens=count_tokens(prompt),
+            response_chars=len(content),
+            response_tokens=count_tokens(content),
+            **route,
+        )
+
+    def _stream(self, endpoint, prompt: str, temperature: float, cancel=None, validate=None):
+        """
+        Читает потоковый ответ endpoint, пока не соберётся JSON-объект, годный для
+        validate(dict) -> bool; негодные объекты (цитаты в рассуждении) не обрывают чтение.
+        cancel (threading.Event) обрывает чтение: ответ уже получен от другого эндпоинта.
+        Если целого JSON в ответе нет, он разбирается терпимо (parse_lenient).
+        """
+        payload = {
+            "model": endpoint.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "stream": True,
+        }
+        json_mode = self.json_mode and endpoint.json_mode is not False
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        resp = get_http_session().post(
+            endpoint.base_url,
+            headers={"Authorization": f"Bearer {endpoint.api_key}", "Content-Type": "application/json"},
+            json=payload,
+            timeout=self._timeout(),
+            stream=True,
+        )
+        with resp:
+            if json_mode and resp.status_code in (400, 422) and "response_format" in resp.text:
+                # Эндпоинт не знает JSON mode — запоминаем и повторяем без него.
+                print(f"⚠️ {endpoint.name} не поддерживает response_format — запрашиваю без JSON mode")
+                endpoint.json_mode = False
+            elif resp.status_code != 200:
+                raise requests.HTTPError(f"{resp.status_code} — {resp.text[:200]}")
+            else:
+                endpoint.json_mode = json_mode or endpoint.json_mode
+                return self._read(resp, cancel, validate)
+        return self._stream(endpoint, prompt, temperature, cancel, validate)
+
+    @staticmethod
+    def _finish(content: str, validate):
+        """Разбор целого ответа: годный объект, затем терпимый разбор, затем любой объект для отчёта о проверке."""
+        result = extract_json(content, validate)
+        if result is None:
+            result = parse_lenient(content, validate)
+        if result is None and validate is not None:
+            result = extract_json(content) or parse_lenient(content)
+        return result, content
+
+    def _read(self, resp, cancel, validate=None):
+        """(dict или None, текст) из ответа сервера: SSE или обычного JSON."""
+        # Сервер может проигнорировать stream и вернуть обычный ответ.
+        if resp.headers.get("Content-Type", "").startswith("application/json"):
+            return self._finish(resp.json()["choices"][0]["message"]["content"].strip(), validate)
+
+        # SSE всегда в UTF-8, а requests без charset в заголовке декодирует text/* как latin-1.
+        resp.encoding = "utf-8"
+        scanner = JsonObjectScanner(validate)
+        for line in resp.iter_lines(decode_unicode=True):
+            if cancel is not None and cancel.is_set():
+                break
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            piece = (choices[0].get("delta") or {}).get("content")
+            if not piece:
+                continue
+            result = scanner.feed(piece)
+            if result is not None:
+                # Остаток ответа не нужен — закрываем соединение, не дочитывая.
+                return result, scanner.buffer.strip()
+        return self._finish(scanner.buffer.strip(), validate)
@@ -0,0 +1,221 @@
+"""
+Маршрутизация запросов LLM по нескольким эндпоинтам с дублированием (hedging).
+
+- у каждого эндпоинта копятся задержки ответов: EWMA, окно последних значений
+  для перцентиля и число неудач подряд; после FAILURES_TO_COOLDOWN неудач
+  эндпоинт уходит на cooldown секунд в конец очереди;
+- запрос уходит на лучший эндпоинт (свободный от cooldown, с меньшей EWMA);
+  если ответа нет дольше его перцентиля задержки (hedge_percentile), тот же
+  запрос уходит на следующий эндпоинт. Побеждает первый валидный JSON,
+  остальные потоки обрываются. Ошибка или негодный ответ сразу переводят
+  запрос на следующий эндпоинт;
+- статистика общая на процесс: менеджер и исполнитель на одном эндпоинте
+  видят одни и те же задержки.
+
+Переменные окружения:
+    LLM_ENDPOINTS               — JSON-список запасных эндпоинтов:
+                                  [{"name": "backup", "base_url": "...", "api_key": "...", "model": "...",
+                                    "roles": ["manager"]}]; api_key и model по умолчанию как у агента,
+                                  roles — каким агентам доступен (по умолчанию всем)
+    LLM_HEDGE_PERCENTILE        — после какого перцентиля задержки дублировать запрос (0.9)
+    LLM_HEDGE_DELAY_SEC         — задержка дублирования, пока статистики мало (8)
+    LLM_HEDGE_MIN_DELAY_SEC     — нижняя граница задержки дублирования (0.5)
+    LLM_ENDPOINT_COOLDOWN_SEC   — на сколько убирать сбоящий эндпоинт (30)
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+EWMA_ALPHA = 0.2
+LATENCY_WINDOW = 50
+MIN_SAMPLES = 5
+FAILURES_TO_COOLDOWN = 2
+
+
+class Endpoint:
+    """Эндпоинт LLM и его здоровье: задержки, неудачи, cooldown."""
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str):
+        self.name = name
+        self.base_url = base_url.strip()
+        self.api_key = api_key
+        self.model = model
+        self.ewma = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.wins = 0
+        # Понимает ли эндпоинт response_format: None — ещё не выяснено.
+        self.json_mode = None
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float, ok, cooldown: float = 0.0):
+        """
+        Учитывает ответ за latency секунд. ok=None — запрос оборван, потому что
+        победил другой эндпоинт: задержка учитывается как нижняя оценка, без неудачи.
+        """
+        with self._lock:
+            self.requests += 1
+            self.ewma = latency if self.ewma is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma
+            self.latencies.append(latency)
+            if ok is False:
+                self.failures += 1
+                if self.failures >= FAILURES_TO_COOLDOWN:
+                    self.cooldown_until = time.monotonic() + cooldown
+            elif ok:
+                self.failures = 0
+
+    def percentile(self, q: float):
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def stats(self) -> dict:
+        p90 = self.percentile(0.9)
+        return {
+            "name": self.name, "model": self.model, "requests": self.requests, "wins": self.wins,
+            "ewma_sec": round(self.ewma, 3) if self.ewma is not None else None,
+            "p90_sec": round(p90, 3) if p90 is not None else None,
+            "failures": self.failures, "cooling": not self.available(),
+        }
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoint(name: str, base_url: str, api_key: str, model: str) -> Endpoint:
+    """Один объект Endpoint на (адрес, модель) в процессе — здоровье у всех агентов общее."""
+    key = (base_url.strip(), model)
+    with _endpoints_lock:
+        if key not in _endpoints:
+            _endpoints[key] = Endpoint(name, base_url, api_key, model)
+        return _endpoints[key]
+
+
+class LLMRouter:
+    def __init__(self, endpoints: list, hedge_percentile: float = 0.9, hedge_delay: float = 8.0,
+                 min_hedge_delay: float = 0.5, cooldown: float = 30.0):
+        self.endpoints = endpoints
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.cooldown = cooldown
+
+    def ranked(self) -> list:
+        """Эндпоинты по порядку попыток: свободные от cooldown, затем по EWMA, затем как в настройках."""
+        return sorted(
+            self.endpoints,
+            key=lambda ep: (not ep.available(), ep.ewma if ep.ewma is not None else float("inf"),
+                            self.endpoints.index(ep)),
+        )
+
+    def delay_for(self, endpoint: Endpoint) -> float:
+        """Сколько ждать ответа endpoint, прежде чем дублировать запрос."""
+        observed = endpoint.percentile(self.hedge_percentile)
+        return max(self.min_hedge_delay, observed if observed is not None else self.hedge_delay)
+
+    def complete(self, prompt: str, temperature: float, validate, request):
+        """
+        request(endpoint, prompt, temperature, cancel) -> (dict или None, текст) выполняет один запрос.
+        Возвращает (dict или None, текст, сведения: endpoint, hedges). Если все эндпоинты
+        упали с исключением, пробрасывает последнее.
+        """
+        candidates = self.ranked()
+        results = queue.Queue()
+        cancel = threading.Event()
+        launched = []
+
+        def worker(endpoint):
+            started = time.perf_counter()
+            error = None
+            try:
+                result, content = request(endpoint, prompt, temperature, cancel)
+                ok = result is not None and (validate is None or validate(result))
+            except Exception as e:
+                result, content, ok, error = None, "", False, e
+            endpoint.observe(time.perf_counter() - started, None if cancel.is_set() and not ok else ok, self.cooldown)
+            results.put((endpoint, ok, result, content, error))
+
+        def launch():
+            endpoint = candidates[len(launched)]
+            launched.append(endpoint)
+            threading.Thread(target=worker, args=(endpoint,), daemon=True, name=f"llm-{endpoint.name}").start()
+            return time.perf_counter() + self.delay_for(endpoint)
+
+        hedge_at = launch()
+        pending = 1
+        last = (None, "", None)
+        while pending:
+            can_hedge = len(launched) < len(candidates)
+            try:
+                endpoint, ok, result, content, error = results.get(
+                    timeout=max(0.0, hedge_at - time.perf_counter()) if can_hedge else None
+                )
+            except queue.Empty:
+                print(f"🪁 {launched[-1].name} не ответил за {self.delay_for(launched[-1]):.1f} с — "
+                      f"дублирую запрос в {candidates[len(launched)].name}")
+                hedge_at = launch()
+                pending += 1
+                continue
+
+            pending -= 1
+            if ok:
+                cancel.set()
+                endpoint.wins += 1
+                return result, content, {"endpoint": endpoint.name, "hedges": len(launched) - 1}
+            print(f"⚠️ Эндпоинт {endpoint.name}: {error or 'негодный ответ'}")
+            last = (result, content, error)
+            if can_hedge:
+                hedge_at = launch()
+                pending += 1
+
+        result, content, error = last
+        if error is not None and not content:
+            raise error
+        return result, content, {"endpoint": None, "hedges": len(launched) - 1}
+
+    def summary(self) -> str:
+        parts = []
+        for ep in self.endpoints:
+            s = ep.stats()
+            parts.append(f"{s['name']}: {s['wins']}/{s['requests']} побед, EWMA {s['ewma_sec']} с, p90 {s['p90_sec']} с")
+        return "🪁 Эндпоинты LLM: " + "; ".join(parts)
+
+
+def router_from_env(base_url: str, api_key: str, model: str, role: str):
+    """LLMRouter из основного эндпоинта агента и LLM_ENDPOINTS или None, если запасных нет."""
+    raw = os.getenv("LLM_ENDPOINTS", "").strip()
+    if not raw:
+        return None
+    try:
+        configured = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"❌ LLM_ENDPOINTS — не JSON: {e}")
+
+    endpoints = [get_endpoint("primary", base_url, api_key, model)]
+    for i, item in enumerate(configured):
+        if item.get("roles") and role not in item["roles"]:
+            continue
+        endpoint = get_endpoint(item.get("name") or f"backup{i}", item["base_url"],
+                                item.get("api_key") or api_key, item.get("model") or model)
+        if endpoint not in endpoints:
+            endpoints.append(endpoint)
+    if len(endpoints) < 2:
+        return None
+    return LLMRouter(
+        endpoints,
+        hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9")),
+        hedge_delay=float(os.getenv("LLM_HEDGE_DELAY_SEC", "8")),
+        min_hedge_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY_SEC", "0.5")),
+        cooldown=float(os.getenv("LLM_ENDPOINT_COOLDOWN_SEC", "30")),
+    )
@@ -0,0 +1,118 @@
+"""
+Обнаружение зацикливания и холостых шагов агента.
+
+Состояние страницы — хэш URL (без #фрагмента) и нормализованного списка
+элементов (тег, тип, подпись). Для каждой пары «состояние + действие»
+запоминается, к какому состоянию она привела. Шаг считается холостым, если:
+- после действия страница не изменилась (клик, который ничего не сделал;
+  ввод текста список элементов не меняет, поэтому для TYPE это не считается);
+- то же действие из того же состояния снова привело туда же, куда и раньше
+  (цикл A → B → A → B).
+
+Известные холостые варианты убираются из плана менеджера, уже выполненные из
+этого состояния — уходят в конец списка. После max_wasted холостых шагов
+задача останавливается.
+
+Переменные окружения:
+    AGENT_MAX_WASTED_STEPS  — сколько холостых шагов допустимо (3, 0 — не останавливать)
+"""
+import hashlib
+import json
+import re
+from urllib.parse import urldefrag
+
+
+def _normalize(text) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def page_fingerprint(url: str, elements: list) -> str:
+    """Хэш состояния страницы: положение и атрибуты элементов не учитываются."""
+    digest = hashlib.sha1(urldefrag(url or "")[0].rstrip("/").encode("utf-8"))
+    for el in elements or []:
+        digest.update(b"\x00")
+        digest.update(f"{el.get('tag')}|{el.get('type')}|{_normalize(el.get('text'))[:80]}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def action_key(option: dict) -> str:
+    """Ключ действия: тип и аргументы в каноническом виде."""
+    args = option.get("args") or {}
+    if option.get("action") in ("CLICK", "TYPE") and "index" in args:
+        try:
+            args = dict(args, index=int(args["index"]))
+        except (TypeError, ValueError):
+            pass
+    return json.dumps([option.get("action"), args], ensure_ascii=False, sort_keys=True)
+
+
+class LoopGuard:
+    def __init__(self, max_wasted: int = 3):
+        self.max_wasted = max_wasted
+        self.reset()
+
+    def reset(self):
+        self._transitions = {}   # (состояние, действие) -> состояние после него
+        self._tried = {}         # (состояние, действие) -> сколько раз выполнялось
+        self._state = None
+        self._pending = None     # (состояние, действие) последнего шага
+        self.wasted = 0
+        self.skipped = 0
+        self.avoided = 0         # шаги, в которых из плана убран заведомо холостой вариант
+
+    def observe(self, state: str):
+        """
+        Запоминает текущее состояние и оценивает предыдущий шаг.
+        Возвращает "noop", "cycle" или None.
+        """
+        self._state = state
+        if self._pending is None:
+            return None
+        before, key = self._pending
+        self._pending = None
+        known = self._transitions.get((before, key))
+        self._transitions[(before, key)] = state
+        if state == before and not key.startswith('["TYPE"'):
+            verdict = "noop"
+        elif known == state:
+            verdict = "cycle"
+        else:
+            return None
+        self.wasted += 1
+        return verdict
+
+    def filter(self, options: list) -> list:
+        """
+        Убирает варианты, которые из текущего состояния ничего не меняли,
+        и отодвигает в конец уже выполнявшиеся. Если убирать пришлось бы всё,
+        оставляет реже всего пробованные варианты.
+        """
+        scored = []
+        for position, option in enumerate(options):
+            key = (self._state, action_key(option))
+            noop = self._transitions.get(key) == self._state
+            scored.append((noop, self._tried.get(key, 0), position, option))
+
+        fresh = [item for item in scored if not item[0]]
+        if not fresh:
+            least = min(item[1] for item in scored)
+            fresh = [item for item in scored if item[1] == least]
+        self.skipped += len(options) - len(fresh)
+        if any(item[0] for item in scored) and len(fresh) < len(options):
+            self.avoided += 1
+        return [option for *_, option in sorted(fresh, key=lambda item: (item[1], item[2]))]
+
+    def record(self, option: dict):
+        """Запоминает действие, выполненное из текущего состояния."""
+        if self._state is None:
+            return
+        key = (self._state, action_key(option))
+        self._tried[key] = self._tried.get(key, 0) + 1
+        self._pending = key
+
+    def exhausted(self) -> bool:
+        return self.max_wasted > 0 and self.wasted >= self.max_wasted
+
+    def summary(self) -> str:
+        return (f"🔂 Защита от зацикливания: холостых шагов {self.wasted}, "
+                f"отброшено повторных вариантов {self.skipped}")
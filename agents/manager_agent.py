@@ -1,8 +1,15 @@
 import os
-import json
 import time
-import requests
-from agents.browser_tools import navigate, click_element, type_text, get_page_summary, get_current_url, summarize_elements
+from agents import tracing
+from agents.browser_tools import navigate, click_element, type_text, get_page_state, get_snapshot_id, summarize_elements, wait_for_stable, run_batch, prefetch, discard_prefetch, set_deadline
+from agents.context import ContextAssembler
+from agents.llm_cache import get_cache
+from agents.tokens import count_tokens
+from agents.llm_client import LLMClient
+from agents.loop_guard import LoopGuard, page_fingerprint
+from agents.relevance import summarize_relevant
+from agents.schemas import repair_plan
+from agents.trajectory import TrajectoryRecorder, get_trajectory_store, replay as replay_trajectory
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -19,109 +26,85 @@ class ManagerAgent:
             raise ValueError("❌ LITELLM_BASE_URL не задан в .env")
 
         self.base_url = self.base_url.strip()
+        self.llm = LLMClient(self.base_url, self.api_key, self.model, temperature=0.3, role="manager")
+        self.elements = []
+        # Вместо полного списка элементов менеджер получает дифф к прошлому шагу,
+        # а весь список — раз в full_resync_every шагов и после смены URL.
+        self.page_diffs = os.getenv("MANAGER_PAGE_DIFF", "1") != "0"
+        self.full_resync_every = int(os.getenv("MANAGER_FULL_RESYNC_EVERY", "5"))
+        self._base_snapshot = None
+        self._state_url = None
+        self._steps_since_resync = 0
+        # Предел числа элементов в промпте; их бюджет токенов — остаток бюджета промпта.
+        self.element_top_k = int(os.getenv("MANAGER_ELEMENT_TOP_K", "150"))
+        # Удачные задачи записываются и потом повторяются без LLM (AGENT_TRAJECTORIES=1 — включить).
+        self.trajectories = get_trajectory_store()
+        self._recorder = None
+        # Промпт последнего плана: если план оказался холостым или ошибочным, его ответ убирается из кэша.
+        self._plan_prompt = None
+        # Холостые шаги и циклы по отпечаткам страницы; после AGENT_MAX_WASTED_STEPS — остановка.
+        self.loop_guard = LoopGuard(int(os.getenv("AGENT_MAX_WASTED_STEPS", "3")))
+        # Пока исполнитель выбирает, адреса вариантов NAVIGATE загружаются в фоновых вкладках.
+        self.speculative = os.getenv("AGENT_SPECULATIVE", "0") == "1"
         
         with open("prompts/manager.txt", encoding="utf-8") as f:
             self.prompt_template = f.read()
+        # Промпт собирается в пределах MANAGER_PROMPT_BUDGET токенов: последние шаги
+        # дословно, более ранние — сжатой сводкой, элементам — что осталось.
+        self.context = ContextAssembler(
+            self.prompt_template,
+            budget=int(os.getenv("MANAGER_PROMPT_BUDGET", "6000")),
+            recent_steps=int(os.getenv("MANAGER_RECENT_STEPS", "5")),
+            history_budget=int(os.getenv("MANAGER_HISTORY_BUDGET", "600")),
+        )
 
     def _ask_llm(self, prompt: str) -> dict:
         print("\n💭 [LLM ДУМАЕТ...]")
         print("-" * 50)
-        
-        for attempt in range(1, 4):
-            try:
-                resp = requests.post(
-                    self.base_url,
-                    headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json={"model": self.model, "messages": [{"role": "user", "content": prompt}], "temperature": 0.1},
-                    timeout=300
-                )
-                if resp.status_code == 200:
-                    content = resp.json()["choices"][0]["message"]["content"].strip()
-                    print(f"🧠 Ответ LLM:\n{content}\n")
-                    
-                    start = content.find("{")
-                    end = content.rfind("}") + 1
-                    if start != -1 and end > start:
-                        try:
-                            result = json.loads(content[start:end])
-                            print(f"✅ Решение: {result}")
-                            print("-" * 50)
-                            return result
-                        except json.JSONDecodeError as e:
-                            print(f"❌ Ошибка JSON: {e}")
-                else:
-                    print(f"❌ API ошибка: {resp.status_code}")
-            except Exception as e:
-                print(f"⚠️ Исключение: {e}")
-            
-            if attempt < 3:
-                print(f"⏳ Повтор попытки {attempt + 1}...")
-                time.sleep(2)
-        
-        print("🛑 Не удалось получить валидное решение от LLM.")
+
+        result, content = self.llm.complete_json(prompt, temperature=0.1)
+        print(f"🧠 Ответ LLM:\n{content}\n")
+        if result is None:
+            print("🛑 Не удалось получить валидное решение от LLM.")
+            print("-" * 50)
+            return {}
+
+        print(f"✅ Решение: {result}")
         print("-" * 50)
-        return {}
+        return result
 
     def _ask_manager(self, goal: str, current_url: str, page_summary: str, history: list) -> dict:
         """
         Запрашивает у LLM план: несколько вариантов действий или сигнал завершения.
         Возвращает словарь с ключами: thought, options (list), is_done (bool)
         """
-        prompt = self.prompt_template.format(
-            goal=goal,
-            current_url=current_url,
-            history="\n".join(history[-5:]),
-            page_summary=page_summary
-        )
+        prompt = self.context.build(goal, current_url, history, page_summary)
+        self._plan_prompt = prompt
 
-        print("\n🧠 [МЕНЕДЖЕР ДУМАЕТ...]")
+        print(f"\n🧠 [МЕНЕДЖЕР ДУМАЕТ...] (промпт ~{count_tokens(prompt)} токенов)")
         print("-" * 50)
 
-        for attempt in range(1, 4):
-            try:
-                resp = requests.post(
-                    self.base_url.strip(),
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "temperature": 0.3
-                    },
-                    timeout=300
-                )
-                if resp.status_code == 200:
-                    content = resp.json()["choices"][0]["message"]["content"].strip()
-                    print(f"🧠 Ответ менеджера:\n{content}\n")
-
-                    start = content.find("{")
-                    end = content.rfind("}") + 1
-                    if start != -1 and end > start:
-                        try:
-                            result = json.loads(content[start:end])
-                            result.setdefault("options", [])
-                            result.setdefault("is_done", False)
-                            print(f"✅ План получен: {len(result['options'])} вариантов, завершено: {result['is_done']}")
-                            print("-" * 50)
-                            return result
-                        except json.JSONDecodeError as e:
-                            print(f"❌ Ошибка парсинга JSON: {e}")
-                else:
-                    print(f"❌ API ошибка: {resp.status_code} — {resp.text[:200]}")
-            except Exception as e:
-                print(f"⚠️ Исключение при запросе к менеджеру: {e}")
+        # Индексы в вариантах сверяются с текущим списком элементов; негодные варианты отбрасываются.
+        result, content = self.llm.complete_json(prompt, repair=lambda data: repair_plan(data, len(self.elements)))
+        print(f"🧠 Ответ менеджера:\n{content}\n")
+        if result is None:
+            print("🛑 Не удалось получить валидный план от менеджера.")
+            print("-" * 50)
+            return {}
 
-            if attempt < 3:
-                print(f"⏳ Повтор попытки {attempt + 1}...")
-                time.sleep(2)
-
-        print("🛑 Не удалось получить валидный план от менеджера.")
+        print(f"✅ План получен: {len(result['options'])} вариантов, завершено: {result['is_done']}")
         print("-" * 50)
-        return {}
+        return result
 
-    def run(self, goal: str):
+    def run(self, goal: str, max_steps: int = None, deadline: float = None) -> dict:
+        """
+        Выполняет задачу не больше чем за max_steps шагов и deadline секунд
+        (оба проверяются перед каждым шагом, а остаток срока ограничивает и
+        тайм-ауты запросов к LLM и MCP-серверу внутри шага). Возвращает итог: status (done, no_plan,
+        no_options, max_steps, deadline, stalled, stopped), steps — число шагов,
+        final_result, wasted_steps — число холостых шагов и saved_steps — сколько шагов сэкономила
+        защита от зацикливания.
+        """
         from agents.executor_agent import ExecutorAgent
 
         print(f"\n🚀 НАЧИНАЮ ВЫПОЛНЕНИЕ ЗАДАЧИ: {goal}")
@@ -130,64 +113,201 @@ class ManagerAgent:
         executor = ExecutorAgent()
         history = []
         step = 0
-
+        self.elements = []
+        self._base_snapshot = None
+        self.loop_guard.reset()
+        self._plan_prompt = None
+        outcome = {"status": "stopped", "steps": 0, "final_result": None}
+        started_at = time.monotonic()
+        deadline_at = started_at + deadline if deadline else None
+        self.llm.deadline_at = executor.llm.deadline_at = deadline_at
+        set_deadline(deadline_at)
+
+        tracing.start_trace(goal)
+
+        self._recorder = TrajectoryRecorder(goal) if self.trajectories is not None else None
+        found = self.trajectories.find(goal) if self.trajectories is not None else None
+        if found is not None:
+            trajectory, params = found
+            print(f"🔁 Найдена траектория «{trajectory['goal_template']}» {params} — повторяю без LLM")
+            replayed = replay_trajectory(trajectory, params, self._recorder, history)
+            outcome["replayed_steps"] = replayed["replayed"]
+            self.trajectories.mark(trajectory, replayed["status"] == "done")
+            if replayed["status"] == "done":
+                outcome["status"] = "done"
+                outcome["final_result"] = trajectory.get("final_result") or "Задача выполнена повтором траектории"
+                print(f"\n🎉 УСПЕХ! {outcome['final_result']} (повтор траектории)")
+                return outcome
+            print(f"↩️ Траектория разошлась: {replayed['reason']}. Продолжаю с LLM.")
+
+        step_checkpoint = self._recorder.checkpoint() if self._recorder is not None else 0
         while True:
-            step += 1
-            print(f"\n🔹 ШАГ {step}")
-
-            current_url, page_summary = self._get_page_state()
-            
-            plan = self._ask_manager(goal, current_url, page_summary, history)
-            if not plan or plan.get("is_done"):
-                self._handle_completion(plan)
+            if max_steps is not None and step >= max_steps:
+                print(f"🛑 Достигнут предел шагов ({max_steps}). Остановка.")
+                outcome["status"] = "max_steps"
                 break
-
-            options = plan.get("options", [])
-            if not options:
-                print("❌ Менеджер не предложил ни одного действия. Остановка.")
-                break
-
-            result, should_continue = self._execute_step(
-                executor, options, goal, current_url, page_summary, history
-            )
-            if not should_continue:
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                print(f"🛑 Истёк срок задачи ({deadline:g} сек). Остановка.")
+                outcome["status"] = "deadline"
                 break
-
-            print(f"   → Результат: {result}")
-            print(f"\n⏳ Жду 2 секунды...")
-            time.sleep(2)
-
-
-    def _get_page_state(self):
-        """Получает текущий URL и форматированный список элементов."""
-        current_url = get_current_url()
-        raw_elements = get_page_summary()
-        page_summary = self._summarize_elements(raw_elements)
+            step += 1
+            outcome["steps"] = step
+            print(f"\n🔹 ШАГ {step}")
+            tracing.start_step(step)
+            try:
+                current_url, page_summary = self._get_page_state(goal, history)
+                tracing.annotate(url=current_url)
+
+                verdict = self.loop_guard.observe(page_fingerprint(current_url, self.elements))
+                if verdict is not None:
+                    note = "страница не изменилась" if verdict == "noop" else "повтор уже пройденного перехода"
+                    print(f"🔂 Холостой шаг ({note}): {self.loop_guard.wasted}")
+                    tracing.annotate(wasted=verdict)
+                    if history:
+                        history[-1] += f" ⛔ {note}"
+                    if verdict == "noop" and self._plan_prompt is not None:
+                        # Тот же промпт снова дал бы из кэша план, который ничего не меняет.
+                        self.llm.forget(self._plan_prompt)
+                    if verdict == "noop" and self._recorder is not None:
+                        # Холостой шаг в траекторию не попадает: при повторе он ничего не даст.
+                        self._recorder.rollback(step_checkpoint)
+                    if self.loop_guard.exhausted():
+                        print(f"🛑 Агент топчется на месте ({self.loop_guard.wasted} холостых шагов). Остановка.")
+                        outcome["status"] = "stalled"
+                        tracing.annotate(status=outcome["status"])
+                        break
+
+                plan = self._ask_manager(goal, current_url, page_summary, history)
+                if not plan or plan.get("is_done"):
+                    outcome["final_result"] = self._handle_completion(plan)
+                    outcome["status"] = "done" if plan else "no_plan"
+                    tracing.annotate(status=outcome["status"])
+                    break
+
+                options = plan.get("options", [])
+                tracing.annotate(options=len(options))
+                if not options:
+                    print("❌ Менеджер не предложил ни одного действия. Остановка.")
+                    outcome["status"] = "no_options"
+                    tracing.annotate(status=outcome["status"])
+                    break
+                options = self.loop_guard.filter(options)
+
+                step_checkpoint = self._recorder.checkpoint() if self._recorder is not None else 0
+                result, should_continue = self._execute_step(
+                    executor, options, goal, current_url, page_summary, history
+                )
+                if not should_continue:
+                    break
+
+                print(f"   → Результат: {result}")
+                print(f"\n⏳ Жду, пока страница успокоится...")
+                print(f"   → {wait_for_stable()}")
+            finally:
+                tracing.end_step()
+
+        if outcome["status"] == "done" and self._recorder is not None:
+            trajectory = self._recorder.build(outcome["final_result"])
+            if trajectory is not None:
+                self.trajectories.save(trajectory)
+                print(f"💾 Траектория сохранена: «{trajectory['goal_template']}»")
+
+        outcome["wasted_steps"] = self.loop_guard.wasted
+        # Сэкономленные шаги: шаги, где из плана убран известный холостой вариант, и при
+        # остановке — сколько шагов ещё оставалось до предела шагов или срока задачи.
+        outcome["saved_steps"] = self.loop_guard.avoided
+        if outcome["status"] == "stalled":
+            outcome["saved_steps"] += self._steps_left(step, max_steps, started_at, deadline_at)
+        print(executor.saved_calls_summary())
+        if self.llm.router is not None:
+            print(self.llm.router.summary())
+        print(self.loop_guard.summary())
+        print(f"🔂 Сэкономлено шагов: {outcome['saved_steps']}")
+        cache = get_cache()
+        if cache is not None:
+            print(cache.summary())
+        return outcome
+
+    def _get_page_state(self, goal: str = "", history: list = None):
+        """
+        Получает текущий URL и форматированный список элементов (или дифф к прошлому шагу).
+        Длинный список сокращается до элементов, релевантных цели и недавней истории.
+        """
+        # URL и элементы приходят одним запросом, поэтому о смене URL узнаём уже
+        # с ответом: если страница другая, дифф не используется и счётчик сбрасывается.
+        resync = (
+            not self.page_diffs
+            or self._base_snapshot is None
+            or self._steps_since_resync >= self.full_resync_every
+        )
+        details = self._recorder is not None
+        # Полный список тоже берётся одним конвейерным запросом в столбцовом формате:
+        # промпт строится только из всего списка, так что поток здесь ничего не перекрыл бы.
+        current_url, raw_elements, delta = get_page_state(
+            self.elements, None if resync else self._base_snapshot, geometry=True, details=details
+        )
+        if current_url != self._state_url:
+            delta = None
+        self.elements = raw_elements
+        self._base_snapshot = get_snapshot_id()
+        self._state_url = current_url
+
+        query = " ".join([goal] + (history or [])[-3:])
+        budget = self.context.element_budget(goal, current_url, history or [])
+        page_summary = self._summarize_elements(raw_elements, query, budget)
+        delta_summary = self._summarize_delta(raw_elements, delta) if delta is not None else None
+        if delta_summary is not None and len(delta_summary) < len(page_summary):
+            page_summary = delta_summary
+            self._steps_since_resync += 1
+        else:
+            self._steps_since_resync = 0
         
         print(f"🌐 Текущий URL: {current_url}")
         print(f"📄 Элементы на странице: {page_summary[:150]}...")
         return current_url, page_summary
 
 
-    def _summarize_elements(self, elements):
-        """Преобразует сырые элементы в человекочитаемую строку."""
+    def _summarize_elements(self, elements, query: str = "", budget: int = None):
+        """Преобразует сырые элементы в человекочитаемую строку в пределах бюджета токенов."""
         if not elements:
             return "Нет интерактивных элементов."
-        parts = []
-        for i, el in enumerate(elements):
-            typ = "поле" if el.get("type") == "input" else "кнопка"
-            text = str(el.get("text", "")).replace("\n", " ").strip()
-            parts.append(f"{i}: {typ} '{text}'")
-        return "; ".join(parts)
+        if budget is None:
+            budget = self.context.element_budget("", "", [])
+        return summarize_relevant(elements, query, budget, self.element_top_k)
+
+
+    def _summarize_delta(self, elements, delta):
+        """Новые и изменившиеся элементы полностью, неизменившиеся — диапазонами номеров."""
+        lines = [f"ИЗМЕНЕНИЯ с прошлого шага (всего элементов: {delta['count']}):"]
+        for prefix, key in (("+", "added"), ("~", "changed")):
+            for el in delta[key]:
+                typ = "поле" if el.get("type") == "input" else "кнопка"
+                text = str(el.get("text", "")).replace("\n", " ").strip()
+                lines.append(f"{prefix} {el['index']}: {typ} '{text}'")
+        if delta["removed"]:
+            lines.append(f"- исчезло элементов: {len(delta['removed'])}")
+
+        ranges = []
+        for start, _, length in delta["unchanged"]:
+            first = str(elements[start].get("text", "")).strip()[:30]
+            if length == 1:
+                ranges.append(f"{start} ('{first}')")
+            else:
+                ranges.append(f"{start}–{start + length - 1} ('{first}' …)")
+        if ranges:
+            total = sum(length for _, _, length in delta["unchanged"])
+            lines.append(f"Без изменений ({total}): " + "; ".join(ranges))
+        return "\n".join(lines)
 
 
     def _handle_completion(self, plan):
-        """Обрабатывает завершение задачи."""
+        """Обрабатывает завершение задачи, возвращает итоговое сообщение или None."""
         if not plan:
             print("🛑 Менеджер не вернул план. Остановка.")
-        else:
-            final_result = plan.get("final_result", "Задача успешно завершена")
-            print(f"\n🎉 УСПЕХ! {final_result}")
+            return None
+        final_result = plan.get("final_result", "Задача успешно завершена")
+        print(f"\n🎉 УСПЕХ! {final_result}")
+        return final_result
 
 
     def _execute_step(self, executor, options, goal, current_url, page_summary, history):
@@ -199,16 +319,23 @@ class ManagerAgent:
             desc = f"{action} {args}"
             print(f"  {i}: {desc}")
 
+        # Загружать варианты заранее есть смысл, только пока думает LLM исполнителя:
+        # если ранжировщик выбрал сразу, фоновые вкладки лишь заняли бы сервер.
+        prefetched = []
         chosen_index = executor.choose_best_action(
             options=options,
             goal=goal,
             current_url=current_url,
-            page_summary=page_summary
+            page_summary=page_summary,
+            elements=self.elements,
+            before_llm=lambda: prefetched.append(self._prefetch_candidates(options)),
         )
+        prefetched = any(prefetched)
 
         if chosen_index is None or chosen_index < 0 or chosen_index >= len(options):
             print("⚠️ Исполнитель не выбрал корректный вариант. Пропуск шага.")
-            time.sleep(2)
+            if prefetched:
+                discard_prefetch()
             return "Пропущено", True
 
         chosen_action = options[chosen_index]
@@ -216,28 +343,85 @@ class ManagerAgent:
         args = chosen_action.get("args", {})
 
         print(f"\n🛠️ ИСПОЛНИТЕЛЬ ВЫБРАЛ: {action} {args}")
+        tracing.annotate(action=action, chosen_index=chosen_index)
+        self.loop_guard.record(chosen_action)
 
         result = "Неизвестное действие"
         if action == "NAVIGATE":
             url = args.get("url", "").strip()
             result = navigate(url)
             history.append(f"→ перешёл на {url}")
+            self._record(action, {"url": url}, current_url, result)
 
         elif action == "CLICK":
             index = args.get("index")
             result = click_element(index)
             history.append(f"🖱️ кликнул по элементу #{index}")
-            print("⏳ Ждём загрузку после клика (4 сек)...")
-            time.sleep(4)
+            self._record(action, args, current_url, result)
 
         elif action == "TYPE":
             index = args.get("index")
             text = args.get("text", "")
             result = type_text(index, text)
             history.append(f"⌨️ ввёл '{text}' в поле #{index}")
+            self._record(action, args, current_url, result)
+
+        elif action == "BATCH":
+            actions = args.get("actions", [])
+            steps = run_batch(actions)
+            for step in steps:
+                if "error" in step:
+                    history.append(f"⛔ {step.get('action')} {step.get('args', {})}: {step['error']}")
+                else:
+                    history.append(f"📦 {step['action']} {step.get('args', {})}")
+                    self._record(step["action"], step.get("args", {}), current_url, step.get("result"))
+            done = sum(1 for step in steps if "error" not in step)
+            result = f"Пакет: выполнено {done} из {len(actions)}"
+            if steps and "error" in steps[-1]:
+                result += f", ошибка: {steps[-1]['error']}"
 
         else:
             result = f"Неизвестное действие: {action}"
             history.append(f"❓ {result}")
 
-        return result, True
\ No newline at end of file
+        # Ошибку дописываем к шагу: в сжатой истории такие шаги хранятся дольше всего.
+        failed = action == "BATCH" and steps and "error" in steps[-1]
+        if action in ("NAVIGATE", "CLICK", "TYPE") and isinstance(result, str) \
+                and result.startswith(("Ошибка", "Исключение")):
+            history[-1] += f" — {result[:200]}"
+            failed = True
+        if failed and self._plan_prompt is not None:
+            self.llm.forget(self._plan_prompt)
+
+        return result, True
+
+    @staticmethod
+    def _steps_left(step: int, max_steps, started_at: float, deadline_at) -> int:
+        """
+        Сколько шагов агент ещё сделал бы без остановки: до max_steps, а без него —
+        до срока задачи по среднему времени шага. Без обоих пределов — ни одного:
+        зацикленный агент без них шёл бы бесконечно, и честной оценки нет.
+        """
+        if max_steps is not None:
+            return max(0, max_steps - step)
+        if deadline_at is not None and step:
+            per_step = (time.monotonic() - started_at) / step
+            return int(max(0.0, deadline_at - time.monotonic()) / per_step) if per_step > 0 else 0
+        return 0
+
+    def _prefetch_candidates(self, options) -> bool:
+        """В спекулятивном режиме начинает загружать адреса вариантов NAVIGATE, пока решает исполнитель."""
+        if not self.speculative or len(options) < 2:
+            return False
+        urls = [str(opt.get("args", {}).get("url", "")).strip() for opt in options if opt.get("action") == "NAVIGATE"]
+        urls = [url for url in urls if url.startswith(("http://", "https://"))]
+        if not urls:
+            return False
+        print(f"🔮 Загружаю варианты перехода заранее: {prefetch(urls)}")
+        return True
+
+    def _record(self, action, args, current_url, result):
+        """Запоминает удачное действие для траектории задачи."""
+        failed = isinstance(result, str) and result.startswith(("Ошибка", "Исключение"))
+        if self._recorder is not None and not failed:
+            self._recorder.add(action, args, current_url, self.elements)
@@ -0,0 +1,110 @@
+"""
+Локальный ранжировщик вариантов менеджера.
+
+Если выбор очевиден (варианты дублируют друг друга или один явно совпадает
+с целью по словам), исполнителю не нужен отдельный вызов LLM. Априорный вес
+действия (ACTION_PRIORS) только добавляется к совпадению: вариант, ни одним
+словом не совпавший с целью, локально не выбирается.
+"""
+import json
+import math
+import re
+
+# Насколько каждое действие само по себе вероятнее продвигает задачу.
+ACTION_PRIORS = {"BATCH": 0.25, "TYPE": 0.2, "CLICK": 0.1, "NAVIGATE": 0.0}
+
+# Штраф за вариант, который заведомо не выполнится.
+INVALID_PENALTY = -1.0
+
+# Русские слова сильно меняют окончания, поэтому сравниваем по началу слова.
+STEM_LENGTH = 5
+
+
+def tokenize(text: str) -> set:
+    words = re.findall(r"\w+", str(text).lower())
+    return {w[:STEM_LENGTH] for w in words if len(w) > 1}
+
+
+def lexical_overlap(goal_tokens: set, text: str) -> float:
+    """Косинусная близость множеств слов цели и текста, от 0 до 1."""
+    tokens = tokenize(text)
+    if not goal_tokens or not tokens:
+        return 0.0
+    return len(goal_tokens & tokens) / math.sqrt(len(goal_tokens) * len(tokens))
+
+
+def option_key(option: dict) -> str:
+    return json.dumps(
+        {"action": option.get("action"), "args": option.get("args", {})},
+        sort_keys=True, ensure_ascii=False
+    )
+
+
+class OptionRanker:
+    def __init__(self, threshold: float, temperature: float = 0.15):
+        self.threshold = threshold
+        self.temperature = temperature
+
+    def score(self, option: dict, goal_tokens: set, current_url: str, elements: list):
+        """
+        Возвращает (оценка, совпадение с целью). Оценка — априорный вес действия
+        плюс совпадение; совпадение — только лексическая близость к цели.
+        """
+        action = option.get("action", "")
+        args = option.get("args", {}) or {}
+        if action not in ACTION_PRIORS:
+            return INVALID_PENALTY, 0.0
+        overlap = 0.0
+
+        if action in ("CLICK", "TYPE"):
+            index = args.get("index")
+            if not isinstance(index, int) or not 0 <= index < len(elements):
+                return INVALID_PENALTY, 0.0
+            element = elements[index]
+            expected_type = "input" if action == "TYPE" else "clickable"
+            if element.get("type") != expected_type:
+                return INVALID_PENALTY, 0.0
+            overlap += lexical_overlap(goal_tokens, element.get("text", ""))
+            if action == "TYPE":
+                overlap += lexical_overlap(goal_tokens, args.get("text", ""))
+        elif action == "NAVIGATE":
+            url = str(args.get("url", "")).strip()
+            if url.rstrip("/") == str(current_url).rstrip("/"):
+                return INVALID_PENALTY, 0.0
+            overlap += lexical_overlap(goal_tokens, url)
+        elif action == "BATCH":
+            steps = args.get("actions") or []
+            if not steps:
+                return INVALID_PENALTY, 0.0
+            step_scores = [self.score(step, goal_tokens, current_url, elements) for step in steps]
+            if min(score for score, _ in step_scores) <= INVALID_PENALTY:
+                return INVALID_PENALTY, 0.0
+            return (ACTION_PRIORS[action] + sum(score for score, _ in step_scores) / len(step_scores),
+                    sum(overlap for _, overlap in step_scores) / len(step_scores))
+        return ACTION_PRIORS[action] + overlap, overlap
+
+    def pick(self, options: list, goal: str, current_url: str, elements: list):
+        """
+        Возвращает (индекс, уверенность, пояснение), если выбор можно сделать
+        локально с уверенностью не ниже порога, иначе None.
+        """
+        unique = {}
+        for i, option in enumerate(options):
+            unique.setdefault(option_key(option), i)
+        if len(unique) == 1:
+            return 0, 1.0, "все варианты одинаковые"
+
+        if not elements:
+            return None
+        goal_tokens = tokenize(goal)
+        scored = sorted(
+            ((*self.score(options[i], goal_tokens, current_url, elements), i) for i in unique.values()),
+            reverse=True
+        )
+        weights = [math.exp((s - scored[0][0]) / self.temperature) for s, _, _ in scored]
+        confidence = weights[0] / sum(weights)
+        best_score, best_overlap, best_index = scored[0]
+        # Априорный вес действия сам по себе выбор не решает: победитель должен совпадать с целью.
+        if best_score <= INVALID_PENALTY or best_overlap <= 0 or confidence < self.threshold:
+            return None
+        return best_index, confidence, f"совпадение с целью {best_overlap:.2f}"
@@ -0,0 +1,93 @@
+"""
+Отбор элементов страницы, относящихся к цели, в пределах бюджета токенов.
+
+Элементы ранжируются по BM25 подписи относительно цели и недавней истории,
+с прибавкой за попадание в видимую часть экрана и за поля ввода. Отобранные
+элементы выводятся в исходном порядке и с исходными номерами, поэтому
+CLICK/TYPE по ним указывают на те же элементы, что и в полном списке.
+"""
+import math
+from collections import Counter
+
+from agents.ranker import tokenize
+from agents.tokens import count_tokens
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+VIEWPORT_BONUS = 0.5
+INPUT_BONUS = 0.3
+
+
+def format_element(index: int, element: dict) -> str:
+    typ = "поле" if element.get("type") == "input" else "кнопка"
+    text = str(element.get("text", "")).replace("\n", " ").strip()
+    return f"{index}: {typ} '{text}'"
+
+
+def bm25_scores(query: str, documents: list) -> list:
+    query_tokens = tokenize(query)
+    docs = [Counter(tokenize(doc)) for doc in documents]
+    if not query_tokens or not docs:
+        return [0.0] * len(docs)
+
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1.0
+    doc_freq = Counter(token for d in docs for token in d)
+    scores = []
+    for d in docs:
+        length = sum(d.values())
+        score = 0.0
+        for token in query_tokens:
+            tf = d.get(token, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[token] + 0.5) / (doc_freq[token] + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def select_relevant(elements: list, query: str, budget_tokens: int, top_k: int = None, required=()) -> list:
+    """
+    Возвращает [(индекс, элемент)] в исходном порядке, укладывающиеся в budget_tokens.
+    Если весь список и так помещается (и не длиннее top_k), он возвращается целиком.
+    Индексы из required попадают в ответ всегда, даже сверх бюджета и top_k.
+    """
+    lines = [format_element(i, el) for i, el in enumerate(elements)]
+    costs = [count_tokens(line) + 1 for line in lines]
+    if sum(costs) <= budget_tokens and (top_k is None or len(elements) <= top_k):
+        return list(enumerate(elements))
+
+    relevance = bm25_scores(query, [el.get("text", "") for el in elements])
+    scores = []
+    for i, el in enumerate(elements):
+        score = relevance[i]
+        if el.get("in_viewport"):
+            score += VIEWPORT_BONUS
+        if el.get("type") == "input":
+            score += INPUT_BONUS
+        scores.append(score)
+
+    # При равных очках выше тот, что раньше на странице.
+    order = sorted(range(len(elements)), key=lambda i: (-scores[i], i))
+    forced = {i for i in required if isinstance(i, int) and 0 <= i < len(elements)}
+    kept = sorted(forced)
+    used = sum(costs[i] for i in kept)
+    for i in order:
+        if i in forced:
+            continue
+        if top_k is not None and len(kept) >= top_k:
+            break
+        if used + costs[i] > budget_tokens:
+            continue
+        kept.append(i)
+        used += costs[i]
+    return [(i, elements[i]) for i in sorted(kept)]
+
+
+def summarize_relevant(elements: list, query: str, budget_tokens: int, top_k: int = None, required=()) -> str:
+    """Строка «i: тип 'подпись'; ...» только с релевантными элементами и пометкой об отборе."""
+    kept = select_relevant(elements, query, budget_tokens, top_k, required)
+    summary = "; ".join(format_element(i, el) for i, el in kept)
+    if len(kept) < len(elements):
+        summary += f" (показано {len(kept)} из {len(elements)}: самые релевантные цели, номера исходные)"
+    return summary
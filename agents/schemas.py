@@ -0,0 +1,255 @@
+"""
+Схемы ответов LLM и их локальная починка.
+
+Вместо того чтобы выбрасывать ответ и платить за новый запрос, ответ
+разбирается терпимо и приводится к схеме:
+
+- parse_lenient достаёт объект из текста с ```json-ограждением, <think>-блоком,
+  висячими запятыми, одинарными кавычками и True/False/None;
+- coerce приводит значения к типам схемы (подмножество JSON Schema: type,
+  properties, required, default, enum, minimum, maximum, items): "2" → 2,
+  "true" → true, "click" → "CLICK";
+- repair_plan и repair_choice сверяют индексы с текущим числом элементов и
+  вариантов: негодные варианты плана отбрасываются. План без is_done: true и без
+  годных вариантов считается негодным и запрашивается заново; null в поле —
+  то же, что его отсутствие.
+"""
+import ast
+import json
+import re
+
+ACTIONS = ("NAVIGATE", "CLICK", "TYPE", "BATCH")
+
+# Строковые литералы в двойных и одинарных кавычках — внутри них ничего не чиним.
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'', re.DOTALL)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_JSON_LITERALS = {"true": "True", "false": "False", "null": "None"}
+
+
+def _outside_strings(text: str, func) -> str:
+    """Применяет func к кускам текста вне строковых литералов."""
+    parts, last = [], 0
+    for match in _STRING.finditer(text):
+        parts.append(func(text[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(func(text[last:]))
+    return "".join(parts)
+
+
+def _object_candidates(text: str):
+    """Сбалансированные по фигурным скобкам куски текста, начиная с каждой «{» верхнего уровня."""
+    start, depth, quote, escape = None, 0, None, False
+    for pos, ch in enumerate(text):
+        if quote:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'" and start is not None:
+            quote = ch
+        elif ch == "{":
+            if start is None:
+                start = pos
+            depth += 1
+        elif ch == "}" and start is not None:
+            depth -= 1
+            if depth == 0:
+                yield text[start:pos + 1]
+                start = None
+
+
+def _repair_object(candidate: str):
+    no_commas = _outside_strings(candidate, lambda part: _TRAILING_COMMA.sub(r"\1", part))
+    try:
+        value = json.loads(no_commas)
+    except ValueError:
+        # Синтаксис Python: одинарные кавычки, True/False/None (true/false/null тоже переводим).
+        pythonic = _outside_strings(
+            candidate, lambda part: re.sub(r"\b(true|false|null)\b", lambda m: _JSON_LITERALS[m.group(1)], part)
+        )
+        try:
+            value = ast.literal_eval(pythonic)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def parse_lenient(text: str, accept=None):
+    """Первый JSON-объект из ответа LLM (годный для accept), по возможности починенный, или None."""
+    if not text:
+        return None
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    text = re.sub(r"```(?:json)?", "", text)
+    for candidate in _object_candidates(text):
+        value = _repair_object(candidate)
+        if value is not None and (accept is None or accept(value)):
+            return value
+    return None
+
+
+def coerce(value, schema: dict, path: str = "$"):
+    """
+    Приводит value к schema. Возвращает (значение, список ошибок); при ошибках
+    значение может быть частично исправленным.
+    """
+    kind = schema.get("type")
+    errors = []
+    if kind == "integer":
+        if isinstance(value, str) and re.fullmatch(r"\s*-?\d+\s*", value):
+            value = int(value)
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            return value, [f"{path}: ожидалось целое, а не {value!r}"]
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} < {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} > {schema['maximum']}")
+    elif kind == "boolean":
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            value = value.strip().lower() == "true"
+        elif isinstance(value, int) and not isinstance(value, bool) and value in (0, 1):
+            value = bool(value)
+        if not isinstance(value, bool):
+            return value, [f"{path}: ожидалось true/false, а не {value!r}"]
+    elif kind == "string":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            return value, [f"{path}: ожидалась строка, а не {value!r}"]
+        if "enum" in schema:
+            upper = value.strip().upper()
+            if upper not in schema["enum"]:
+                return value, [f"{path}: {value!r} не из {schema['enum']}"]
+            value = upper
+    elif kind == "array":
+        if isinstance(value, dict):
+            value = [value]
+        if not isinstance(value, list):
+            return value, [f"{path}: ожидался список, а не {value!r}"]
+        items = []
+        for i, item in enumerate(value):
+            item, item_errors = coerce(item, schema.get("items", {}), f"{path}[{i}]")
+            items.append(item)
+            errors.extend(item_errors)
+        value = items
+    elif kind == "object":
+        if not isinstance(value, dict):
+            return value, [f"{path}: ожидался объект, а не {value!r}"]
+        value = dict(value)
+        for key, sub in schema.get("properties", {}).items():
+            if value.get(key) is None:
+                # null считается отсутствующим полем: "final_result": null не повод для нового запроса.
+                value.pop(key, None)
+                if "default" in sub:
+                    value[key] = sub["default"]
+                elif key in schema.get("required", ()):
+                    errors.append(f"{path}.{key}: нет поля")
+                continue
+            value[key], sub_errors = coerce(value[key], sub, f"{path}.{key}")
+            errors.extend(sub_errors)
+    return value, errors
+
+
+def _index_schema(count: int) -> dict:
+    return {"type": "integer", "minimum": 0, "maximum": max(count - 1, 0) if count else 10 ** 9}
+
+
+def action_schemas(element_count: int) -> dict:
+    """Схемы args по действиям; element_count=0 — число элементов неизвестно, индексы не сверяются."""
+    index = _index_schema(element_count)
+    single = {
+        "NAVIGATE": {"type": "object", "required": ["url"], "properties": {"url": {"type": "string"}}},
+        "CLICK": {"type": "object", "required": ["index"], "properties": {"index": index}},
+        "TYPE": {"type": "object", "required": ["index", "text"],
+                 "properties": {"index": index, "text": {"type": "string"}}},
+    }
+    return dict(single, BATCH={"type": "object", "required": ["actions"],
+                               "properties": {"actions": {"type": "array", "items": {"type": "object"}}}})
+
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string", "default": ""},
+        "is_done": {"type": "boolean", "default": False},
+        "final_result": {"type": "string"},
+        "options": {"type": "array", "default": [], "items": {
+            "type": "object", "required": ["action"],
+            "properties": {"action": {"type": "string", "enum": list(ACTIONS)}, "args": {"type": "object", "default": {}}},
+        }},
+    },
+}
+
+
+def choice_schema(option_count: int) -> dict:
+    return {
+        "type": "object",
+        "required": ["chosen_index"],
+        "properties": {"chosen_index": _index_schema(option_count), "reason": {"type": "string", "default": ""}},
+    }
+
+
+def _repair_option(option, schemas: dict, nested: bool = False):
+    """Вариант действия, приведённый к схеме, или (None, ошибки)."""
+    option, errors = coerce(option, PLAN_SCHEMA["properties"]["options"]["items"])
+    if errors:
+        return None, errors
+    if option["action"] == "BATCH":
+        if nested:
+            return None, ["BATCH внутри BATCH"]
+        args, errors = coerce(option["args"], schemas["BATCH"])
+        if errors:
+            return None, errors
+        actions = []
+        for item in args["actions"]:
+            item, item_errors = _repair_option(item, schemas, nested=True)
+            if item is None:
+                # Пакет выполняется по порядку, поэтому без негодного шага он теряет смысл.
+                return None, item_errors
+            actions.append(item)
+        option["args"] = {"actions": actions}
+        return (option, []) if actions else (None, ["пустой BATCH"])
+
+    option["args"], errors = coerce(option["args"], schemas[option["action"]])
+    if option["action"] == "NAVIGATE" and not errors and not option["args"]["url"].strip().startswith(("http://", "https://")):
+        errors = [f"URL без http(s): {option['args']['url']!r}"]
+    return (None, errors) if errors else (option, [])
+
+
+def repair_plan(data: dict, element_count: int = 0):
+    """
+    План менеджера, приведённый к PLAN_SCHEMA; негодные варианты отбрасываются.
+    Возвращает (план или None, список проблем).
+    """
+    fields = {key: sub for key, sub in PLAN_SCHEMA["properties"].items() if key != "options"}
+    plan, problems = coerce(data, {"type": "object", "properties": fields})
+    if problems:
+        return None, problems
+    raw_options = data.get("options") or []
+    if isinstance(raw_options, dict):
+        raw_options = [raw_options]
+    if not isinstance(raw_options, list):
+        return None, [f"$.options: ожидался список, а не {raw_options!r}"]
+
+    schemas = action_schemas(element_count)
+    plan["options"] = []
+    for i, option in enumerate(raw_options):
+        option, errors = _repair_option(option, schemas)
+        if option is None:
+            problems.extend(f"вариант {i}: {error}" for error in errors)
+        else:
+            plan["options"].append(option)
+    if not plan["is_done"] and not plan["options"]:
+        # Ни завершения, ни действий: {} или случайный {"index": 3} — это не план.
+        return None, problems or ["нет ни is_done: true, ни вариантов действий"]
+    return plan, problems
+
+
+def repair_choice(data: dict, option_count: int):
+    """Выбор исполнителя, приведённый к choice_schema. Возвращает (выбор или None, проблемы)."""
+    choice, problems = coerce(data, choice_schema(option_count))
+    return (None, problems) if problems else (choice, [])
@@ -0,0 +1,21 @@
+"""
+Подсчёт токенов для бюджетов промпта.
+
+Если установлен tiktoken — считаем его энкодером cl100k_base, иначе оцениваем
+по длине: кириллица в большинстве токенизаторов занимает ~3 символа на токен.
+"""
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+CHARS_PER_TOKEN = 3
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
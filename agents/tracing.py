@@ -0,0 +1,106 @@
+"""
+Трассировка шагов агента в JSONL.
+
+Включается переменной AGENT_TRACE_FILE (путь к файлу, строки дописываются в конец).
+На каждый шаг менеджера пишется одна строка-спан:
+    trace_id, step, goal          — задача и номер шага;
+    duration_ms                   — весь шаг;
+    manager_llm_ms, executor_llm_ms, tools_ms — из чего он сложился;
+    other_ms                      — остаток: разбор ответов, печать, паузы;
+    llm   — вызовы LLM: роль, модель, время, попытки, размеры промпта и ответа, кэш;
+    tools — вызовы MCP: инструмент, время на клиенте и на сервере, успех.
+Вызовы вне шага (например, из бенчмарков) пишутся отдельными строками.
+Спан привязан к потоку, поэтому параллельные агенты в потоках не смешиваются.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return bool(os.getenv("AGENT_TRACE_FILE"))
+
+
+def _write(record: dict):
+    path = os.getenv("AGENT_TRACE_FILE")
+    if not path:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def start_trace(goal: str) -> str:
+    """Начинает трассу задачи; возвращает её id."""
+    _local.trace_id = uuid.uuid4().hex
+    _local.goal = goal
+    return _local.trace_id
+
+
+def start_step(step: int):
+    if not enabled():
+        _local.span = None
+        return
+    _local.span = {
+        "type": "step",
+        "trace_id": getattr(_local, "trace_id", None),
+        "goal": getattr(_local, "goal", None),
+        "step": step,
+        "ts": round(time.time(), 3),
+        "_start": time.perf_counter(),
+        "llm": [],
+        "tools": [],
+    }
+
+
+def annotate(**fields):
+    """Добавляет поля к текущему спану шага."""
+    span = getattr(_local, "span", None)
+    if span is not None:
+        span.update(fields)
+
+
+def _record(kind: str, event: dict):
+    if not enabled():
+        return
+    span = getattr(_local, "span", None)
+    if span is None:
+        _write({"type": kind, "trace_id": getattr(_local, "trace_id", None),
+                "ts": round(time.time(), 3), **event})
+    else:
+        span[kind].append(event)
+
+
+def record_llm(role: str, **fields):
+    _record("llm", {"role": role, **fields})
+
+
+def record_tool(tool: str, **fields):
+    _record("tools", {"tool": tool, **fields})
+
+
+def end_step(**fields):
+    """Закрывает спан шага и пишет его в файл."""
+    span = getattr(_local, "span", None)
+    if span is None:
+        return
+    _local.span = None
+    duration_ms = (time.perf_counter() - span.pop("_start")) * 1000
+    manager_ms = sum(e["latency_ms"] for e in span["llm"] if e["role"] == "manager")
+    executor_ms = sum(e["latency_ms"] for e in span["llm"] if e["role"] == "executor")
+    tools_ms = sum(e["latency_ms"] for e in span["tools"])
+    span.update(
+        duration_ms=round(duration_ms, 1),
+        manager_llm_ms=round(manager_ms, 1),
+        executor_llm_ms=round(executor_ms, 1),
+        tools_ms=round(tools_ms, 1),
+        other_ms=round(max(0.0, duration_ms - manager_ms - executor_ms - tools_ms), 1),
+        **fields,
+    )
+    _write(span)
@@ -0,0 +1,284 @@
+"""
+Запись траекторий удачных задач и их повтор без LLM.
+
+После успешной задачи сохраняется траектория: цель, действия и у CLICK/TYPE —
+отпечаток целевого элемента (тег, тип, подпись, атрибуты, номер и положение).
+Тексты TYPE, взятые из цели, становятся параметрами: «Найди ноутбук ...»
+сохраняется как «Найди {p0} ...», и та же траектория подходит для
+«Найди телефон ...». Параметры подставляются и в URL, как есть и в
+URL-кодировке.
+
+При повторе действия идут напрямую в MCP-сервер; перед CLICK/TYPE элемент
+ищется по отпечатку в свежем списке. Если элемент не нашёлся, страница
+другая или действие вернуло ошибку, повтор останавливается, и задача
+продолжается обычным циклом с LLM.
+
+Переменные окружения:
+    AGENT_TRAJECTORIES=1     — записывать и повторять траектории (по умолчанию выключено:
+                               запись требует подробностей элементов в каждом getElements)
+    AGENT_TRAJECTORY_DIR     — каталог (по умолчанию .cache/trajectories)
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import quote, quote_plus, urlsplit
+
+from agents.browser_tools import click_element, get_current_url, get_page_update, navigate, type_text, wait_for_stable
+
+# Сколько очков нужно элементу, чтобы считаться тем же: подпись даёт LABEL_WEIGHT,
+# id/name — по 2, прочие атрибуты, тот же номер и близкое положение — до 1.
+MIN_MATCH_SCORE = 3.0
+LABEL_WEIGHT = 3.0
+STRONG_ATTRS = ("id", "name")
+
+# Как параметр записан в строке: как есть, в query (quote_plus) и в пути (quote).
+_ENCODINGS = (("|url", quote_plus), ("|path", lambda value: quote(value, safe="")), ("", lambda value: value))
+_PLACEHOLDER = re.compile(r"\{p(\d+)\}")
+
+
+def _normalize(text) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip()
+
+
+def _failed(result) -> bool:
+    return isinstance(result, str) and result.startswith(("Ошибка", "Исключение"))
+
+
+def _templatize(text: str, params: list) -> str:
+    for i, value in enumerate(params):
+        for suffix, encode in _ENCODINGS:
+            encoded = encode(value)
+            if suffix and encoded == value:
+                continue
+            text = text.replace(encoded, f"{{p{i}{suffix}}}")
+    return text
+
+
+def _fill(text: str, params: list) -> str:
+    for i, value in enumerate(params):
+        for suffix, encode in _ENCODINGS:
+            text = text.replace(f"{{p{i}{suffix}}}", encode(value))
+    return text
+
+
+def _map_strings(value, func):
+    """Применяет func ко всем строкам во вложенных dict/list."""
+    if isinstance(value, str):
+        return func(value)
+    if isinstance(value, dict):
+        return {k: _map_strings(v, func) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_map_strings(v, func) for v in value]
+    return value
+
+
+def _same_page(a: str, b: str) -> bool:
+    a, b = urlsplit(a or ""), urlsplit(b or "")
+    return (a.netloc, a.path.rstrip("/")) == (b.netloc, b.path.rstrip("/"))
+
+
+def fingerprint(index: int, element: dict) -> dict:
+    return {
+        "index": index,
+        "tag": element.get("tag"),
+        "type": element.get("type"),
+        "text": _normalize(element.get("text")),
+        "attrs": element.get("attrs") or {},
+        "y": element.get("y"),
+    }
+
+
+def match_element(target: dict, elements: list):
+    """Номер элемента, совпадающего с отпечатком, или None."""
+    best = None
+    for i, el in enumerate(elements):
+        if el.get("tag") != target["tag"] or el.get("type") != target["type"]:
+            continue
+        label = _normalize(el.get("text")) == target["text"]
+        attrs = el.get("attrs") or {}
+        strong = any(attrs.get(name) == target["attrs"][name] for name in STRONG_ATTRS if name in target["attrs"])
+        if not (label or strong):
+            continue
+
+        score = LABEL_WEIGHT if label else 0.0
+        for name, value in target["attrs"].items():
+            if attrs.get(name) == value:
+                score += 2.0 if name in STRONG_ATTRS else 1.0
+        if i == target["index"]:
+            score += 1.0
+        if target.get("y") is not None and el.get("y") is not None:
+            score += max(0.0, 1.0 - abs(el["y"] - target["y"]) / 500)
+
+        key = (score, -abs(i - target["index"]))
+        if best is None or key > best[0]:
+            best = (key, i)
+    if best is None or best[0][0] < MIN_MATCH_SCORE:
+        return None
+    return best[1]
+
+
+def describe_step(action: str, args: dict) -> str:
+    """Строка для истории менеджера в том же виде, что и у обычных шагов."""
+    if action == "NAVIGATE":
+        return f"→ перешёл на {args.get('url')}"
+    if action == "CLICK":
+        return f"🖱️ кликнул по элементу #{args.get('index')}"
+    return f"⌨️ ввёл '{args.get('text', '')}' в поле #{args.get('index')}"
+
+
+class TrajectoryRecorder:
+    """Копит удачные действия задачи вместе с отпечатками их элементов."""
+
+    def __init__(self, goal: str):
+        self.goal = goal
+        self.steps = []
+
+    def add(self, action: str, args: dict, url: str, elements: list = None):
+        step = {"action": action, "args": dict(args), "url": url}
+        if action in ("CLICK", "TYPE"):
+            try:
+                index = int(args.get("index"))
+            except (TypeError, ValueError):
+                return
+            if not elements or not 0 <= index < len(elements):
+                # Без отпечатка действие не повторить — траектория будет неполной.
+                self.steps.append({"action": action, "unusable": True})
+                return
+            step["args"]["index"] = index
+            step["target"] = fingerprint(index, elements[index])
+        self.steps.append(step)
+
+    def checkpoint(self) -> int:
+        """Отметка для rollback: сколько действий записано сейчас."""
+        return len(self.steps)
+
+    def rollback(self, checkpoint: int):
+        """Забывает действия после отметки — например, шаг, после которого страница не изменилась."""
+        del self.steps[checkpoint:]
+
+    def build(self, final_result: str = None):
+        """Готовая траектория с параметризованной целью или None, если повторять нечего."""
+        if not self.steps or any(step.get("unusable") for step in self.steps):
+            return None
+
+        params = []
+        for step in self.steps:
+            if step["action"] == "TYPE":
+                text = _normalize(step["args"].get("text"))
+                if len(text) >= 3 and text.lower() in self.goal.lower() and text not in params:
+                    params.append(text)
+
+        goal_template = self.goal
+        for i, value in enumerate(params):
+            goal_template = re.sub(re.escape(value), lambda _, i=i: f"{{p{i}}}", goal_template,
+                                   count=1, flags=re.IGNORECASE)
+        return {
+            "goal": self.goal,
+            "goal_template": _normalize(goal_template),
+            "params": params,
+            "final_result": final_result,
+            "steps": _map_strings(copy.deepcopy(self.steps), lambda s: _templatize(s, params)),
+            "created": time.time(),
+            "replays": 0,
+            "failures": 0,
+        }
+
+
+class TrajectoryStore:
+    """Траектории в каталоге, по файлу на шаблон цели; новая заменяет старую."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, goal_template: str) -> str:
+        key = hashlib.sha256(goal_template.lower().encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{key}.json")
+
+    def save(self, trajectory: dict):
+        path = self._path(trajectory["goal_template"])
+        # Свой временный файл у каждого потока: пакетный запуск может сохранять одновременно.
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(trajectory, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    def find(self, goal: str):
+        """Возвращает (траектория, значения параметров) для цели или None."""
+        goal = _normalize(goal)
+        found = None
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    trajectory = json.load(f)
+            except (OSError, ValueError):
+                continue
+            parts = re.split(r"(\{p\d+\})", trajectory["goal_template"])
+            pattern = "".join(
+                f"(?P<p{_PLACEHOLDER.fullmatch(part).group(1)}>.+?)" if _PLACEHOLDER.fullmatch(part) else re.escape(part)
+                for part in parts
+            )
+            match = re.fullmatch(pattern, goal, flags=re.IGNORECASE | re.DOTALL)
+            if match is None:
+                continue
+            params = [match.group(f"p{i}") for i in range(len(trajectory["params"]))]
+            # Самая конкретная траектория — с наименьшим числом параметров.
+            if found is None or len(params) < len(found[1]):
+                found = (trajectory, params)
+        return found
+
+    def mark(self, trajectory: dict, ok: bool):
+        trajectory["replays" if ok else "failures"] += 1
+        self.save(trajectory)
+
+
+def get_trajectory_store():
+    """Хранилище траекторий или None, если они отключены."""
+    if os.getenv("AGENT_TRAJECTORIES", "0") != "1":
+        return None
+    return TrajectoryStore(os.getenv("AGENT_TRAJECTORY_DIR", os.path.join(".cache", "trajectories")))
+
+
+def replay(trajectory: dict, params: list, recorder: TrajectoryRecorder = None, history: list = None) -> dict:
+    """
+    Повторяет траекторию через MCP-сервер, сверяя отпечатки элементов.
+    Возвращает {"status": "done" | "diverged", "replayed": число выполненных действий, "reason"}.
+    """
+    for number, step in enumerate(trajectory["steps"]):
+        action = step["action"]
+        args = _map_strings(step["args"], lambda s: _fill(s, params))
+        current_url = get_current_url()
+        elements = None
+
+        if action == "NAVIGATE":
+            result = navigate(args["url"])
+        else:
+            expected_url = _fill(step.get("url") or "", params)
+            if expected_url and not _same_page(current_url, expected_url):
+                return {"status": "diverged", "replayed": number,
+                        "reason": f"ожидалась страница {expected_url}, открыта {current_url}"}
+            elements, _ = get_page_update(geometry=True, details=True)
+            target = _map_strings(step["target"], lambda s: _fill(s, params))
+            index = match_element(target, elements)
+            if index is None:
+                return {"status": "diverged", "replayed": number,
+                        "reason": f"не найден элемент {target['tag']} '{target['text']}'"}
+            args["index"] = index
+            result = click_element(index) if action == "CLICK" else type_text(index, args.get("text", ""))
+
+        if _failed(result):
+            return {"status": "diverged", "replayed": number, "reason": str(result)}
+        print(f"🔁 {action} {args}: {result}")
+        if recorder is not None:
+            recorder.add(action, args, current_url, elements)
+        if history is not None:
+            history.append(f"🔁 {describe_step(action, args)}")
+        wait_for_stable()
+
+    return {"status": "done", "replayed": len(trajectory["steps"]), "reason": None}
@@ -0,0 +1,82 @@
+"""
+Бенчмарк движков извлечения: css (обход по селекторам) против accessibility (дерево доступности).
+
+Для каждой страницы-фикстуры: число элементов, время снимка и размер списка элементов
+в промпте менеджера (в токенах, как его считает agents/tokens.py).
+
+Запуск:
+    python benchmarks/bench_backends.py --browser chromium --catalog 50 500 --elements 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from playwright.async_api import async_playwright
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "browser-agent"))
+
+from agents.relevance import format_element
+from agents.tokens import count_tokens
+from backends import BACKENDS
+from fixtures import build_catalog_page, build_elements_page, build_form_page, build_results_page
+
+
+def fixture_pages(args) -> dict:
+    pages = {"form": build_form_page(), "results": build_results_page("ноутбук", 20)}
+    for n in args.catalog:
+        pages[f"catalog_{n}"] = build_catalog_page(n)
+    for n in args.elements:
+        pages[f"elements_{n}"] = build_elements_page(n)
+    return pages
+
+
+async def measure(backend, page, repeats: int):
+    timings = []
+    elements = []
+    for snapshot_id in range(repeats):
+        start = time.perf_counter()
+        elements, _ = await backend.snapshot(page, snapshot_id)
+        timings.append(time.perf_counter() - start)
+    return elements, min(timings)
+
+
+async def run(args):
+    report = []
+    async with async_playwright() as p:
+        browser = await getattr(p, args.browser).launch(headless=True)
+        page = await browser.new_page()
+        for name, content in fixture_pages(args).items():
+            await page.set_content(content)
+            row = {"page": name}
+            for backend in BACKENDS.values():
+                elements, elapsed = await measure(backend, page, args.repeats)
+                summary = "\n".join(format_element(i, el) for i, el in enumerate(elements))
+                row[backend.name] = {
+                    "elements": len(elements),
+                    "sec": round(elapsed, 4),
+                    "prompt_tokens": count_tokens(summary),
+                }
+            report.append(row)
+        await browser.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog", type=int, nargs="*", default=[50, 500])
+    parser.add_argument("--elements", type=int, nargs="*", default=[1000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--browser", choices=["chromium", "firefox"], default="chromium")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
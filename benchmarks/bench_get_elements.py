@@ -0,0 +1,65 @@
+"""
+Бенчмарк извлечения элементов: один evaluate против прежнего пути по handle'ам.
+
+Запуск:
+    python benchmarks/bench_get_elements.py --sizes 100 1000 3000 --browser firefox
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from playwright.async_api import async_playwright
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "browser-agent"))
+
+from extraction import extract_elements, extract_elements_per_handle
+from fixtures import build_elements_page
+
+
+async def measure(func, page, repeats: int):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = await func(page)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+async def run(args):
+    report = []
+    async with async_playwright() as p:
+        browser = await getattr(p, args.browser).launch(headless=True)
+        page = await browser.new_page()
+        for size in args.sizes:
+            await page.set_content(build_elements_page(size))
+            fast, fast_time = await measure(extract_elements, page, args.repeats)
+            slow, slow_time = await measure(extract_elements_per_handle, page, args.repeats)
+            report.append({
+                "elements": size,
+                "visible": len(fast),
+                "evaluate_sec": round(fast_time, 4),
+                "per_handle_sec": round(slow_time, 4),
+                "speedup": round(slow_time / fast_time, 1) if fast_time else None,
+                "identical": fast == slow,
+            })
+        await browser.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 3000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--browser", choices=["chromium", "firefox"], default="chromium")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Бенчмарк хвостовых задержек LLM: один эндпоинт против двух с дублированием запросов.
+
+Две заглушки LLM отвечают за delay_ms, но доля slow_share ответов задерживается ещё
+на slow_ms (у каждой заглушки свой случайный хвост). Сначала все запросы идут в один
+эндпоинт, затем через LLMRouter с запасным эндпоинтом: медленный запрос дублируется
+после перцентиля задержки, побеждает первый ответ. В stdout идёт только отчёт
+в JSON, ход прогона (сообщения клиента и роутера) — в stderr.
+
+Запуск:
+    python benchmarks/bench_hedging.py --requests 100 --slow-share 0.05 --slow-ms 3000
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agents.llm_client import LLMClient
+from stub_llm import start_stub_llm
+
+SCENARIO_RULES = [{"match": r"", "response": {"chosen_index": 0, "reason": "заглушка"}}]
+
+
+def latency_report(latencies: list) -> dict:
+    ordered = sorted(latencies)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {"p50_sec": pick(0.5), "p90_sec": pick(0.9), "p99_sec": pick(0.99),
+            "max_sec": round(ordered[-1], 3), "mean_sec": round(statistics.mean(ordered), 3)}
+
+
+def run_requests(client: LLMClient, count: int) -> list:
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        result, _ = client.complete_json(f"Запрос {i}", use_cache=False)
+        if result is None:
+            raise RuntimeError(f"запрос {i} остался без ответа")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--delay-ms", type=int, default=100)
+    parser.add_argument("--slow-share", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=int, default=3000)
+    parser.add_argument("--percentile", type=float, default=0.9)
+    parser.add_argument("--min-delay", type=float, default=0.2, help="нижняя граница задержки дублирования, сек")
+    args = parser.parse_args()
+
+    urls = []
+    for seed in (1, 2):
+        scenario = {"rules": SCENARIO_RULES, "delay_ms": args.delay_ms, "slow_share": args.slow_share,
+                    "slow_ms": args.slow_ms, "seed": seed}
+        _, _, url = start_stub_llm(scenario)
+        urls.append(url)
+
+    # Отчёт читают через `| jq`, поэтому печать клиента и роутера уходит в stderr.
+    with contextlib.redirect_stdout(sys.stderr):
+        os.environ.pop("LLM_ENDPOINTS", None)
+        single = LLMClient(urls[0], "stub", "stub-model", temperature=0.0, max_attempts=1)
+        single_latencies = run_requests(single, args.requests)
+
+        os.environ["LLM_ENDPOINTS"] = json.dumps([{"name": "backup", "base_url": urls[1]}])
+        os.environ["LLM_HEDGE_PERCENTILE"] = str(args.percentile)
+        os.environ["LLM_HEDGE_MIN_DELAY_SEC"] = str(args.min_delay)
+        # Основной эндпоинт уже набрал статистику в первом прогоне — дублирование начнётся с его перцентиля.
+        hedged = LLMClient(urls[0], "stub", "stub-model", temperature=0.0, max_attempts=1)
+        hedged_latencies = run_requests(hedged, args.requests)
+
+    print(json.dumps({
+        "requests": args.requests,
+        "stub": {"delay_ms": args.delay_ms, "slow_share": args.slow_share, "slow_ms": args.slow_ms},
+        "single": latency_report(single_latencies),
+        "hedged": latency_report(hedged_latencies),
+        "endpoints": [endpoint.stats() for endpoint in hedged.router.endpoints],
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Бенчмарк запуска MCP-сервера: время до первого ответа /mcp и до первой команды в новой сессии.
+
+Сравниваются варианты запуска:
+    persistent — профиль пользователя через launch_persistent_context (нужен --user-data-dir);
+    cold       — обычный браузер, контексты создаются по требованию (MCP_WARM_CONTEXTS=0);
+    warm       — то же с пулом прогретых контекстов (MCP_WARM_CONTEXTS=2).
+С --storage-state контексты cold и warm создаются из сохранённого снимка cookies/localStorage.
+
+Запуск:
+    python benchmarks/bench_startup.py --browser firefox --repeats 3 --user-data-dir ~/.mozilla/firefox/xxx.default
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_URL = "http://127.0.0.1:8000/mcp"
+
+
+def _call(tool: str, session: str = "default", timeout: float = 5):
+    resp = requests.post(SERVER_URL, json={"tool": tool, "args": {}, "session": session}, timeout=timeout)
+    data = resp.json()
+    if "error" in data:
+        raise RuntimeError(data["error"])
+    return data
+
+
+def measure(env: dict, timeout: float, warm_wait: float) -> dict:
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "browser-agent", "mcp_server.py")],
+                               cwd=ROOT, env=dict(os.environ, **env), stdout=subprocess.DEVNULL)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"сервер завершился с кодом {process.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("сервер не ответил вовремя")
+            try:
+                _call("get_url")
+                break
+            except (requests.RequestException, ValueError, RuntimeError):
+                time.sleep(0.1)
+        first_call = time.perf_counter() - started
+
+        # Даём пулу прогреться, как это было бы между запросами в работе.
+        time.sleep(warm_wait)
+        session_started = time.perf_counter()
+        _call("get_url", session="bench-new", timeout=timeout)
+        new_session = time.perf_counter() - session_started
+        return {"first_call_sec": first_call, "new_session_sec": new_session}
+    finally:
+        try:
+            _call("quit")
+        except Exception:
+            pass
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска MCP-сервера")
+    parser.add_argument("--browser", choices=["chromium", "firefox"], default="firefox")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--user-data-dir", help="профиль для варианта persistent")
+    parser.add_argument("--storage-state", help="снимок storage_state для вариантов cold и warm")
+    parser.add_argument("--warm-wait", type=float, default=2.0, help="пауза перед новой сессией, сек")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    base = {"MCP_PROFILE": "fast", "MCP_BROWSER": args.browser, "MCP_STORAGE_STATE": args.storage_state or ""}
+    variants = {}
+    if args.user_data_dir:
+        variants["persistent"] = dict(base, MCP_USER_DATA_DIR=args.user_data_dir, MCP_STORAGE_STATE="",
+                                      MCP_WARM_CONTEXTS="0")
+    variants["cold"] = dict(base, MCP_WARM_CONTEXTS="0")
+    variants["warm"] = dict(base, MCP_WARM_CONTEXTS="2")
+
+    report = []
+    for name, env in variants.items():
+        runs = [measure(env, args.timeout, args.warm_wait) for _ in range(args.repeats)]
+        report.append({
+            "variant": name,
+            "first_call_sec": round(statistics.median(r["first_call_sec"] for r in runs), 3),
+            "new_session_sec": round(statistics.median(r["new_session_sec"] for r in runs), 3),
+        })
+    print(json.dumps({"browser": args.browser, "repeats": args.repeats, "results": report},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Локальный HTTP-сервер с генерируемыми страницами для бенчмарков.
+
+Страницы:
+    /elements?n=1000    — n интерактивных элементов разных видов (часть скрыта/выключена);
+    /catalog?n=200      — n карточек товара: обёртки с aria-label вокруг ссылок и кнопок;
+    /form               — поле поиска и кнопка «Найти»;
+    /results?q=...      — результаты поиска с кнопками «Добавить в корзину»;
+    /delayed?ms=1500    — кнопки появляются через ms миллисекунд после загрузки.
+"""
+import html
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def build_elements_page(count: int) -> str:
+    """Страница с count интерактивными элементами разных видов, часть скрыта или выключена."""
+    parts = ["<html><body>"]
+    for i in range(count):
+        kind = i % 8
+        if kind == 0:
+            parts.append(f"<button>Купить {i}</button>")
+        elif kind == 1:
+            parts.append(f"<a href='/item/{i}'>Товар\n{i}</a>")
+        elif kind == 2:
+            parts.append(f"<input placeholder='Поиск {i}'>")
+        elif kind == 3:
+            parts.append(f"<div role='button' aria-label='Добавить {i}'>+</div>")
+        elif kind == 4:
+            parts.append(f"<textarea title='Комментарий {i}'></textarea>")
+        elif kind == 5:
+            parts.append(f"<div contenteditable='true'>Заметка {i}</div>")
+        elif kind == 6:
+            parts.append(f"<button disabled>Недоступно {i}</button>")
+        else:
+            parts.append(f"<button style='display:none'>Скрыто {i}</button>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def build_catalog_page(count: int) -> str:
+    """Каталог, как на реальных витринах: у карточки и её частей свои aria-label."""
+    cards = "".join(
+        f"<div class='card' aria-label='Карточка товара {i}'>"
+        f"<a href='/item/{i}' aria-label='Товар {i}'><span aria-label='Цена'>{100 + i} ₽</span> Товар {i}</a>"
+        f"<div aria-label='Рейтинг'>★★★★☆</div>"
+        f"<button aria-label='Добавить товар {i} в корзину'><span aria-label='плюс'>+</span></button></div>"
+        for i in range(count)
+    )
+    return f"<html><body><input placeholder='Поиск'><button>Найти</button>{cards}</body></html>"
+
+
+def build_form_page() -> str:
+    return (
+        "<html><body><a href='/form'>Главная</a>"
+        "<form action='/results'><input name='q' placeholder='Поиск'>"
+        "<button type='submit'>Найти</button></form></body></html>"
+    )
+
+
+def build_results_page(query: str, count: int = 5) -> str:
+    items = "".join(
+        f"<div><span>{html.escape(query)} — модель {i}</span>"
+        f"<button onclick=\"this.setAttribute('aria-label', 'В корзине ✓')\">Добавить в корзину</button></div>"
+        for i in range(count)
+    )
+    return (
+        f"<html><body><a href='/form'>Главная</a>"
+        f"<form action='/results'><input name='q' placeholder='Поиск' value='{html.escape(query)}'>"
+        f"<button type='submit'>Найти</button></form>{items}</body></html>"
+    )
+
+
+def build_delayed_page(delay_ms: int) -> str:
+    return (
+        "<html><body><div id='root'><a href='#loading'>Загрузка...</a></div><script>"
+        f"setTimeout(() => {{ document.getElementById('root').innerHTML ="
+        f" '<button>Готово</button><input placeholder=\"Поле\">'; }}, {delay_ms});"
+        "</script></body></html>"
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/elements":
+            body = build_elements_page(int(params.get("n", ["100"])[0]))
+        elif url.path == "/catalog":
+            body = build_catalog_page(int(params.get("n", ["200"])[0]))
+        elif url.path in ("/", "/form"):
+            body = build_form_page()
+        elif url.path == "/results":
+            body = build_results_page(params.get("q", [""])[0])
+        elif url.path == "/delayed":
+            body = build_delayed_page(int(params.get("ms", ["1000"])[0]))
+        elif url.path.startswith("/item/"):
+            body = f"<html><body><a href='/form'>Главная</a><h1>{html.escape(url.path)}</h1></body></html>"
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fixture_server(host: str = "127.0.0.1", port: int = 0):
+    """Запускает сервер в фоновом потоке, возвращает (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+if __name__ == "__main__":
+    server, base_url = start_fixture_server(port=8100)
+    print(f"🧪 Фикстуры на {base_url}")
+    server.serve_forever()
@@ -0,0 +1,194 @@
+"""
+Офлайн-бенчмарк всей связки: фикстуры + заглушка LLM + MCP-сервер + агент.
+
+Меряет задержку инструментов (getElements, click, type, wait_for_page_ready)
+на страницах с разным числом элементов, а также число шагов и время задач
+агента. Итог — JSON, который удобно сравнивать между коммитами.
+
+Запуск (сервер поднимается сам с профилем fast):
+    python benchmarks/run_benchmarks.py --start-server --output bench.json
+С уже запущенным сервером:
+    python benchmarks/run_benchmarks.py --server-url http://127.0.0.1:8000/mcp
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fixtures import start_fixture_server
+from stub_llm import load_scenario, start_stub_llm
+
+# Задачи агента для сценария по умолчанию из stub_llm.py.
+TASKS = [
+    {"name": "search_cart", "start": "/", "goal": "Найди «ноутбук» и добавь первый товар в корзину"},
+    {"name": "delayed", "start": "/delayed?ms=1500", "goal": "Дождись появления кнопки «Готово»"},
+]
+
+
+def _stats(timings: list) -> dict:
+    return {
+        "n": len(timings),
+        "min_ms": round(min(timings) * 1000, 1),
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+    }
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _is_error(result) -> bool:
+    return isinstance(result, str) and result.startswith(("Ошибка", "Исключение"))
+
+
+def start_server(profile: str, timeout: float = 60):
+    """Запускает browser-agent/mcp_server.py и ждёт ответа get_url. Возвращает (процесс, секунды)."""
+    from agents.browser_tools import get_current_url
+
+    env = dict(os.environ, MCP_PROFILE=profile)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "browser-agent", "mcp_server.py")],
+                               cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"❌ MCP-сервер завершился с кодом {process.returncode}")
+        if not _is_error(get_current_url()):
+            return process, time.perf_counter() - start
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("❌ MCP-сервер не ответил вовремя")
+
+
+def bench_tools(base_url: str, sizes: list, repeats: int) -> list:
+    from agents import browser_tools as bt
+
+    report = []
+    for size in sizes:
+        timings = {name: [] for name in ("navigate", "wait_for_page_ready", "getElements", "click", "type")}
+        errors = 0
+        elements = []
+        for _ in range(repeats):
+            result, elapsed = _timed(bt.navigate, f"{base_url}/elements?n={size}")
+            timings["navigate"].append(elapsed)
+            errors += _is_error(result)
+            _, elapsed = _timed(bt.wait_for_page_ready)
+            timings["wait_for_page_ready"].append(elapsed)
+            (elements, _), elapsed = _timed(bt.get_page_update)
+            timings["getElements"].append(elapsed)
+
+            button = next((i for i, el in enumerate(elements) if el.get("tag") == "button"), None)
+            field = next((i for i, el in enumerate(elements) if el.get("tag") == "input"), None)
+            if button is not None:
+                result, elapsed = _timed(bt.click_element, button)
+                timings["click"].append(elapsed)
+                errors += _is_error(result)
+            if field is not None:
+                result, elapsed = _timed(bt.type_text, field, "ноутбук")
+                timings["type"].append(elapsed)
+                errors += _is_error(result)
+
+        report.append({
+            "elements": size,
+            "visible": len(elements),
+            "errors": errors,
+            "tools": {name: _stats(t) for name, t in timings.items() if t},
+        })
+    return report
+
+
+def bench_tasks(base_url: str, stub, tasks: list, verbose: bool) -> list:
+    from agents import browser_tools as bt
+    from agents.manager_agent import ManagerAgent
+
+    report = []
+    for task in tasks:
+        bt.navigate(base_url + task["start"])
+        bt.wait_for_stable()
+        requests_before = stub.requests
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            outcome = ManagerAgent().run(task["goal"])
+        report.append({
+            "task": task["name"],
+            "status": outcome["status"],
+            "steps": outcome["steps"],
+            "llm_requests": stub.requests - requests_before,
+            "wall_sec": round(time.perf_counter() - start, 3),
+        })
+    return report
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк MCP-сервера и агента")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--server-url", default=os.getenv("MCP_SERVER_URL", "http://127.0.0.1:8000/mcp"))
+    parser.add_argument("--start-server", action="store_true", help="поднять MCP-сервер самому")
+    parser.add_argument("--profile", default="fast", help="MCP_PROFILE для --start-server")
+    parser.add_argument("--scenario", help="JSON-сценарий заглушки LLM (по умолчанию встроенный)")
+    parser.add_argument("--skip-tasks", action="store_true", help="только задержки инструментов")
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод агента")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    fixtures, base_url = start_fixture_server()
+    scenario = load_scenario(args.scenario) if args.scenario else None
+    stub_server, stub, llm_url = start_stub_llm(scenario, base_url)
+
+    # До импорта агентов: адреса читаются из окружения при импорте и создании агентов.
+    os.environ["MCP_SERVER_URL"] = args.server_url
+    os.environ["LITELLM_BASE_URL"] = llm_url
+    os.environ["LITELLM_API_KEY"] = "stub"
+    os.environ["LLM_CACHE"] = "0"
+    # Повтор записанных траекторий обошёл бы LLM, и прогоны перестали бы быть сравнимыми.
+    os.environ["AGENT_TRAJECTORIES"] = "0"
+    os.chdir(ROOT)
+
+    report = {"commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "profile": args.profile if args.start_server else None}
+    process = None
+    try:
+        if args.start_server:
+            process, startup = start_server(args.profile)
+            report["server_startup_sec"] = round(startup, 3)
+        report["tools"] = bench_tools(base_url, args.sizes, args.repeats)
+        if not args.skip_tasks:
+            report["tasks"] = bench_tasks(base_url, stub, TASKS, args.verbose)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        fixtures.shutdown()
+        stub_server.shutdown()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"📊 Отчёт записан в {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Заглушка OpenAI-совместимого эндпоинта /v1/chat/completions для офлайн-бенчмарков.
+
+Ответ выбирается по сценарию: список правил {"match": regex, "response": ...},
+первое правило, регулярное выражение которого нашлось в промпте, побеждает.
+response — объект (отдаётся как JSON) или строка; "{base_url}" в нём заменяется
+адресом фикстур. Поддерживаются потоковый (SSE) и обычный ответ.
+
+Формат файла сценария (--scenario):
+    {"think": "необязательная преамбула", "delay_ms": 0, "chunk_size": 16,
+     "slow_share": 0.0, "slow_ms": 0, "seed": null, "json_mode": true,
+     "rules": [{"match": "...", "response": {...}, "delay_ms": 0}, ...]}
+slow_share — доля ответов, к задержке которых добавляется slow_ms (тяжёлый хвост
+задержек, как у перегруженного провайдера); seed делает её воспроизводимой.
+json_mode: false — эндпоинт без JSON mode: запрос с response_format получает 400.
+
+Запуск отдельно:
+    python benchmarks/stub_llm.py --port 8200 --base-url http://127.0.0.1:8100
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Сценарий для фикстур из fixtures.py: поиск товара и добавление в корзину,
+# ожидание отложенного контента.
+DEFAULT_SCENARIO = {
+    "rules": [
+        {"match": r"Выбери номер действия",
+         "response": {"chosen_index": 0, "reason": "первый вариант"}},
+        {"match": r"В корзине ✓",
+         "response": {"thought": "Товар в корзине", "is_done": True,
+                      "final_result": "Товар добавлен в корзину", "options": []}},
+        {"match": r"кнопка 'Готово'",
+         "response": {"thought": "Контент загрузился", "is_done": True,
+                      "final_result": "Кнопка «Готово» появилась", "options": []}},
+        {"match": r"URL: \S*/results",
+         "response": {"thought": "Добавляю первый товар", "is_done": False,
+                      "options": [{"action": "CLICK", "args": {"index": 3}}]}},
+        {"match": r"URL: \S*/form",
+         "response": {"thought": "Ищу товар", "is_done": False,
+                      "options": [{"action": "BATCH", "args": {"actions": [
+                          {"action": "TYPE", "args": {"index": 1, "text": "ноутбук"}},
+                          {"action": "CLICK", "args": {"index": 2}},
+                      ]}}]}},
+        {"match": r"URL: \S*/delayed",
+         "response": {"thought": "Жду загрузки", "is_done": False,
+                      "options": [{"action": "CLICK", "args": {"index": 0}}]}},
+        {"match": r"",
+         "response": {"thought": "Открываю форму поиска", "is_done": False,
+                      "options": [{"action": "NAVIGATE", "args": {"url": "{base_url}/form"}}]}},
+    ],
+}
+
+
+def _render(response, base_url: str) -> str:
+    text = response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+    return text.replace("{base_url}", base_url)
+
+
+class StubLLM:
+    """Выбор ответа по сценарию и счётчики запросов по правилам."""
+
+    def __init__(self, scenario: dict, base_url: str = ""):
+        self.scenario = scenario
+        self.base_url = base_url
+        self.rules = [(re.compile(rule["match"]), rule) for rule in scenario["rules"]]
+        self.hits = [0] * len(self.rules)
+        self.requests = 0
+        self.slow = 0
+        self._random = random.Random(scenario.get("seed"))
+        self._lock = threading.Lock()
+
+    def answer(self, prompt: str):
+        """Возвращает (текст ответа, задержка в секундах)."""
+        with self._lock:
+            self.requests += 1
+            for i, (pattern, rule) in enumerate(self.rules):
+                if pattern.search(prompt):
+                    self.hits[i] += 1
+                    break
+            else:
+                return "{}", 0.0
+        text = _render(rule["response"], self.base_url)
+        think = self.scenario.get("think")
+        if think:
+            text = f"<think>{think}</think>{text}"
+        delay = rule.get("delay_ms", self.scenario.get("delay_ms", 0)) / 1000
+        with self._lock:
+            if self._random.random() < self.scenario.get("slow_share", 0.0):
+                self.slow += 1
+                delay += self.scenario.get("slow_ms", 0) / 1000
+        return text, delay
+
+
+def _make_handler(stub: StubLLM):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if "response_format" in payload and not stub.scenario.get("json_mode", True):
+                self._send_error(400, "Unsupported parameter: response_format")
+                return
+            prompt = "\n".join(str(m.get("content", "")) for m in payload.get("messages", []))
+            text, delay = stub.answer(prompt)
+            if delay:
+                time.sleep(delay)
+
+            if payload.get("stream"):
+                self._send_stream(payload.get("model", "stub"), text)
+            else:
+                self._send_json(payload.get("model", "stub"), text)
+
+        def _send_error(self, status: int, message: str):
+            body = json.dumps({"error": {"message": message}}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, model: str, text: str):
+            body = json.dumps({
+                "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+            }, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, model: str, text: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            size = stub.scenario.get("chunk_size", 16)
+            try:
+                for start in range(0, len(text), size):
+                    chunk = {"object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": text[start:start + size]}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент закрыл поток, как только собрал JSON.
+                pass
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub_llm(scenario: dict = None, base_url: str = "", host: str = "127.0.0.1", port: int = 0):
+    """Запускает заглушку в фоновом потоке, возвращает (server, stub, url эндпоинта)."""
+    stub = StubLLM(scenario or DEFAULT_SCENARIO, base_url)
+    server = ThreadingHTTPServer((host, port), _make_handler(stub))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub, f"http://{host}:{server.server_port}/v1/chat/completions"
+
+
+def load_scenario(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого LLM")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--scenario", help="JSON-файл сценария (по умолчанию — сценарий для фикстур)")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8100", help="адрес фикстур для {base_url}")
+    args = parser.parse_args()
+
+    server, _, url = start_stub_llm(load_scenario(args.scenario) if args.scenario else None,
+                                    args.base_url, port=args.port)
+    print(f"🤖 Заглушка LLM на {url}")
+    server.serve_forever()
@@ -0,0 +1,132 @@
+"""
+Движки извлечения интерактивных элементов.
+
+- css — обход DOM по INTERACTIVE_SELECTORS (extraction.py). Находит всё, но
+  [aria-label] цепляет и обёртки вокруг кнопок, так что элементы дублируются;
+- accessibility — снимок дерева доступности Playwright (aria_snapshot, в старых
+  версиях page.accessibility.snapshot): только узлы интерактивных ролей, по
+  одному на элемент, с ролью и доступным именем. Узлы находятся через
+  get_by_role — один evaluate_all на роль.
+
+Оба движка строят один и тот же снимок в странице (window.__mcpSnapshot), поэтому
+click/type работают по индексам одинаково. Движок выбирается MCP_EXTRACTION_BACKEND
+или аргументом backend у getElements.
+"""
+import json
+import re
+from collections import Counter
+
+from extraction import (
+    COLLECT_ROLE_JS, INTERACTIVE_SELECTORS, ROLE_SNAPSHOT_JS, extract_snapshot, extract_snapshot_page,
+)
+
+INTERACTIVE_ROLES = (
+    "button", "link", "textbox", "searchbox", "combobox", "checkbox", "radio", "switch",
+    "tab", "menuitem", "menuitemcheckbox", "menuitemradio", "option", "slider", "spinbutton", "treeitem",
+)
+
+# Строка aria_snapshot: «- role "имя" [признаки]:»; ключ со спецсимволами YAML берёт в одинарные кавычки.
+_ARIA_LINE = re.compile(r'^- (?P<role>[a-z]+)(?: (?P<name>"(?:[^"\\]|\\.)*"))?(?P<props>(?: \[[^\]]*\])*)')
+
+
+def parse_aria_snapshot(text: str) -> list:
+    """Узлы интерактивных ролей из YAML aria_snapshot: [(роль, имя, disabled), ...]."""
+    nodes = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("- '") and line.rstrip(":").endswith("'"):
+            line = "- " + line.rstrip(":")[3:-1].replace("''", "'")
+        match = _ARIA_LINE.match(line)
+        if match is None or match["role"] not in INTERACTIVE_ROLES:
+            continue
+        try:
+            name = json.loads(match["name"]) if match["name"] else ""
+        except ValueError:
+            name = match["name"][1:-1]
+        nodes.append((match["role"], name, "[disabled" in match["props"]))
+    return nodes
+
+
+def _flatten_accessibility_tree(node, out: list) -> list:
+    if node.get("role") in INTERACTIVE_ROLES:
+        out.append((node["role"], node.get("name") or "", bool(node.get("disabled"))))
+    for child in node.get("children") or []:
+        _flatten_accessibility_tree(child, out)
+    return out
+
+
+async def aria_nodes(page) -> list:
+    """Интерактивные узлы дерева доступности в порядке документа."""
+    body = page.locator("body")
+    if hasattr(body, "aria_snapshot"):
+        return parse_aria_snapshot(await body.aria_snapshot())
+    tree = await page.accessibility.snapshot()
+    return _flatten_accessibility_tree(tree or {}, [])
+
+
+class ExtractionBackend:
+    name = ""
+    # Чего ждёт wait_for_page_ready: появления хоть одного такого элемента.
+    ready_selector = INTERACTIVE_SELECTORS
+
+    async def snapshot(self, page, snapshot_id, geometry=False, details=False):
+        """Строит снимок; возвращает (элементы, стабильные id узлов)."""
+        raise NotImplementedError
+
+    async def snapshot_page(self, page, snapshot_id, offset=None, limit=200, geometry=False, details=False):
+        """Страница снимка, как extraction.extract_snapshot_page."""
+        raise NotImplementedError
+
+
+class CssBackend(ExtractionBackend):
+    name = "css"
+
+    async def snapshot(self, page, snapshot_id, geometry=False, details=False):
+        return await extract_snapshot(page, snapshot_id, geometry=geometry, details=details)
+
+    async def snapshot_page(self, page, snapshot_id, offset=None, limit=200, geometry=False, details=False):
+        return await extract_snapshot_page(page, snapshot_id, offset, limit, geometry=geometry, details=details)
+
+
+class AccessibilityBackend(ExtractionBackend):
+    name = "accessibility"
+
+    async def _build(self, page, snapshot_id, geometry, details, describe_all):
+        nodes = await aria_nodes(page)
+        per_role = Counter(role for role, _, _ in nodes)
+        found = {role: await page.get_by_role(role).evaluate_all(COLLECT_ROLE_JS, role) for role in per_role}
+
+        # Обычно k-й узел роли в дереве — k-й результат get_by_role(role). Если числа
+        # не сошлись, узлы этой роли ищутся по точному имени.
+        by_name = {role for role, count in per_role.items() if found[role] != count}
+        for role, name in {(role, name) for role, name, _ in nodes if role in by_name}:
+            await page.get_by_role(role, name=name, exact=True).evaluate_all(COLLECT_ROLE_JS, f"{role}\n{name}")
+
+        seen = Counter()
+        picks = []
+        for role, name, disabled in nodes:
+            key = f"{role}\n{name}" if role in by_name else role
+            k = seen[key]
+            seen[key] += 1
+            if not disabled:
+                picks.append([key, k, role, name])
+        return await page.evaluate(ROLE_SNAPSHOT_JS, [picks, snapshot_id, geometry, details, describe_all])
+
+    async def snapshot(self, page, snapshot_id, geometry=False, details=False):
+        elements, ids = await self._build(page, snapshot_id, geometry, details, True)
+        return elements, ids
+
+    async def snapshot_page(self, page, snapshot_id, offset=None, limit=200, geometry=False, details=False):
+        if offset is None:
+            await self._build(page, snapshot_id, geometry, details, False)
+        return await extract_snapshot_page(page, snapshot_id, offset, limit, selectors=None,
+                                           geometry=geometry, details=details)
+
+
+BACKENDS = {backend.name: backend for backend in (CssBackend(), AccessibilityBackend())}
+
+
+def get_backend(name: str) -> ExtractionBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный движок извлечения {name!r}. Доступны: {', '.join(BACKENDS)}")
+    return BACKENDS[name]
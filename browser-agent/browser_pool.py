@@ -0,0 +1,84 @@
+"""
+Пул прогретых контекстов браузера.
+
+Контексты со вкладкой создаются заранее (create — корутина, возвращающая
+(context, page)), поэтому новая сессия получает готовый контекст сразу.
+Перед выдачей и при периодической проверке вкладка отвечает на evaluate
+с таймаутом; сломанные контексты закрываются и заменяются новыми.
+"""
+import asyncio
+
+HEALTH_TIMEOUT = 2.0
+
+
+async def is_healthy(page) -> bool:
+    if page is None or page.is_closed():
+        return False
+    try:
+        await asyncio.wait_for(page.evaluate("1"), HEALTH_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+
+async def close_quietly(context):
+    try:
+        await context.close()
+    except Exception:
+        pass
+
+
+class ContextPool:
+    def __init__(self, size: int, create):
+        self.size = size
+        self._create = create
+        self._ready = []
+        self._filling = None
+        self.recycled = 0
+
+    def ready(self) -> int:
+        return len(self._ready)
+
+    def refill(self):
+        """Запускает дозаполнение пула в фоне, если оно ещё не идёт."""
+        if self.size > 0 and (self._filling is None or self._filling.done()):
+            self._filling = asyncio.create_task(self._fill())
+
+    async def _fill(self):
+        while len(self._ready) < self.size:
+            try:
+                self._ready.append(await self._create())
+            except Exception as e:
+                print(f"⚠️ Не удалось прогреть контекст: {e}")
+                return
+
+    async def acquire(self):
+        """Отдаёт здоровый прогретый контекст (context, page) или создаёт новый."""
+        while self._ready:
+            context, page = self._ready.pop(0)
+            if await is_healthy(page):
+                self.refill()
+                return context, page
+            self.recycled += 1
+            await close_quietly(context)
+        self.refill()
+        return await self._create()
+
+    async def check(self):
+        """Проверяет прогретые контексты, сломанные закрывает и дозаполняет пул."""
+        waiting, self._ready = self._ready, []
+        for context, page in waiting:
+            if await is_healthy(page):
+                self._ready.append((context, page))
+            else:
+                self.recycled += 1
+                print("♻️ Прогретый контекст не отвечает — заменяю")
+                await close_quietly(context)
+        self.refill()
+
+    async def close_all(self):
+        if self._filling is not None:
+            self._filling.cancel()
+        waiting, self._ready = self._ready, []
+        for context, _ in waiting:
+            await close_quietly(context)
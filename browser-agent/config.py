@@ -0,0 +1,109 @@
+"""
+Настройки запуска браузера.
+
+Профиль выбирается переменной MCP_PROFILE:
+- default — как раньше: Firefox с окном, личный профиль, slow_mo и ввод по буквам;
+- fast — для продакшена: headless, без slow_mo, блокировка картинок, шрифтов,
+  медиа и трекеров, ввод через fill/insertText.
+
+Поверх профиля применяются JSON-файл из MCP_CONFIG (те же ключи, что в PROFILES)
+и отдельные переменные окружения MCP_BROWSER, MCP_HEADLESS, MCP_SLOW_MO,
+MCP_USER_DATA_DIR, MCP_STORAGE_STATE, MCP_WARM_CONTEXTS, MCP_BLOCK_RESOURCES,
+MCP_BLOCK_DOMAINS, MCP_INPUT_MODE, MCP_TYPE_DELAY, MCP_EXTRACTION_BACKEND
+(списки — через запятую, пустая строка — «нет»).
+
+storage_state — JSON со снимком cookies и localStorage (его пишет инструмент
+save_storage_state). Если он задан, контексты создаются из него в обычном
+браузере, а профиль user_data_dir не открывается: это в разы быстрее.
+warm_contexts — сколько контекстов держать прогретыми для новых сессий.
+extraction_backend — движок getElements по умолчанию: css или accessibility (см. backends.py).
+"""
+import json
+import os
+
+TRACKER_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "googlesyndication.com", "adservice.google.com",
+    "mc.yandex.ru", "an.yandex.ru", "yandexadexchange.net", "ads.adfox.ru",
+    "top-fwz1.mail.ru", "connect.facebook.net", "hotjar.com", "criteo.com",
+    "scorecardresearch.com", "mixpanel.com", "segment.io",
+]
+
+PROFILES = {
+    "default": {
+        "browser": "firefox",
+        "headless": False,
+        "slow_mo": 300,
+        "user_data_dir": "/home/q/.mozilla/firefox/nsaalvuw.default-release",
+        "storage_state": None,
+        "warm_contexts": 0,
+        "block_resources": [],
+        "block_domains": [],
+        "input_mode": "type",
+        "type_delay": 50,
+        "extraction_backend": "css",
+    },
+    "fast": {
+        "browser": "firefox",
+        "headless": True,
+        "slow_mo": 0,
+        "user_data_dir": None,
+        "storage_state": None,
+        "warm_contexts": 2,
+        "block_resources": ["image", "font", "media"],
+        "block_domains": TRACKER_DOMAINS,
+        "input_mode": "fill",
+        "type_delay": 0,
+        "extraction_backend": "css",
+    },
+}
+
+
+def _env_list(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+_ENV_OVERRIDES = {
+    "MCP_BROWSER": ("browser", str),
+    "MCP_HEADLESS": ("headless", lambda v: v.lower() in ("1", "true", "yes")),
+    "MCP_SLOW_MO": ("slow_mo", int),
+    "MCP_USER_DATA_DIR": ("user_data_dir", lambda v: v or None),
+    "MCP_STORAGE_STATE": ("storage_state", lambda v: v or None),
+    "MCP_WARM_CONTEXTS": ("warm_contexts", int),
+    "MCP_BLOCK_RESOURCES": ("block_resources", _env_list),
+    "MCP_BLOCK_DOMAINS": ("block_domains", _env_list),
+    "MCP_INPUT_MODE": ("input_mode", str),
+    "MCP_TYPE_DELAY": ("type_delay", int),
+    "MCP_EXTRACTION_BACKEND": ("extraction_backend", str),
+}
+
+
+def load_config() -> dict:
+    name = os.getenv("MCP_PROFILE", "default")
+    if name not in PROFILES:
+        raise ValueError(f"❌ Неизвестный профиль MCP_PROFILE={name}. Доступны: {', '.join(PROFILES)}")
+    config = dict(PROFILES[name], profile=name)
+
+    path = os.getenv("MCP_CONFIG")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+
+    for variable, (key, parse) in _ENV_OVERRIDES.items():
+        value = os.getenv(variable)
+        if value is not None:
+            config[key] = parse(value)
+
+    if config["browser"] not in ("chromium", "firefox", "webkit"):
+        raise ValueError(f"❌ browser должен быть chromium, firefox или webkit, а не {config['browser']!r}")
+    if config["input_mode"] not in ("type", "fill"):
+        raise ValueError(f"❌ input_mode должен быть 'type' или 'fill', а не {config['input_mode']!r}")
+    if config["extraction_backend"] not in ("css", "accessibility"):
+        raise ValueError(f"❌ extraction_backend должен быть 'css' или 'accessibility', "
+                         f"а не {config['extraction_backend']!r}")
+    return config
+
+
+def is_blocked_host(host: str, domains: list) -> bool:
+    host = host.lower()
+    return any(host == d or host.endswith("." + d) for d in domains)
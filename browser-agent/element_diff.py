@@ -0,0 +1,55 @@
+"""
+Дифф между двумя снимками getElements.
+
+Узлы сопоставляются по стабильным id из страницы, поэтому вставка одного
+элемента в начало списка не делает «изменёнными» все остальные.
+Формат ответа:
+    count      — сколько элементов в новом снимке;
+    added      — новые элементы с их индексом и id;
+    changed    — те же узлы с другим тегом, подписью, типом или атрибутами;
+    removed    — id пропавших узлов;
+    unchanged  — отрезки [new_start, old_start, length]: элементы
+                 new[new_start + k] совпадают с old[old_start + k];
+    moved      — только с geometry=True: {index, y, in_viewport} неизменившихся
+                 элементов, у которых сдвинулось положение (например, после прокрутки).
+"""
+FIELDS = ("tag", "text", "type", "attrs")
+GEOMETRY_FIELDS = ("y", "in_viewport")
+
+
+def diff_elements(old_ids: list, old_elements: list, new_ids: list, new_elements: list,
+                  geometry: bool = False) -> dict:
+    old_by_id = {node_id: i for i, node_id in enumerate(old_ids)}
+    added, changed, unchanged, moved = [], [], [], []
+
+    for i, (node_id, element) in enumerate(zip(new_ids, new_elements)):
+        old_index = old_by_id.get(node_id)
+        if old_index is None:
+            added.append({"index": i, "id": node_id, **element})
+            continue
+        old_element = old_elements[old_index]
+        if any(old_element.get(f) != element.get(f) for f in FIELDS):
+            changed.append({"index": i, "id": node_id, **element})
+            continue
+        # Сдвиг не делает элемент изменённым, но клиенту нужно свежее положение,
+        # а не то, что осталось в его копии прошлого снимка.
+        if geometry and any(old_element.get(f) != element.get(f) for f in GEOMETRY_FIELDS):
+            moved.append({"index": i, **{f: element.get(f) for f in GEOMETRY_FIELDS}})
+        last = unchanged[-1] if unchanged else None
+        if last and last[0] + last[2] == i and last[1] + last[2] == old_index:
+            last[2] += 1
+        else:
+            unchanged.append([i, old_index, 1])
+
+    new_id_set = set(new_ids)
+    removed = [node_id for node_id in old_ids if node_id not in new_id_set]
+    diff = {
+        "count": len(new_elements),
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": unchanged,
+    }
+    if geometry:
+        diff["moved"] = moved
+    return diff
@@ -0,0 +1,35 @@
+"""
+Компактная передача ответов MCP-сервера.
+
+- encode_columns: список элементов [{tag, text, type, ...}, ...] превращается в
+  {"count": N, "columns": {"tag": [...], "text": [...], ...}} — ключи не повторяются
+  в каждом элементе;
+- pack_response: если клиент принимает application/msgpack и пакет msgpack
+  установлен, ответ кодируется им, иначе остаётся JSON.
+"""
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPE = "application/msgpack"
+
+
+def encode_columns(elements: list) -> dict:
+    keys = []
+    for element in elements:
+        for key in element:
+            if key not in keys:
+                keys.append(key)
+    return {
+        "count": len(elements),
+        "columns": {key: [element.get(key) for element in elements] for key in keys},
+    }
+
+
+def pack_response(accept: str, payload):
+    if msgpack is not None and MSGPACK_TYPE in (accept or ""):
+        return Response(msgpack.packb(payload, use_bin_type=True), media_type=MSGPACK_TYPE)
+    return payload
@@ -0,0 +1,376 @@
+"""
+Извлечение интерактивных элементов страницы.
+
+Весь список строится внутри страницы одним вызовом evaluate: видимость,
+доступность, тег, подпись и тип элемента считаются в JS, а не через
+отдельные round trip'ы Playwright на каждый handle.
+"""
+
+INTERACTIVE_SELECTORS = (
+    "button, a[href], [role='button'], "
+    "input:not([type='hidden']):not([type='button']):not([type='submit']), "
+    "textarea, [aria-label], div[contenteditable='true'], div[contenteditable='']"
+)
+
+# Вспомогательные функции повторяют проверки Playwright:
+# - query: как query_selector_all, заходит в открытые shadow root;
+# - isVisible: как ElementHandle.is_visible (visibility + ненулевой bbox);
+# - isEnabled: как ElementHandle.is_enabled (disabled, fieldset, aria-disabled — только у ролей
+#   из списка Playwright; неявная роль определяется по тегу упрощённо).
+_JS_HELPERS = r"""
+const NATIVE_CONTROLS = ['BUTTON', 'INPUT', 'SELECT', 'TEXTAREA', 'OPTION', 'OPTGROUP'];
+
+function query(root, selectors, out) {
+    for (const el of root.querySelectorAll(selectors)) out.push(el);
+    for (const el of root.querySelectorAll('*')) {
+        if (el.shadowRoot) query(el.shadowRoot, selectors, out);
+    }
+    return out;
+}
+
+function isTextNodeVisible(node) {
+    const range = document.createRange();
+    range.selectNode(node);
+    const rect = range.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0;
+}
+
+function isVisible(el) {
+    const style = getComputedStyle(el);
+    if (!style) return true;
+    if (style.display === 'contents') {
+        for (let child = el.firstChild; child; child = child.nextSibling) {
+            if (child.nodeType === 1 && isVisible(child)) return true;
+            if (child.nodeType === 3 && isTextNodeVisible(child)) return true;
+        }
+        return false;
+    }
+    if (el.checkVisibility && !el.checkVisibility()) return false;
+    if (style.visibility !== 'visible') return false;
+    const rect = el.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0;
+}
+
+function inDisabledFieldset(el) {
+    const fieldset = el.closest('fieldset[disabled]');
+    if (!fieldset) return false;
+    const legend = fieldset.querySelector(':scope > legend');
+    return !legend || !legend.contains(el);
+}
+
+// Роли, для которых Playwright учитывает aria-disabled (kAriaDisabledRoles в roleUtils).
+const ARIA_DISABLED_ROLES = new Set([
+    'application', 'button', 'composite', 'gridcell', 'group', 'input', 'link', 'menuitem', 'scrollbar',
+    'separator', 'tab', 'checkbox', 'columnheader', 'combobox', 'grid', 'listbox', 'menu', 'menubar',
+    'menuitemcheckbox', 'menuitemradio', 'option', 'radio', 'radiogroup', 'row', 'rowheader', 'searchbox',
+    'select', 'slider', 'spinbutton', 'switch', 'tablist', 'textbox', 'toolbar', 'tree', 'treegrid', 'treeitem',
+]);
+const INPUT_ROLES = {
+    checkbox: 'checkbox', radio: 'radio', range: 'slider', number: 'spinbutton', search: 'searchbox',
+    button: 'button', submit: 'button', reset: 'button', image: 'button',
+};
+
+function ariaRole(el) {
+    const explicit = (el.getAttribute('role') || '').trim().split(/\s+/)[0];
+    if (explicit) return explicit;
+    switch (el.tagName) {
+        case 'BUTTON': case 'SUMMARY': return 'button';
+        case 'A': case 'AREA': return el.hasAttribute('href') ? 'link' : '';
+        case 'TEXTAREA': return 'textbox';
+        case 'SELECT': return el.multiple || el.size > 1 ? 'listbox' : 'combobox';
+        case 'OPTION': return 'option';
+        case 'FIELDSET': case 'OPTGROUP': return 'group';
+        case 'INPUT': {
+            const type = (el.getAttribute('type') || 'text').toLowerCase();
+            return INPUT_ROLES[type] || (el.hasAttribute('list') ? 'combobox' : 'textbox');
+        }
+    }
+    return '';
+}
+
+function isAriaDisabled(el) {
+    // Как hasExplicitAriaDisabled в Playwright: aria-disabled самого элемента и его
+    // предков учитывается, только если у элемента роль из ARIA_DISABLED_ROLES.
+    if (!ARIA_DISABLED_ROLES.has(ariaRole(el))) return false;
+    for (let node = el; node; node = node.parentElement || (node.getRootNode() || {}).host) {
+        const value = (node.getAttribute('aria-disabled') || '').toLowerCase();
+        if (value === 'true') return true;
+        if (value === 'false') return false;
+    }
+    return false;
+}
+
+function isEnabled(el) {
+    if (NATIVE_CONTROLS.includes(el.tagName)) {
+        if (el.hasAttribute('disabled')) return false;
+        if (el.tagName === 'OPTION' && el.closest('optgroup[disabled]')) return false;
+        if (inDisabledFieldset(el)) return false;
+    }
+    return !isAriaDisabled(el);
+}
+
+function collect(selectors) {
+    return query(document, selectors, []).filter(el => isVisible(el) && isEnabled(el));
+}
+
+function describe(el) {
+    const tag = el.tagName.toLowerCase();
+    const text = (el.textContent || '').trim();
+    const placeholder = el.getAttribute('placeholder') || '';
+    const ariaLabel = el.getAttribute('aria-label') || '';
+    const title = el.getAttribute('title') || '';
+
+    let label = ariaLabel || text || placeholder || title || `<${tag}>`;
+    // Array.from режет по символам, как срез строки в Python, а не по UTF-16.
+    label = Array.from(label.replace(/\n/g, ' ').trim()).slice(0, 80).join('');
+
+    const contenteditable = el.getAttribute('contenteditable');
+    const isContenteditable = contenteditable !== null
+        && ['', 'true'].includes(contenteditable.trim().toLowerCase());
+    const isInputTag = tag === 'input' || tag === 'textarea';
+    return {tag: tag, text: label, type: isInputTag || isContenteditable ? 'input' : 'clickable'};
+}
+
+// describe + положение: y от верха документа и попадание в видимую часть окна.
+function describeWithGeometry(el) {
+    const info = describe(el);
+    const rect = el.getBoundingClientRect();
+    info.y = Math.round(rect.top + window.scrollY);
+    info.in_viewport = rect.bottom > 0 && rect.right > 0
+        && rect.top < window.innerHeight && rect.left < window.innerWidth;
+    return info;
+}
+
+// Атрибуты, по которым элемент узнаётся на той же странице в другой раз.
+const FINGERPRINT_ATTRS = ['id', 'name', 'role', 'href', 'placeholder', 'aria-label', 'title', 'type'];
+
+function attributesOf(el) {
+    const attrs = {};
+    for (const name of FINGERPRINT_ATTRS) {
+        const value = el.getAttribute(name);
+        if (value) attrs[name] = Array.from(value.trim()).slice(0, 120).join('');
+    }
+    return attrs;
+}
+"""
+
+# Снимок: узлы из последнего getElements хранятся в window.__mcpSnapshot,
+# чтобы click/type брали элемент по индексу без повторного обхода DOM.
+# MutationObserver помечает снимок устаревшим при любом изменении документа.
+_JS_SNAPSHOT = r"""
+// Стабильный id узла: живёт, пока узел в документе. Префикс документа не даёт
+// спутать узлы до и после навигации.
+function stableId(node) {
+    if (!window.__mcpIds) {
+        window.__mcpIds = new WeakMap();
+        window.__mcpNextId = 1;
+        window.__mcpDoc = Math.random().toString(36).slice(2, 8);
+    }
+    let id = window.__mcpIds.get(node);
+    if (id === undefined) {
+        id = `${window.__mcpDoc}:${window.__mcpNextId++}`;
+        window.__mcpIds.set(node, id);
+    }
+    return id;
+}
+
+function remember(nodes, snapshotId) {
+    window.__mcpSnapshot = {id: snapshotId, nodes: nodes, stale: false};
+    if (!window.__mcpObserver) {
+        window.__mcpObserver = new MutationObserver(() => {
+            if (window.__mcpSnapshot) window.__mcpSnapshot.stale = true;
+        });
+        window.__mcpObserver.observe(document, {
+            childList: true, subtree: true, attributes: true, characterData: true
+        });
+    }
+}
+"""
+
+# Постраничная выдача: при первом вызове узлы упорядочиваются «сначала видимые»
+# и порядок хранится в снимке (snap.order). Следующие страницы берутся из того же
+# снимка, а index элемента — его номер в снимке, тот же, что у click/type.
+_JS_VIEWPORT_ORDER = r"""
+// Сначала элементы в окне, затем ниже сгиба сверху вниз, затем выше окна.
+function viewportOrder(nodes) {
+    const height = window.innerHeight;
+    const keyed = nodes.map((el, i) => {
+        const rect = el.getBoundingClientRect();
+        const band = rect.bottom <= 0 ? 2 : (rect.top < height ? 0 : 1);
+        return [band, band === 1 ? rect.top : 0, i];
+    });
+    keyed.sort((a, b) => a[0] - b[0] || a[1] - b[1] || a[2] - b[2]);
+    return keyed.map(item => item[2]);
+}
+"""
+
+# Снимок по дереву доступности хранит для узлов роль и доступное имя (snap.labels):
+# имя заменяет подпись, собранную describe.
+_JS_LABELS = r"""
+function labelOf(snap, i) {
+    if (!snap.labels) return {};
+    const [role, name] = snap.labels[i];
+    const label = {role: role};
+    if (name) label.text = Array.from(name.replace(/\n/g, ' ').trim()).slice(0, 80).join('');
+    return label;
+}
+"""
+
+_JS_DESCRIBE_NODE = (
+    "const describeNode = (el) => {"
+    "  const info = geometry ? describeWithGeometry(el) : describe(el);"
+    "  if (details) info.attrs = attributesOf(el);"
+    "  return info; };"
+)
+
+EXTRACT_JS = "(selectors) => {" + _JS_HELPERS + "return collect(selectors).map(describe); }"
+
+SNAPSHOT_JS = (
+    "([selectors, snapshotId, geometry, details]) => {" + _JS_HELPERS + _JS_SNAPSHOT + _JS_DESCRIBE_NODE
+    + "const nodes = collect(selectors); remember(nodes, snapshotId);"
+    + "return [nodes.map(describeNode), nodes.map(stableId)]; }"
+)
+
+SNAPSHOT_PAGE_JS = (
+    "([selectors, snapshotId, offset, limit, geometry, details]) => {"
+    + _JS_HELPERS + _JS_SNAPSHOT + _JS_VIEWPORT_ORDER + _JS_LABELS + _JS_DESCRIBE_NODE
+    # selectors === null — снимок snapshotId уже построен (см. ROLE_SNAPSHOT_JS), нужен только порядок.
+    + "if (offset === null) {"
+    + "  if (selectors !== null) remember(collect(selectors), snapshotId);"
+    + "  const built = window.__mcpSnapshot;"
+    + "  if (!built || built.id !== snapshotId) return null;"
+    + "  built.order = viewportOrder(built.nodes); offset = 0; }"
+    + "const snap = window.__mcpSnapshot;"
+    + "if (!snap || snap.id !== snapshotId || !snap.order) return null;"
+    + "const page = snap.order.slice(offset, offset + limit);"
+    + "return [page.map(i => Object.assign(describeNode(snap.nodes[i]), labelOf(snap, i), {index: i})),"
+    + "        page.map(i => stableId(snap.nodes[i])), snap.order.length]; }"
+)
+
+# Узлы одной роли (или роли с именем) складываются в window.__mcpRoleNodes[key]
+# вызовом locator.evaluate_all, а ROLE_SNAPSHOT_JS собирает из них снимок по
+# списку [key, номер, роль, имя] без ElementHandle на каждый узел.
+COLLECT_ROLE_JS = """(nodes, key) => {
+    (window.__mcpRoleNodes = window.__mcpRoleNodes || {})[key] = nodes;
+    return nodes.length;
+}"""
+
+ROLE_SNAPSHOT_JS = (
+    "([picks, snapshotId, geometry, details, describeAll]) => {"
+    + _JS_HELPERS + _JS_SNAPSHOT + _JS_LABELS + _JS_DESCRIBE_NODE
+    + "const found = window.__mcpRoleNodes || {}; const seen = new Set();"
+    + "const nodes = [], labels = [];"
+    + "for (const [key, k, role, name] of picks) {"
+    + "  const node = (found[key] || [])[k];"
+    + "  if (!node || seen.has(node)) continue;"
+    + "  seen.add(node); nodes.push(node); labels.push([role, name]); }"
+    + "window.__mcpRoleNodes = null;"
+    + "remember(nodes, snapshotId); window.__mcpSnapshot.labels = labels;"
+    + "if (!describeAll) return nodes.length;"
+    + "return [nodes.map((el, i) => Object.assign(describeNode(el), labelOf(window.__mcpSnapshot, i))),"
+    + "        nodes.map(stableId)]; }"
+)
+
+# Возвращает [узел или null, сведения о снимке и элементе].
+RESOLVE_JS = r"""([index, snapshotId]) => {
+    const snap = window.__mcpSnapshot;
+    if (!snap) return [null, {status: 'missing'}];
+    if (snapshotId !== null && snap.id !== snapshotId) {
+        return [null, {status: 'mismatch', current: snap.id}];
+    }
+    if (index >= snap.nodes.length) {
+        return [null, {status: 'range', count: snap.nodes.length}];
+    }
+    const node = snap.nodes[index];
+    if (!node.isConnected) return [null, {status: 'detached', snapshot_id: snap.id}];
+    const tag = node.tagName.toLowerCase();
+    const contenteditable = node.getAttribute('contenteditable');
+    const editable = contenteditable === '' || contenteditable === 'true';
+    return [node, {
+        status: 'ok',
+        snapshot_id: snap.id,
+        stale: snap.stale,
+        editable: editable,
+        is_input: tag === 'input' || tag === 'textarea' || editable
+    }];
+}"""
+
+
+async def extract_elements(page, selectors=INTERACTIVE_SELECTORS):
+    """Возвращает список {tag, text, type} за один вызов evaluate."""
+    return await page.evaluate(EXTRACT_JS, selectors)
+
+
+async def extract_snapshot(page, snapshot_id, selectors=INTERACTIVE_SELECTORS, geometry=False, details=False):
+    """
+    Как extract_elements, но дополнительно запоминает узлы в странице под snapshot_id.
+    geometry=True добавляет к элементам y и in_viewport, details=True — attrs
+    (id, name, role, href, placeholder, aria-label, title, type).
+    Возвращает (элементы, стабильные id узлов в том же порядке).
+    """
+    elements, ids = await page.evaluate(SNAPSHOT_JS, [selectors, snapshot_id, geometry, details])
+    return elements, ids
+
+
+async def extract_snapshot_page(page, snapshot_id, offset=None, limit=200, selectors=INTERACTIVE_SELECTORS,
+                                geometry=False, details=False):
+    """
+    Страница снимка: limit элементов начиная с offset в порядке «сначала видимые».
+    offset=None строит новый снимок под snapshot_id, иначе читает уже построенный;
+    selectors=None с offset=None только упорядочивает уже построенный снимок snapshot_id.
+    У каждого элемента есть index — его номер в снимке для click/type.
+    Возвращает (элементы, стабильные id, всего элементов) или None, если снимок
+    snapshot_id уже заменён другим getElements.
+    """
+    data = await page.evaluate(SNAPSHOT_PAGE_JS, [selectors, snapshot_id, offset, limit, geometry, details])
+    return tuple(data) if data is not None else None
+
+
+async def resolve_snapshot_element(page, index, snapshot_id=None):
+    """
+    Берёт элемент по индексу из снимка в странице за O(1).
+    Возвращает (ElementHandle или None, словарь со status и сведениями об элементе).
+    snapshot_id=None — использовать последний снимок, каким бы он ни был.
+    """
+    pair = await page.evaluate_handle(RESOLVE_JS, [index, snapshot_id])
+    try:
+        info = await (await pair.get_property("1")).json_value()
+        if info["status"] != "ok":
+            return None, info
+        return (await pair.get_property("0")).as_element(), info
+    finally:
+        await pair.dispose()
+
+
+async def extract_elements_per_handle(page, selectors=INTERACTIVE_SELECTORS):
+    """
+    Прежний путь: несколько round trip'ов Playwright на каждый handle.
+    Оставлен как эталон для бенчмарка и сверки результатов.
+    """
+    handles = await page.query_selector_all(selectors)
+
+    elements = []
+    for el in handles:
+        if not (await el.is_visible() and await el.is_enabled()):
+            continue
+
+        tag = await el.evaluate("el => el.tagName.toLowerCase()")
+        text = (await el.text_content() or '').strip()
+        placeholder = await el.get_attribute("placeholder") or ""
+        aria_label = await el.get_attribute("aria-label") or ""
+        title = await el.get_attribute("title") or ""
+
+        label = aria_label or text or placeholder or title or f"<{tag}>"
+        label = label.replace("\n", " ").strip()[:80]
+
+        is_input_tag = tag in ("input", "textarea")
+        contenteditable = await el.get_attribute("contenteditable")
+        is_contenteditable = contenteditable is not None and contenteditable.strip().lower() in ("", "true")
+        elem_type = "input" if is_input_tag or is_contenteditable else "clickable"
+
+        elements.append({
+            "tag": tag,
+            "text": label,
+            "type": elem_type
+        })
+    return elements
@@ -1,191 +1,495 @@
-from fastapi import FastAPI
-from playwright.sync_api import sync_playwright
-import queue
-import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from playwright.async_api import async_playwright
+import asyncio
+import itertools
+import json
+import os
 import time
+import uuid
 import uvicorn
-from typing import Optional
+from urllib.parse import urlsplit
 
-app = FastAPI()
+from backends import get_backend
+from browser_pool import ContextPool, close_quietly
+from config import is_blocked_host, load_config
+from element_diff import diff_elements
+from encoding import encode_columns, pack_response
+from extraction import resolve_snapshot_element
+from metrics import Metrics
+from sessions import DEFAULT_SESSION, SessionPool
+from settle import PageActivity, wait_for_stable
+
+config = load_config()
 
-browser_thread: Optional[threading.Thread] = None
 playwright_instance = None
-browser = None
-page = None
+# Контекст с профилем пользователя для основной сессии (если задан user_data_dir и нет storage_state).
+persistent_context = None
+# Общий браузер для остальных контекстов: они изолированы друг от друга.
+shared_browser = None
+_browser_lock = asyncio.Lock()
+server = None
 
-command_queue = queue.Queue()
-result_queue = queue.Queue()
+snapshot_ids = itertools.count(1)
+
+# Выполняющиеся запросы по id — для инструмента cancel.
+inflight = {}
+# Фоновые задачи без ожидающего: цикл событий держит на задачи только слабые ссылки.
+background_tasks = set()
+
+metrics = Metrics()
+recycled_sessions = 0
+
+DEFAULT_DEADLINE = float(os.getenv("MCP_CALL_DEADLINE_SEC", "300"))
+# Сколько элементов в одной странице getElements (limit/cursor) и в одной строке потока.
+ELEMENTS_PAGE_SIZE = int(os.getenv("MCP_ELEMENTS_PAGE_SIZE", "200"))
+NDJSON_TYPE = "application/x-ndjson"
+
+# Спекулятивная загрузка: сколько фоновых вкладок на сессию и на весь сервер.
+PREFETCH_PER_SESSION = int(os.getenv("MCP_PREFETCH_PER_SESSION", "2"))
+PREFETCH_TOTAL = int(os.getenv("MCP_PREFETCH_TOTAL", "4"))
+prefetch_stats = {"hits": 0, "discarded": 0}
+
+
+async def _launch_browser():
+    browser_type = getattr(playwright_instance, config["browser"])
+    return await browser_type.launch(headless=config["headless"], slow_mo=config["slow_mo"])
+
+
+async def _get_browser():
+    """Общий браузер; если он упал или отключился, запускается заново."""
+    global shared_browser
+    async with _browser_lock:
+        if shared_browser is None or not shared_browser.is_connected():
+            if shared_browser is not None:
+                print("💥 Браузер отключился — перезапускаю")
+            shared_browser = await _launch_browser()
+        return shared_browser
+
+
+async def _new_context():
+    """Контекст общего браузера (из storage_state, если задан) с открытой вкладкой."""
+    browser = await _get_browser()
+    context = await browser.new_context(storage_state=config["storage_state"])
+    await _install_blocklist(context)
+    return context, await context.new_page()
+
+
+contexts = ContextPool(config["warm_contexts"], _new_context)
+
+
+async def _open_session(session):
+    """Создаёт контекст и страницу для сессии при первой команде."""
+    if session.id == DEFAULT_SESSION and persistent_context is not None:
+        # Основная сессия работает в профиле пользователя, как и раньше.
+        session.context = persistent_context
+        session.page = persistent_context.pages[0] if persistent_context.pages else await persistent_context.new_page()
+    else:
+        session.context, session.page = await contexts.acquire()
+    _attach_page(session)
+    print(f"🆕 Сессия '{session.id}' открыта. Стартовая страница: {session.page.url}")
 
-def browser_worker():
-    """Запускается в отдельном потоке. Управляет браузером."""
-    global playwright_instance, browser, page
-    
-    try:
-        playwright_instance = sync_playwright().start()
-        user_profile = "/home/q/.mozilla/firefox/nsaalvuw.default-release"
-        
-        print("🚀 Запуск Firefox...")
-        browser = playwright_instance.firefox.launch_persistent_context(
-            user_data_dir=user_profile,
-            headless=False,
-            slow_mo=300
-        )
-        
-        page = browser.pages[0] if browser.pages else browser.new_page()
-        print(f"✅ Браузер запущен. Стартовая страница: {page.url}")
-        
-        while True:
-            try:
-                command = command_queue.get(timeout=0.5)
-                tool = command.get("tool")
-                args = command.get("args", {})
-                
-                if tool == "navigate":
-                    _handle_navigate(args)
-                elif tool == "wait_for_page_ready":
-                    _handle_wait_for_page_ready()
-                elif tool == "get_url":
-                    _handle_get_url()
-                elif tool == "getElements":
-                    _handle_get_elements()
-                elif tool == "click":
-                    _handle_click(args)
-                elif tool == "type":
-                    _handle_type(args)
-                elif tool == "quit":
-                    _handle_quit()
-                    break
-                else:
-                    result_queue.put({"error": f"Неизвестный инструмент: {tool}"})
-
-            except queue.Empty:
-                continue
-            except Exception as e:
-                print(f"💥 Неожиданная ошибка в основном цикле: {e}")
-                result_queue.put({"error": f"Цикл сломался: {e}"})
 
+def _attach_page(session, activity=None):
+    session.activity = activity or PageActivity(session.page)
+    session.snapshots.clear()
+    session.crashed = False
+    session.page.on("crash", lambda _: setattr(session, "crashed", True))
+
+
+async def _recycle_session(session):
+    """Заменяет вкладку или контекст сессии, если вкладка упала или браузер отключился."""
+    global persistent_context, recycled_sessions
+    recycled_sessions += 1
+    print(f"♻️ [{session.id}] Вкладка недоступна — пересоздаю")
+    await _discard_prefetch(session)
+    if session.context is persistent_context:
+        try:
+            session.page = await persistent_context.new_page()
+            _attach_page(session)
+            return
+        except Exception:
+            # Профиль без перезапуска сервера не поднять — дальше обычный контекст.
+            print("⚠️ Профиль браузера недоступен, основная сессия переходит в обычный контекст")
+            persistent_context = None
+    else:
+        await close_quietly(session.context)
+    await _open_session(session)
+
+
+async def _install_blocklist(context):
+    """Отсекает ресурсы ненужных типов и запросы к трекерам из профиля."""
+    block_resources = set(config["block_resources"])
+    block_domains = config["block_domains"]
+    if not block_resources and not block_domains:
+        return
+
+    async def handle(route):
+        request = route.request
+        host = urlsplit(request.url).hostname or ""
+        if request.resource_type in block_resources or is_blocked_host(host, block_domains):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", handle)
+
+
+async def _close_session(session):
+    if session.context is persistent_context:
+        await _discard_prefetch(session)
+        return
+    try:
+        await session.context.close()
+        print(f"🚪 Сессия '{session.id}' закрыта")
     except Exception as e:
-        print(f"❌ Ошибка в browser_worker: {e}")
-        result_queue.put({"error": f"Запуск браузера сломался: {e}"})
+        print(f"⚠️ Не удалось закрыть сессию '{session.id}': {e}")
+
+
+pool = SessionPool(
+    max_sessions=int(os.getenv("MCP_MAX_SESSIONS", "4")),
+    idle_timeout=float(os.getenv("MCP_SESSION_IDLE_SEC", "900")),
+    open_session=_open_session,
+    close_session=_close_session,
+)
+
+
+async def _sweep_idle_sessions():
+    while True:
+        await asyncio.sleep(30)
+        await pool.close_idle()
+        await contexts.check()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Запускает браузер вместе с сервером и закрывает его при остановке."""
+    global playwright_instance, persistent_context
+    playwright_instance = await async_playwright().start()
+
+    print(f"🚀 Запуск {config['browser']} (профиль {config['profile']})...")
+    if config["storage_state"] and not os.path.exists(config["storage_state"]):
+        print(f"⚠️ Файл storage_state {config['storage_state']} не найден — контексты будут чистыми")
+        config["storage_state"] = None
+    if config["user_data_dir"] and not config["storage_state"]:
+        persistent_context = await getattr(playwright_instance, config["browser"]).launch_persistent_context(
+            user_data_dir=config["user_data_dir"],
+            headless=config["headless"],
+            slow_mo=config["slow_mo"]
+        )
+        await _install_blocklist(persistent_context)
+    else:
+        await _get_browser()
+    contexts.refill()
+    print("✅ Браузер запущен")
+    sweeper = asyncio.create_task(_sweep_idle_sessions())
+    try:
+        yield
     finally:
+        sweeper.cancel()
         try:
-            if browser:
-                browser.close()
-            if playwright_instance:
-                playwright_instance.stop()
-        except:
+            await pool.close_all()
+            await contexts.close_all()
+            if shared_browser:
+                await shared_browser.close()
+            if persistent_context:
+                await persistent_context.close()
+            await playwright_instance.stop()
+        except Exception:
             pass
 
 
-def _handle_navigate(args):
+app = FastAPI(lifespan=lifespan)
+
+
+# Инструменты _dispatch; остальные имена в метриках сводятся к "unknown".
+TOOLS = (
+    "navigate", "wait_for_page_ready", "wait_for_stable", "get_url", "getElements", "click", "type",
+    "prefetch", "discard_prefetch", "batch", "save_storage_state", "close_session", "quit",
+)
+
+
+async def _dispatch(session, tool, args):
+    if tool == "navigate":
+        return await _handle_navigate(session, args)
+    elif tool == "wait_for_page_ready":
+        return await _handle_wait_for_page_ready(session, args)
+    elif tool == "wait_for_stable":
+        return await _handle_wait_for_stable(session, args)
+    elif tool == "get_url":
+        return await _handle_get_url(session)
+    elif tool == "getElements":
+        return await _handle_get_elements(session, args)
+    elif tool in ("click", "type"):
+        # Действие на текущей странице — фоновые вкладки больше не понадобятся.
+        await _discard_prefetch(session)
+        return await (_handle_click if tool == "click" else _handle_type)(session, args)
+    elif tool == "prefetch":
+        return await _handle_prefetch(session, args)
+    elif tool == "discard_prefetch":
+        return {"result": f"Закрыто фоновых вкладок: {await _discard_prefetch(session)}"}
+    elif tool == "batch":
+        return await _handle_batch(session, args)
+    elif tool == "save_storage_state":
+        return await _handle_save_storage_state(session, args)
+    elif tool == "close_session":
+        return await _handle_close_session(session)
+    elif tool == "quit":
+        return _handle_quit()
+    else:
+        return {"error": f"Неизвестный инструмент: {tool}"}
+
+
+async def _handle_navigate(session, args):
     url = args["url"].strip()
     if not url.startswith(("http://", "https://")):
-        result_queue.put({"error": "URL должен начинаться с http:// или https://"})
-        return
-    print(f"🌐 Переход на: {url}")
-    page.goto(url, timeout=300_000)
-    result_queue.put({"result": f"Перешли на {url}"})
+        return {"error": "URL должен начинаться с http:// или https://"}
+    entry = session.prefetched.pop(url, None)
+    await _discard_prefetch(session)
+    if entry is not None and await _swap_prefetched(session, url, entry):
+        return {"result": f"Перешли на {url}", "prefetched": True}
+    print(f"🌐 [{session.id}] Переход на: {url}")
+    await session.page.goto(url, timeout=300_000)
+    return {"result": f"Перешли на {url}"}
 
 
-def _handle_wait_for_page_ready():
-    print("⏳ Ожидание загрузки страницы (до 300 сек)...")
+async def _load_prefetch(context, url):
+    """Открывает url в новой вкладке контекста; вернёт (вкладка, её PageActivity)."""
+    page = await context.new_page()
+    activity = PageActivity(page)
     try:
-        page.wait_for_load_state("networkidle", timeout=300_000)
-        selectors = (
-            "button, a[href], [role='button'], "
-            "input:not([type='hidden']):not([type='button']):not([type='submit']), "
-            "textarea, [aria-label], div[contenteditable='true'], div[contenteditable=''], "
-            "div[class*='plus' i], span[class*='plus' i], "
-            "div[class*='add' i], span[class*='add' i], "
-            "div[class*='button' i], span[class*='button' i], "
-            "div[data-testid*='button' i], div[data-testid*='plus' i], "
-            "div[data-tid*='plus' i], div[data-auto*='plus' i]"
-        )
-        page.wait_for_selector(selectors, state="visible", timeout=150_000)
-        result_queue.put({"result": "Страница готова"})
+        await page.goto(url, timeout=300_000)
+    except (Exception, asyncio.CancelledError):
+        await close_quietly(page)
+        raise
+    return page, activity
+
+
+async def _handle_prefetch(session, args):
+    """
+    Начинает загружать args.urls в фоновых вкладках контекста сессии и сразу отвечает.
+    navigate на один из этих адресов подменяет текущую вкладку загруженной, остальные
+    фоновые вкладки закрываются. Лишние адреса сверх лимитов пропускаются.
+    """
+    started, skipped = [], []
+    for url in args.get("urls") or []:
+        url = str(url).strip()
+        open_total = sum(len(s.prefetched) for s in pool.sessions.values())
+        if (not url.startswith(("http://", "https://")) or url in session.prefetched
+                or len(session.prefetched) >= PREFETCH_PER_SESSION or open_total >= PREFETCH_TOTAL):
+            skipped.append(url)
+            continue
+        task = asyncio.create_task(_load_prefetch(session.context, url))
+        # Ошибку загрузки заберёт navigate или _discard_prefetch; здесь только гасим предупреждение.
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        session.prefetched[url] = {"task": task, "started": time.monotonic()}
+        started.append(url)
+    if started:
+        print(f"🔮 [{session.id}] Загружаю в фоне: {', '.join(started)}")
+    return {"result": f"Загружается в фоне: {len(started)}", "started": started, "skipped": skipped}
+
+
+async def _swap_prefetched(session, url, entry):
+    """Делает загруженную в фоне вкладку текущей; False — если она не загрузилась."""
+    try:
+        page, activity = await entry["task"]
     except Exception as e:
-        result_queue.put({"result": f"Частичная загрузка: {str(e)[:100]}"})
+        print(f"⚠️ [{session.id}] Фоновая загрузка {url} не удалась: {e}")
+        return False
+    old = session.page
+    session.page = page
+    _attach_page(session, activity)
+    await close_quietly(old)
+    try:
+        await page.bring_to_front()
+    except Exception:
+        pass
+    prefetch_stats["hits"] += 1
+    waited_ms = int((time.monotonic() - entry["started"]) * 1000)
+    print(f"⚡ [{session.id}] Переход на {url} из фоновой вкладки (загружалась {waited_ms} мс)")
+    return True
 
 
-def _handle_get_url():
-    current_url = page.url
-    print(f"🔗 Текущий URL: {current_url}")
-    result_queue.put({"result": current_url})
+async def _discard_prefetch(session) -> int:
+    """Закрывает фоновые вкладки сессии; возвращает, сколько их было."""
+    entries, session.prefetched = session.prefetched, {}
+    for entry in entries.values():
+        task = entry["task"]
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            page, _ = task.result()
+            await close_quietly(page)
+    prefetch_stats["discarded"] += len(entries)
+    return len(entries)
 
 
-def _handle_get_elements():
-    selectors = (
-        "button, a[href], [role='button'], "
-        "input:not([type='hidden']):not([type='button']):not([type='submit']), "
-        "textarea, [aria-label], div[contenteditable='true'], div[contenteditable='']"
-    )
-    handles = page.query_selector_all(selectors)
-    
-    elements = []
-    for el in handles:
-        if not (el.is_visible() and el.is_enabled()):
-            continue
-            
-        tag = el.evaluate("el => el.tagName.toLowerCase()")
-        text = (el.text_content() or '').strip()
-        placeholder = el.get_attribute("placeholder") or ""
-        aria_label = el.get_attribute("aria-label") or ""
-        title = el.get_attribute("title") or ""
-        
-        label = aria_label or text or placeholder or title or f"<{tag}>"
-        label = label.replace("\n", " ").strip()[:80]
-        
-        is_input_tag = tag in ("input", "textarea")
-        contenteditable = el.get_attribute("contenteditable")
-        is_contenteditable = contenteditable is not None and contenteditable.strip().lower() in ("", "true")
-        elem_type = "input" if is_input_tag or is_contenteditable else "clickable"
-        
-        elements.append({
-            "tag": tag,
-            "text": label,
-            "type": elem_type
-        })
-    
-    print(f"🔍 Найдено элементов: {len(elements)}")
-    result_queue.put({"result": elements})
-
-
-def _handle_click(args):
+def _backend(args):
+    """Движок извлечения: из args.backend или MCP_EXTRACTION_BACKEND (ValueError, если неизвестен)."""
+    return get_backend(args.get("backend") or config["extraction_backend"])
+
+
+async def _handle_wait_for_page_ready(session, args):
+    """Ждёт networkidle и первого интерактивного элемента; оба ожидания укладываются в args.timeout мс."""
+    timeout = float(args.get("timeout", 300_000))
+    print(f"⏳ Ожидание загрузки страницы (до {timeout / 1000:g} сек)...")
+    started = time.perf_counter()
+    try:
+        await session.page.wait_for_load_state("networkidle", timeout=timeout)
+        remaining = max(1.0, timeout - (time.perf_counter() - started) * 1000)
+        # Ждём тех же элементов, что потом вернёт getElements.
+        await session.page.wait_for_selector(_backend({}).ready_selector, state="visible", timeout=remaining)
+        return {"result": "Страница готова"}
+    except Exception as e:
+        return {"result": f"Частичная загрузка: {str(e)[:100]}"}
+
+
+async def _handle_wait_for_stable(session, args):
+    """Возвращается, как только затихли сеть, DOM и навигации, но не позже timeout мс."""
+    timeout = float(args.get("timeout", 10_000)) / 1000
+    quiet = float(args.get("quiet", 300)) / 1000
+    stable, elapsed = await wait_for_stable(session.activity, timeout, quiet)
+    elapsed_ms = int(elapsed * 1000)
+    if stable:
+        print(f"🧘 [{session.id}] Страница стабильна за {elapsed_ms} мс")
+        return {"result": f"Страница стабильна за {elapsed_ms} мс", "stable": True, "elapsed_ms": elapsed_ms}
+    print(f"⏱️ [{session.id}] Страница не успокоилась за {elapsed_ms} мс")
+    return {"result": f"Страница не успокоилась за {elapsed_ms} мс", "stable": False, "elapsed_ms": elapsed_ms}
+
+
+async def _handle_get_url(session):
+    current_url = session.page.url
+    print(f"🔗 [{session.id}] Текущий URL: {current_url}")
+    return {"result": current_url}
+
+
+async def _handle_get_elements(session, args):
+    """
+    Возвращает элементы страницы. С args.since (id прошлого снимка этой сессии)
+    вместо полного списка возвращает дифф относительно него, если снимок ещё помнится.
+    args.geometry добавляет к элементам положение на странице (y, in_viewport),
+    args.details — атрибуты для узнавания элемента (attrs).
+    args.format="columns" отдаёт списки элементов по столбцам (см. encoding.py).
+    С args.limit или args.cursor элементы отдаются постранично (см. _handle_get_elements_page).
+    args.backend выбирает движок извлечения (css, accessibility) вместо MCP_EXTRACTION_BACKEND.
+    """
+    try:
+        backend = _backend(args)
+    except ValueError as e:
+        return {"error": str(e)}
+    if args.get("limit") is not None or args.get("cursor"):
+        return await _handle_get_elements_page(session, args, backend)
+
+    snapshot_id = next(snapshot_ids)
+    elements, ids = await backend.snapshot(session.page, snapshot_id, geometry=bool(args.get("geometry")),
+                                           details=bool(args.get("details")))
+    print(f"🔍 [{session.id}] Найдено элементов: {len(elements)} (снимок {snapshot_id}, {backend.name})")
+
+    since = args.get("since")
+    columns = args.get("format") == "columns"
+    base = session.remember_snapshot(snapshot_id, ids, elements, since)
+    if base is None:
+        if columns:
+            return {"result": encode_columns(elements), "snapshot_id": snapshot_id, "diff": False,
+                    "format": "columns"}
+        return {"result": elements, "snapshot_id": snapshot_id, "diff": False}
+
+    diff = diff_elements(base[0], base[1], ids, elements, geometry=bool(args.get("geometry")))
+    print(f"🧮 [{session.id}] Дифф к снимку {since}: +{len(diff['added'])} "
+          f"~{len(diff['changed'])} -{len(diff['removed'])}")
+    response = {"result": diff, "snapshot_id": snapshot_id, "base_snapshot_id": since, "diff": True}
+    if columns:
+        diff["added"] = encode_columns(diff["added"])
+        diff["changed"] = encode_columns(diff["changed"])
+        if "moved" in diff:
+            diff["moved"] = encode_columns(diff["moved"])
+        response["format"] = "columns"
+    return response
+
+
+async def _handle_get_elements_page(session, args, backend):
+    """
+    Постраничный getElements: сначала элементы в окне, затем ниже сгиба сверху вниз.
+    Без cursor строит новый снимок и отдаёт первые limit элементов; next_cursor
+    ведёт к следующим limit элементам того же снимка (None — элементы кончились).
+    У каждого элемента есть index для click/type с тем же snapshot_id.
+    """
+    limit = max(1, int(args.get("limit") or ELEMENTS_PAGE_SIZE))
+    cursor = args.get("cursor")
+    if cursor:
+        try:
+            snapshot_id, offset = (int(part) for part in str(cursor).split(":"))
+        except ValueError:
+            return {"error": f"Неверный cursor: {cursor!r}"}
+    else:
+        snapshot_id, offset = next(snapshot_ids), None
+
+    page = await backend.snapshot_page(session.page, snapshot_id, offset, limit,
+                                       geometry=bool(args.get("geometry")), details=bool(args.get("details")))
+    if page is None:
+        return {"error": f"Курсор {cursor} устарел: снимок {snapshot_id} заменён. Вызовите getElements"}
+    elements, _, total = page
+    end = (offset or 0) + len(elements)
+    print(f"🔍 [{session.id}] Элементы {offset or 0}–{end} из {total} (снимок {snapshot_id})")
+
+    response = {"result": elements, "snapshot_id": snapshot_id, "diff": False, "total": total,
+                "next_cursor": f"{snapshot_id}:{end}" if end < total else None}
+    if args.get("format") == "columns":
+        response.update(result=encode_columns(elements), format="columns")
+    return response
+
+
+async def _resolve_target(session, args, index):
+    """
+    Находит элемент по индексу в снимке getElements.
+    Возвращает (ElementHandle, сведения) или (None, текст ошибки).
+    """
+    snapshot_id = args.get("snapshot_id")
+    if snapshot_id is not None:
+        snapshot_id = int(snapshot_id)
+    target, info = await resolve_snapshot_element(session.page, index, snapshot_id)
+    if info["status"] == "missing" and snapshot_id is None:
+        # Снимка ещё не было (или страница перезагрузилась) — строим его сами.
+        await _backend({}).snapshot(session.page, next(snapshot_ids))
+        target, info = await resolve_snapshot_element(session.page, index)
+
+    status = info["status"]
+    if status == "missing":
+        return None, f"Снимок {snapshot_id} устарел: страница перезагружена. Вызовите getElements"
+    if status == "mismatch":
+        return None, f"Снимок {snapshot_id} устарел, актуальный: {info['current']}. Вызовите getElements"
+    if status == "range":
+        return None, f"Индекс {index} вне диапазона. Доступно: {info['count']}"
+    if status == "detached":
+        return None, f"Элемент #{index} из снимка {info['snapshot_id']} исчез со страницы. Вызовите getElements"
+    if info["stale"]:
+        print(f"⚠️ Снимок {info['snapshot_id']} устарел: DOM менялся после getElements")
+    return target, info
+
+
+async def _handle_click(session, args):
     raw_index = args.get("index")
     try:
         index = int(raw_index)
         if index < 0:
             raise ValueError("index < 0")
     except (ValueError, TypeError):
-        result_queue.put({"error": f"Неверный index: {repr(raw_index)}"})
-        return
+        return {"error": f"Неверный index: {repr(raw_index)}"}
 
-    selectors = (
-        "button, a[href], [role='button'], "
-        "input:not([type='hidden']):not([type='button']):not([type='submit']), "
-        "textarea, [aria-label], div[contenteditable='true'], div[contenteditable='']"
-    )
-    all_elements = page.query_selector_all(selectors)
-    visible_elements = [el for el in all_elements if el.is_visible() and el.is_enabled()]
-    
-    if index >= len(visible_elements):
-        result_queue.put({"error": f"Индекс {index} вне диапазона. Доступно: {len(visible_elements)}"})
-        return
-    
-    target = visible_elements[index]
-    tag = target.evaluate("el => el.tagName.toLowerCase()")
-    is_input = tag in ("input", "textarea") or target.get_attribute("contenteditable") in ("", "true")
-    
-    if is_input:
-        result_queue.put({"error": f"Нельзя кликнуть по полю ввода #{index}"})
-        return
-    
-    print(f"🖱️ Клик по элементу #{index}")
-    target.click(timeout=30_000)
-    result_queue.put({"result": "Клик выполнен"})
+    target, info = await _resolve_target(session, args, index)
+    if target is None:
+        return {"error": info}
+
+    if info["is_input"]:
+        return {"error": f"Нельзя кликнуть по полю ввода #{index}"}
+
+    print(f"🖱️ [{session.id}] Клик по элементу #{index}")
+    await target.click(timeout=30_000)
+    return {"result": "Клик выполнен", "snapshot_id": info["snapshot_id"], "stale": info["stale"]}
 
 
-def _handle_type(args):
+async def _handle_type(session, args):
     raw_index = args.get("index")
     text = args.get("text", "")
     try:
@@ -193,77 +497,344 @@ def _handle_type(args):
         if index < 0:
             raise ValueError("index < 0")
     except (ValueError, TypeError):
-        result_queue.put({"error": f"Неверный index: {repr(raw_index)}"})
-        return
+        return {"error": f"Неверный index: {repr(raw_index)}"}
 
-    selectors = (
-        "button, a[href], [role='button'], "
-        "input:not([type='hidden']):not([type='button']):not([type='submit']), "
-        "textarea, [aria-label], div[contenteditable='true'], div[contenteditable='']"
-    )
-    all_elements = page.query_selector_all(selectors)
-    visible_elements = [el for el in all_elements if el.is_visible() and el.is_enabled()]
-    
-    if index >= len(visible_elements):
-        result_queue.put({"error": f"Индекс {index} вне диапазона. Доступно: {len(visible_elements)}"})
-        return
-    
-    target = visible_elements[index]
-    tag = target.evaluate("el => el.tagName.toLowerCase()")
-    is_input = tag in ("input", "textarea") or target.get_attribute("contenteditable") in ("", "true")
-    
-    if not is_input:
-        result_queue.put({"error": f"Элемент #{index} не является полем ввода"})
-        return
-    
-    print(f"⌨️ Ввод в элемент #{index}: '{text}'")
-    if target.get_attribute("contenteditable") in ("", "true"):
-        target.click()
-        page.keyboard.press("Control+A")
-        page.keyboard.press("Delete")
-        page.keyboard.type(text, delay=50)
+    target, info = await _resolve_target(session, args, index)
+    if target is None:
+        return {"error": info}
+
+    if not info["is_input"]:
+        return {"error": f"Элемент #{index} не является полем ввода"}
+
+    print(f"⌨️ [{session.id}] Ввод в элемент #{index}: '{text}'")
+    fast_input = config["input_mode"] == "fill"
+    if info["editable"]:
+        await target.click()
+        await session.page.keyboard.press("Control+A")
+        await session.page.keyboard.press("Delete")
+        if fast_input:
+            await session.page.keyboard.insert_text(text)
+        else:
+            await session.page.keyboard.type(text, delay=config["type_delay"])
+    elif fast_input:
+        await target.fill(text)
     else:
-        target.fill("")
-        target.type(text, delay=50)
-    
-    result_queue.put({"result": f"Введено: {text}"})
+        await target.fill("")
+        await target.type(text, delay=config["type_delay"])
+
+    return {"result": f"Введено: {text}", "snapshot_id": info["snapshot_id"], "stale": info["stale"]}
+
+
+async def _handle_batch(session, args):
+    """
+    Выполняет по порядку список NAVIGATE/CLICK/TYPE против одного снимка элементов.
+    Между действиями ждёт стабильности страницы, на первой ошибке останавливается.
+    """
+    actions = args.get("actions") or []
+    snapshot_id = args.get("snapshot_id")
+    settle = float(args.get("settle", 2_000)) / 1000
+
+    results = []
+    for i, item in enumerate(actions):
+        action = str(item.get("action", "")).upper()
+        action_args = dict(item.get("args") or {})
+        if action == "NAVIGATE":
+            result = await _handle_navigate(session, action_args)
+        elif action in ("CLICK", "TYPE"):
+            if snapshot_id is not None:
+                action_args.setdefault("snapshot_id", snapshot_id)
+            # Как и одиночные click/type: действие на текущей странице — фоновые вкладки не нужны.
+            await _discard_prefetch(session)
+            handler = _handle_click if action == "CLICK" else _handle_type
+            result = await handler(session, action_args)
+        else:
+            result = {"error": f"Неизвестное действие: {action}"}
+        results.append({"action": action, "args": item.get("args") or {}, **result})
+
+        if "error" in result:
+            print(f"⛔ [{session.id}] Пакет остановлен на действии #{i}: {result['error']}")
+            return {
+                "result": results,
+                "error": f"Пакет остановлен на действии #{i} ({action}): {result['error']}",
+            }
+        if i < len(actions) - 1:
+            await wait_for_stable(session.activity, settle, 0.2)
+
+    print(f"📦 [{session.id}] Пакет из {len(actions)} действий выполнен")
+    return {"result": results}
+
+
+async def _handle_save_storage_state(session, args):
+    """Сохраняет cookies и localStorage сессии в JSON для MCP_STORAGE_STATE."""
+    path = args.get("path") or config["storage_state"] or "storage_state.json"
+    await session.context.storage_state(path=path)
+    print(f"💾 [{session.id}] Состояние браузера сохранено в {path}")
+    return {"result": f"Состояние сохранено в {path}"}
+
+
+async def _handle_close_session(session):
+    if session.id == DEFAULT_SESSION:
+        return {"error": "Основную сессию закрыть нельзя"}
+    # Закрываем в фоне, чтобы ответ ушёл раньше, чем закроется контекст. Сессия сразу
+    # уходит из пула, а закрытие ждёт session.lock: команды, вставшие в очередь раньше,
+    # успеют выполниться, а дождавшиеся очереди после закрытия получат ошибку.
+    _spawn(pool.close(session.id))
+    return {"result": f"Сессия {session.id} закрыта"}
+
+
+def _spawn(coro):
+    """Запускает задачу в фоне и держит ссылку на неё, пока она не завершится."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 
 def _handle_quit():
-    """Обрабатывает команду завершения — просто отправляет подтверждение."""
+    """Обрабатывает команду завершения: останавливает сервер, браузер закроет lifespan."""
     print("🛑 Завершение браузера...")
-    result_queue.put({"result": "Браузер завершён"})
+    if server is not None:
+        server.should_exit = True
+    return {"result": "Браузер завершён"}
+
+
+def _handle_cancel(args):
+    task = inflight.get(args.get("id"))
+    if task is None:
+        return {"error": f"Запрос {args.get('id')} не выполняется"}
+    task.cancel()
+    return {"result": f"Запрос {args.get('id')} отменён"}
+
+
+async def _acquire_turn(session):
+    """Ждёт очереди сессии; освобождать session.lock должен вызывающий."""
+    session.waiting += 1
+    queued = time.perf_counter()
+    try:
+        await session.lock.acquire()
+    finally:
+        session.waiting -= 1
+    metrics.observe_lock_wait(time.perf_counter() - queued)
+
 
-def execute_in_browser(tool: str, args: dict = None):
-    """Отправляет команду и ждёт результат (до 300 сек)."""
+async def _run_in_session(session_id, tool, args):
+    """Выполняет команду в сессии; команды одной сессии идут строго по очереди."""
+    try:
+        session = await pool.get(session_id)
+    except RuntimeError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        print(f"💥 Не удалось открыть сессию '{session_id}': {e}")
+        return {"error": f"Не удалось открыть сессию {session_id}: {e}"}
+
+    await _acquire_turn(session)
+    try:
+        if session.closed:
+            return {"error": f"Сессия {session_id} закрыта"}
+        if session.crashed or session.page.is_closed():
+            await _recycle_session(session)
+        return await _dispatch(session, tool, args)
+    except Exception as e:
+        print(f"💥 Неожиданная ошибка в {tool}: {e}")
+        return {"error": f"Инструмент {tool} сломался: {e}"}
+    finally:
+        session.lock.release()
+
+
+async def execute_in_browser(tool: str, args: dict = None, session_id: str = DEFAULT_SESSION,
+                             request_id: str = None, deadline: float = None):
+    """Выполняет команду с ограничением по времени; её можно отменить по id."""
     if args is None:
         args = {}
-    command_queue.put({"tool": tool, "args": args})
+    request_id = request_id or uuid.uuid4().hex
+    deadline = deadline or DEFAULT_DEADLINE
+
+    if tool == "cancel":
+        return {**_handle_cancel(args), "id": request_id, "session": session_id}
+
+    task = asyncio.create_task(_run_in_session(session_id, tool, args))
+    inflight[request_id] = task
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(task, timeout=deadline)
+    except asyncio.TimeoutError:
+        result = {"error": f"Таймаут {deadline:g} сек"}
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        result = {"error": "Запрос отменён"}
+    finally:
+        inflight.pop(request_id, None)
+    elapsed = time.perf_counter() - started
+    metrics.observe_tool(tool if tool in TOOLS else "unknown", elapsed, "error" not in result)
+    return {**result, "id": request_id, "session": session_id, "server_ms": round(elapsed * 1000, 1)}
+
+
+async def _stream_elements(body: dict):
+    """
+    getElements строками NDJSON: страницы снимка по args.chunk элементов в порядке
+    «сначала видимые», каждая с index элементов, и итоговая строка {"done": true}.
+    Сессия занята, пока поток не закончится, поэтому снимок не меняется по ходу;
+    весь снимок потом помнится для диффов, как после обычного getElements.
+    Как и обычные вызовы, поток можно отменить по id (cancel), а каждое извлечение
+    ограничено оставшимся до deadline временем.
+    """
+    args = body.get("args") or {}
+    session_id = str(body.get("session") or DEFAULT_SESSION)
+    request_id = body.get("id") or uuid.uuid4().hex
+    deadline = float(body.get("deadline") or DEFAULT_DEADLINE)
+    chunk = max(1, int(args.get("chunk") or ELEMENTS_PAGE_SIZE))
+    started = time.perf_counter()
+
+    def line(payload):
+        payload = {**payload, "id": request_id, "session": session_id}
+        return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
     try:
-        return result_queue.get(timeout=300)
-    except queue.Empty:
-        return {"error": "Таймаут 300 сек"}
+        session = await pool.get(session_id)
+    except RuntimeError as e:
+        yield line({"error": str(e)})
+        return
+    except Exception as e:
+        print(f"💥 Не удалось открыть сессию '{session_id}': {e}")
+        yield line({"error": f"Не удалось открыть сессию {session_id}: {e}"})
+        return
+
+    await _acquire_turn(session)
+    ok = False
+    try:
+        if session.closed:
+            yield line({"error": f"Сессия {session_id} закрыта"})
+            return
+        if session.crashed or session.page.is_closed():
+            await _recycle_session(session)
+        backend = _backend(args)
+        snapshot_id, offset, collected = next(snapshot_ids), None, {}
+        while True:
+            remaining = deadline - (time.perf_counter() - started)
+            extraction = asyncio.create_task(backend.snapshot_page(session.page, snapshot_id, offset, chunk,
+                                                                   geometry=bool(args.get("geometry")),
+                                                                   details=bool(args.get("details"))))
+            inflight[request_id] = extraction
+            try:
+                page = await asyncio.wait_for(extraction, timeout=max(0.0, remaining))
+            except asyncio.TimeoutError:
+                yield line({"error": f"Таймаут {deadline:g} сек"})
+                return
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                yield line({"error": "Запрос отменён"})
+                return
+            if page is None:
+                yield line({"error": f"Снимок {snapshot_id} заменён во время выдачи"})
+                return
+            elements, ids, total = page
+            start = offset or 0
+            offset = start + len(elements)
+            collected.update((el["index"], (node_id, el)) for el, node_id in zip(elements, ids))
+            yield line({"result": elements, "snapshot_id": snapshot_id, "offset": start, "total": total})
+            if offset >= total:
+                break
+
+        order = sorted(collected)
+        session.remember_snapshot(snapshot_id, [collected[i][0] for i in order],
+                                  [{k: v for k, v in collected[i][1].items() if k != "index"} for i in order])
+        print(f"🔍 [{session.id}] Потоком отдано элементов: {total} (снимок {snapshot_id})")
+        ok = True
+        yield line({"done": True, "snapshot_id": snapshot_id, "total": total, "url": session.page.url,
+                    "server_ms": round((time.perf_counter() - started) * 1000, 1)})
+    except Exception as e:
+        print(f"💥 Неожиданная ошибка в потоке getElements: {e}")
+        yield line({"error": f"Инструмент getElements сломался: {e}"})
+    finally:
+        inflight.pop(request_id, None)
+        session.lock.release()
+        metrics.observe_tool("getElements_stream", time.perf_counter() - started, ok)
+
+
+async def _wait_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(0.5)
+
+
+async def _execute_call(body: dict):
+    tool = body.get("tool")
+    args = body.get("args", {})
+    session_id = str(body.get("session") or DEFAULT_SESSION)
+    deadline = body.get("deadline")
+    print(f"📥 MCP [{session_id}]: {tool} {args}")
+    return await execute_in_browser(
+        tool, args, session_id, body.get("id"), float(deadline) if deadline else None
+    )
+
+
+async def _execute_pipeline(calls: list):
+    """Вызовы одной сессии выполняются по порядку, разных сессий — параллельно."""
+    groups = {}
+    for position, body in enumerate(calls):
+        groups.setdefault(str(body.get("session") or DEFAULT_SESSION), []).append((position, body))
+
+    results = [None] * len(calls)
+
+    async def run_group(items):
+        for position, body in items:
+            results[position] = await _execute_call(body)
+
+    await asyncio.gather(*(run_group(items) for items in groups.values()))
+    return results
+
 
 @app.post("/mcp")
-def handle_mcp(request: dict):
-    """Обрабатывает MCP-запрос. Возвращает ТОЛЬКО то, что вернул браузер."""
-    tool = request.get("tool")
-    args = request.get("args", {})
-    print(f"📥 MCP: {tool} {args}")
-    return execute_in_browser(tool, args)
+async def handle_mcp(request: Request):
+    """
+    Обрабатывает MCP-запрос. Возвращает то, что вернул браузер,
+    плюс id запроса и сессию, чтобы клиент мог сверить ответ.
+    Тело может быть списком вызовов — тогда и ответ список в том же порядке;
+    ошибка одного вызова не останавливает остальные.
+    Если клиент отключился, не дождавшись ответа, команды отменяются.
+    Одиночный getElements с Accept: application/x-ndjson отдаётся потоком (_stream_elements).
+    """
+    body = await request.json()
+    pipelined = isinstance(body, list)
+    if not pipelined and body.get("tool") == "getElements" and NDJSON_TYPE in request.headers.get("accept", ""):
+        print(f"📥 MCP [{body.get('session') or DEFAULT_SESSION}]: getElements потоком {body.get('args', {})}")
+        return StreamingResponse(_stream_elements(body), media_type=NDJSON_TYPE)
+    calls = body if pipelined else [body]
+
+    call = asyncio.create_task(_execute_pipeline(calls))
+    watcher = asyncio.create_task(_wait_disconnect(request))
+    done, _ = await asyncio.wait({call, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    if call in done:
+        watcher.cancel()
+        results = call.result()
+        return pack_response(request.headers.get("accept"), results if pipelined else results[0])
+    call.cancel()
+    print(f"🔌 Клиент отключился — отменено вызовов: {len(calls)}")
+    return {"error": "Клиент отключился"}
+
+
+@app.get("/metrics")
+async def handle_metrics():
+    """Гистограммы задержек инструментов и глубина очередей в формате Prometheus."""
+    return PlainTextResponse(metrics.render({
+        "mcp_queue_depth": ("Команды, ждущие своей очереди в сессиях.", pool.depth()),
+        "mcp_inflight_requests": ("Выполняющиеся запросы.", len(inflight)),
+        "mcp_sessions_open": ("Открытые сессии.", len(pool.sessions)),
+        "mcp_warm_contexts": ("Прогретые контексты в пуле.", contexts.ready()),
+        "mcp_prefetch_tabs": ("Открытые фоновые вкладки prefetch.",
+                              sum(len(s.prefetched) for s in pool.sessions.values())),
+    }, counters={
+        "mcp_prefetch_hits_total": ("Переходы из фоновых вкладок с запуска.", prefetch_stats["hits"]),
+        "mcp_prefetch_discarded_total": ("Закрытые без пользы фоновые вкладки с запуска.",
+                                         prefetch_stats["discarded"]),
+        "mcp_recycled_contexts_total": ("Пересозданные контексты и вкладки с запуска.",
+                                        contexts.recycled + recycled_sessions),
+    }))
 
 
 if __name__ == "__main__":
     print("🖥️  Запуск MCP-сервера...")
-    browser_thread = threading.Thread(target=browser_worker, daemon=True)
-    browser_thread.start()
-    
-    for _ in range(60):
-        if page is not None:
-            break
-        time.sleep(0.5)
-    else:
-        print("⚠️  Браузер не запустился за 30 сек")
-    
-    print("✅ MCP-сервер готов на http://127.0.0.1:8000")
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="warning")
\ No newline at end of file
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=8000, log_level="warning"))
+    print("✅ MCP-сервер будет готов на http://127.0.0.1:8000 после запуска браузера")
+    server.run()
@@ -0,0 +1,95 @@
+"""
+Метрики MCP-сервера для эндпоинта /metrics в текстовом формате Prometheus.
+
+- mcp_tool_duration_seconds{tool}   — гистограмма времени вызова инструмента;
+- mcp_tool_errors_total{tool}       — вызовы, вернувшие error;
+- mcp_lock_wait_seconds             — гистограмма ожидания очереди сессии;
+- мгновенные значения (глубина очереди, число сессий) и счётчики с запуска
+  передаются при выдаче.
+
+Метку tool задаёт сервер из своего списка инструментов (неизвестные — "unknown"),
+так что число рядов ограничено; значения меток всё равно экранируются.
+"""
+import math
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+def label_value(value) -> str:
+    """Значение метки для текстового формата Prometheus: экранирует обратную косую, кавычку и перевод строки."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name: str, labels: str = "") -> list:
+        lines = []
+        cumulative = 0
+        sep = "," if labels else ""
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.tool_latency = {}
+        self.tool_errors = {}
+        self.lock_wait = Histogram()
+
+    def observe_tool(self, tool: str, seconds: float, ok: bool):
+        self.tool_latency.setdefault(tool, Histogram()).observe(seconds)
+        if not ok:
+            self.tool_errors[tool] = self.tool_errors.get(tool, 0) + 1
+
+    def observe_lock_wait(self, seconds: float):
+        self.lock_wait.observe(seconds)
+
+    def render(self, gauges: dict, counters: dict = None) -> str:
+        """
+        Текст для /metrics; gauges — {имя: (описание, значение)}, counters — то же
+        для растущих с запуска счётчиков (имя с суффиксом _total).
+        """
+        lines = [
+            "# HELP mcp_tool_duration_seconds Время выполнения инструмента.",
+            "# TYPE mcp_tool_duration_seconds histogram",
+        ]
+        for tool, histogram in sorted(self.tool_latency.items()):
+            lines += histogram.render("mcp_tool_duration_seconds", f'tool="{label_value(tool)}"')
+
+        lines += [
+            "# HELP mcp_tool_errors_total Вызовы инструмента, вернувшие ошибку.",
+            "# TYPE mcp_tool_errors_total counter",
+        ]
+        for tool in sorted(self.tool_latency):
+            lines.append(f'mcp_tool_errors_total{{tool="{label_value(tool)}"}} {self.tool_errors.get(tool, 0)}')
+
+        lines += [
+            "# HELP mcp_lock_wait_seconds Ожидание своей очереди в сессии.",
+            "# TYPE mcp_lock_wait_seconds histogram",
+        ]
+        lines += self.lock_wait.render("mcp_lock_wait_seconds")
+
+        for name, (description, value) in gauges.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+        for name, (description, value) in (counters or {}).items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
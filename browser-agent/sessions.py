@@ -0,0 +1,131 @@
+"""
+Сессии MCP-сервера: у каждой своя пара BrowserContext/страница и свой канал команд.
+
+Каналом служит asyncio.Lock сессии: команды одной сессии выполняются строго
+по очереди, а разные сессии работают с общим браузером параллельно.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+DEFAULT_SESSION = "default"
+
+# Сколько последних снимков getElements держать для диффов.
+SNAPSHOT_HISTORY = 4
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.context = None
+        self.page = None
+        self.activity = None
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.last_used = time.monotonic()
+        self.snapshots = OrderedDict()
+        # Вкладка упала (событие crash) — контекст пересоздаётся перед следующей командой.
+        self.crashed = False
+        # Фоновые вкладки инструмента prefetch: url -> {"task", "started"}.
+        self.prefetched = {}
+        # Открытие контекста (задача) — его ждут все, кто получил сессию до конца открытия.
+        self.opening = None
+        # Сессия закрыта и убрана из пула — команды, ждавшие её очереди, не выполняются.
+        self.closed = False
+
+    def remember_snapshot(self, snapshot_id, ids, elements, base_id=None):
+        """
+        Сохраняет снимок и возвращает (ids, elements) снимка base_id,
+        если он ещё есть в истории сессии, иначе None.
+        """
+        base = self.snapshots.get(int(base_id)) if base_id is not None else None
+        self.snapshots[snapshot_id] = (ids, elements)
+        while len(self.snapshots) > SNAPSHOT_HISTORY:
+            self.snapshots.popitem(last=False)
+        return base
+
+    @property
+    def is_open(self) -> bool:
+        return self.page is not None
+
+
+class SessionPool:
+    """Ограниченный набор сессий. Контексты создаёт переданная фабрика open_session."""
+
+    def __init__(self, max_sessions: int, idle_timeout: float, open_session, close_session):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self._open_session = open_session
+        self._close_session = close_session
+        self._lock = asyncio.Lock()
+
+    async def get(self, session_id: str) -> Session:
+        """
+        Возвращает открытую сессию, при необходимости создаёт её.
+        Если пул заполнен — бросает RuntimeError. Место в пуле занимается под
+        блокировкой, а контекст открывается уже без неё, чтобы медленное открытие
+        одной сессии не задерживало остальные. Ошибку открытия пробрасывает.
+        """
+        async with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    raise RuntimeError(f"Пул сессий заполнен ({self.max_sessions})")
+                session = Session(session_id)
+                session.opening = asyncio.ensure_future(self._open_session(session))
+                self.sessions[session_id] = session
+            session.last_used = time.monotonic()
+        try:
+            # shield: отмена одного ждущего запроса не обрывает открытие для остальных.
+            await asyncio.shield(session.opening)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            async with self._lock:
+                if self.sessions.get(session_id) is session:
+                    del self.sessions[session_id]
+            raise
+        return session
+
+    async def close(self, session_id: str):
+        """Убирает сессию из пула и закрывает её, дождавшись команды, которая сейчас выполняется."""
+        async with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            await self._close(session)
+
+    async def _close(self, session: Session):
+        try:
+            await session.opening
+        except Exception:
+            return
+        async with session.lock:
+            session.closed = True
+            await self._close_session(session)
+
+    async def close_idle(self):
+        """Закрывает сессии без запросов дольше idle_timeout (кроме основной)."""
+        now = time.monotonic()
+        async with self._lock:
+            idle = [
+                s for s in self.sessions.values()
+                if s.id != DEFAULT_SESSION and not s.lock.locked() and s.waiting == 0
+                and now - s.last_used > self.idle_timeout
+            ]
+            for s in idle:
+                del self.sessions[s.id]
+        for s in idle:
+            print(f"💤 Сессия '{s.id}' простаивает — закрываю")
+            await self._close(s)
+
+    async def close_all(self):
+        async with self._lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for s in sessions:
+            await self._close(s)
+
+    def depth(self) -> int:
+        """Сколько команд ждут своей очереди во всех сессиях."""
+        return sum(s.waiting for s in self.sessions.values())
@@ -0,0 +1,79 @@
+"""
+Определение момента, когда страница «успокоилась».
+
+Страница считается стабильной, когда одновременно выполнено:
+- нет незавершённых сетевых запросов (кроме долгоживущих: long polling, стримы);
+- DOM не менялся последние quiet мс (MutationObserver в странице);
+- за те же quiet мс не было навигаций основного фрейма.
+"""
+import asyncio
+import time
+
+# Запросы, висящие дольше этого срока, считаем фоновыми и не ждём.
+BACKGROUND_REQUEST_SEC = 5.0
+IGNORED_RESOURCE_TYPES = ("websocket", "eventsource")
+
+# Сколько мс прошло с последней мутации DOM; при первом вызове ставит наблюдатель.
+DOM_IDLE_JS = r"""() => {
+    if (!window.__mcpSettle) {
+        window.__mcpSettle = {last: performance.now()};
+        new MutationObserver(() => { window.__mcpSettle.last = performance.now(); })
+            .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    }
+    return performance.now() - window.__mcpSettle.last;
+}"""
+
+
+class PageActivity:
+    """Следит за сетью и навигациями страницы через события Playwright."""
+
+    def __init__(self, page):
+        self.page = page
+        self.inflight = {}
+        now = time.monotonic()
+        self.last_network = now
+        self.last_navigation = now
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_request_done)
+        page.on("requestfailed", self._on_request_done)
+        page.on("framenavigated", self._on_navigated)
+
+    def _on_request(self, request):
+        if request.resource_type in IGNORED_RESOURCE_TYPES:
+            return
+        self.inflight[request] = time.monotonic()
+        self.last_network = time.monotonic()
+
+    def _on_request_done(self, request):
+        if self.inflight.pop(request, None) is not None:
+            self.last_network = time.monotonic()
+
+    def _on_navigated(self, frame):
+        if frame == self.page.main_frame:
+            self.last_navigation = time.monotonic()
+
+    def pending_requests(self) -> int:
+        now = time.monotonic()
+        return sum(1 for started in self.inflight.values() if now - started < BACKGROUND_REQUEST_SEC)
+
+
+async def wait_for_stable(activity: PageActivity, timeout: float, quiet: float, poll: float = 0.05):
+    """
+    Ждёт стабильности страницы не дольше timeout секунд.
+    Возвращает (стабильна ли, сколько секунд ждали).
+    """
+    start = time.monotonic()
+    while True:
+        now = time.monotonic()
+        network_quiet = activity.pending_requests() == 0 and now - activity.last_network >= quiet
+        if network_quiet and now - activity.last_navigation >= quiet:
+            try:
+                dom_idle_ms = await activity.page.evaluate(DOM_IDLE_JS)
+            except Exception:
+                # Контекст страницы пересоздаётся — значит, идёт навигация.
+                dom_idle_ms = 0
+            if dom_idle_ms >= quiet * 1000:
+                return True, time.monotonic() - start
+        if now - start >= timeout:
+            return False, now - start
+        await asyncio.sleep(poll)
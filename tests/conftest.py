@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Тесты импортируют agents.* из корня репозитория, как agent.py и бенчмарки.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
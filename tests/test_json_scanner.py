@@ -0,0 +1,46 @@
+"""Потоковый разбор ответа LLM: JsonObjectScanner и extract_json."""
+from agents.llm_client import JsonObjectScanner, extract_json
+
+
+def is_plan(data):
+    return "options" in data or "is_done" in data
+
+
+def feed_by_chars(scanner, text):
+    for ch in text:
+        result = scanner.feed(ch)
+        if result is not None:
+            return result
+    return None
+
+
+def test_rejected_object_is_skipped_and_scan_continues():
+    text = 'Рассуждаю: кликну {"index": 3}. Ответ: {"is_done": false, "options": [{"action": "CLICK", "args": {"index": 3}}]}'
+    result = feed_by_chars(JsonObjectScanner(is_plan), text)
+    assert result == {"is_done": False, "options": [{"action": "CLICK", "args": {"index": 3}}]}
+
+
+def test_without_accept_first_object_wins():
+    text = 'кликну {"index": 3}, затем {"is_done": true}'
+    assert feed_by_chars(JsonObjectScanner(), text) == {"index": 3}
+
+
+def test_nested_objects_of_rejected_candidate_are_not_rescanned():
+    # Вложенный {"is_done": true} — часть отвергнутого объекта, а не самостоятельный ответ.
+    text = '{"quote": {"is_done": true}} {"is_done": false, "options": []}'
+    assert extract_json(text, lambda data: "quote" not in data and is_plan(data)) == {"is_done": False, "options": []}
+
+
+def test_think_block_is_skipped():
+    text = '<think>может быть {"is_done": true}?</think>{"is_done": false, "options": [{"action": "NAVIGATE"}]}'
+    result = feed_by_chars(JsonObjectScanner(is_plan), text)
+    assert result == {"is_done": False, "options": [{"action": "NAVIGATE"}]}
+
+
+def test_braces_inside_strings_do_not_break_scan():
+    text = '{"thought": "фигурная } скобка {", "is_done": true}'
+    assert extract_json(text, is_plan) == {"thought": "фигурная } скобка {", "is_done": True}
+
+
+def test_nothing_acceptable_returns_none():
+    assert extract_json('{"index": 3} {"index": 4}', is_plan) is None
@@ -0,0 +1,39 @@
+"""Локальный выбор варианта исполнителем (OptionRanker)."""
+from agents.ranker import OptionRanker
+
+ELEMENTS = [
+    {"type": "input", "text": "Поиск"},
+    {"type": "clickable", "text": "Войти"},
+    {"type": "clickable", "text": "Корзина"},
+]
+
+
+def test_prior_alone_does_not_win_without_goal_overlap():
+    # TYPE сильнее NAVIGATE только априорным весом; ни одно слово цели не совпало.
+    options = [
+        {"action": "TYPE", "args": {"index": 0, "text": "abc"}},
+        {"action": "NAVIGATE", "args": {"url": "https://example.com/xyz"}},
+    ]
+    assert OptionRanker(0.75).pick(options, "оформить подписку", "https://example.com", ELEMENTS) is None
+
+
+def test_clear_goal_match_is_picked_locally():
+    options = [
+        {"action": "CLICK", "args": {"index": 1}},
+        {"action": "CLICK", "args": {"index": 2}},
+    ]
+    decision = OptionRanker(0.75).pick(options, "открыть корзину", "https://example.com", ELEMENTS)
+    assert decision is not None
+    assert decision[0] == 1
+
+
+def test_identical_options_need_no_llm():
+    options = [{"action": "CLICK", "args": {"index": 1}}] * 2
+    assert OptionRanker(0.75).pick(options, "что угодно", "https://example.com", ELEMENTS)[0] == 0
+
+
+def test_invalid_targets_score_zero_overlap():
+    ranker = OptionRanker(0.75)
+    # Кликнуть по полю ввода или по несуществующему индексу нельзя.
+    assert ranker.score({"action": "CLICK", "args": {"index": 0}}, {"поиск"}, "", ELEMENTS)[1] == 0.0
+    assert ranker.score({"action": "CLICK", "args": {"index": 9}}, {"поиск"}, "", ELEMENTS)[1] == 0.0
@@ -0,0 +1,50 @@
+"""Терпимый разбор и починка ответов LLM по схемам (agents/schemas.py)."""
+from agents.schemas import parse_lenient, repair_choice, repair_plan
+
+
+def test_empty_object_is_not_a_plan():
+    plan, problems = repair_plan({}, element_count=5)
+    assert plan is None
+    assert problems
+
+
+def test_stray_index_object_is_not_a_plan():
+    plan, _ = repair_plan({"index": 3}, element_count=5)
+    assert plan is None
+
+
+def test_null_fields_count_as_missing():
+    plan, problems = repair_plan({"thought": None, "is_done": True, "final_result": None}, element_count=5)
+    assert plan is not None
+    assert plan["thought"] == ""
+    assert "final_result" not in plan
+    assert problems == []
+
+
+def test_trailing_comma_and_string_index_are_repaired():
+    data = parse_lenient('```json\n{"is_done": false, "options": [{"action": "click", "args": {"index": "2"}},],}\n```')
+    plan, problems = repair_plan(data, element_count=5)
+    assert plan["options"] == [{"action": "CLICK", "args": {"index": 2}}]
+    assert problems == []
+
+
+def test_out_of_range_index_drops_option():
+    data = {"options": [{"action": "CLICK", "args": {"index": 7}}, {"action": "CLICK", "args": {"index": 1}}]}
+    plan, problems = repair_plan(data, element_count=5)
+    assert plan["options"] == [{"action": "CLICK", "args": {"index": 1}}]
+    assert problems
+
+
+def test_plan_with_only_bad_options_is_rejected():
+    plan, _ = repair_plan({"options": [{"action": "CLICK", "args": {"index": 7}}]}, element_count=5)
+    assert plan is None
+
+
+def test_choice_out_of_range_is_rejected():
+    assert repair_choice({"chosen_index": "1"}, option_count=2)[0] == {"chosen_index": 1, "reason": ""}
+    assert repair_choice({"chosen_index": 2}, option_count=2)[0] is None
+
+
+def test_parse_lenient_skips_think_block_and_python_literals():
+    text = "<think>{'is_done': True}</think> {'is_done': False, 'options': [], 'thought': None}"
+    assert parse_lenient(text) == {"is_done": False, "options": [], "thought": None}